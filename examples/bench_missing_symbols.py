@@ -0,0 +1,44 @@
+
+# Measures what a FilterExpression costs when the record it is matched
+# against lacks the fields the expression uses (the "miss" path). Every miss
+# used to format a debug message containing repr() of the whole record even
+# when the debug logger threw it away. The "before" timings use a logger
+# which throws messages away but claims to be enabled, which makes the
+# FilterExpression format them the way it used to.
+
+import timeit
+
+from hdslfilter.filter import FilterExpression
+from hdslfilter import debug
+
+class DiscardingDebugLogger(debug.NullDebugLogger):
+	enabled = True
+
+expression = 'nickname == "Jo" or location.zip =~ /^9/ or snort.src_addr == "1.2.3.4"'
+
+# a largish record, none of the fields above are in it
+record = {
+	'name': 'John Doe',
+	'age': 133,
+	'location': {
+		'city': 'Ono',
+		'country': 'US'
+	},
+	'message': 'sshd[1234]: Accepted publickey for john from 10.1.2.3 port 22 ' * 8,
+	'fields': dict([('field%d' % i, 'value %d' % i) for i in range(50)])
+}
+
+count = 20000
+
+for engine in FilterExpression.engines:
+	before = FilterExpression.from_string(expression, engine=engine)
+	before._logger = DiscardingDebugLogger()
+	before._debug = True
+	after = FilterExpression.from_string(expression, engine=engine)
+
+	t_before = timeit.timeit(lambda: before.match(record), number=count)
+	t_after = timeit.timeit(lambda: after.match(record), number=count)
+
+	print '%s engine, %d matches against a record missing every field:' % (engine, count)
+	print '  before: %.3fs (%.1fus per match)' % (t_before, t_before/count*1e6)
+	print '  after:  %.3fs (%.1fus per match)' % (t_after, t_after/count*1e6)
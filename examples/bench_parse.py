@@ -0,0 +1,47 @@
+# Measures how building a filter scales with the number of clauses in it,
+# for the long chains of "or"s which filters generated from inventories tend
+# to be, at python's default recursion limit.
+#
+# parse.parse builds the tree in a single pass (parse.Parser);
+# parse.parse_in_stages is how every expression used to be parsed, and how
+# parse still handles input Parser doesn't accept (ie, input with errors).
+# Its time used to grow with the square of the number of clauses; "error" is
+# how long building a FilterExpression takes to fail when the last clause
+# has a syntax error, which goes through both. The other columns are the
+# whole of building a FilterExpression with each engine, and a Sieve, from
+# the source, and matching a record which only the last clause matches.
+
+import time
+
+from hdslfilter import tokenize
+from hdslfilter import parse
+from hdslfilter import errors
+from hdslfilter.filter import FilterExpression, Sieve
+
+clause = '(host.name == "web%d" and program =~ /^sshd/)'
+
+def timed(function):
+	start = time.time()
+	function()
+	return '%.3fs' % (time.time() - start)
+
+def fails(src):
+	try:
+		FilterExpression.from_string(src)
+	except errors.UserError:
+		pass
+
+for count in (10, 100, 1000, 10000, 100000):
+	src = ' or '.join([clause % i for i in range(count)])
+	tokens = tokenize.tokenize(src)[0]
+	record = {'host': {'name': 'web%d' % (count-1)}, 'program': 'sshd'}
+
+	t_single = timed(lambda: parse.parse(list(tokens)))
+	t_stages = timed(lambda: parse.parse_in_stages(list(tokens)))
+	t_error = timed(lambda: fails(src + ' or not not z == 1'))
+	t_eval = timed(lambda: FilterExpression.from_string(src).match(record))
+	t_closure = timed(lambda: FilterExpression.from_string(src, engine='closure').match(record))
+	t_sieve = timed(lambda: Sieve.from_str(src).match(record))
+
+	print '%6d clauses: parse %s, in stages %s, error %s; eval engine %s, closure engine %s, sieve %s' % (
+		count, t_single, t_stages, t_error, t_eval, t_closure, t_sieve)
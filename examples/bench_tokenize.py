@@ -0,0 +1,36 @@
+# Measures how tokenizing a sieve scales with its size. The "slicing" timings
+# tokenize the way the tokenizer used to, with get_token, which returns the
+# rest of the input after each token as a new string, so the time taken
+# grows with the square of the input's size. tokenize() works along the
+# input by position instead, and its time grows linearly.
+
+import time
+
+from hdslfilter import tokenize
+
+rule = '(program == "sshd" or program == "login") and msg =~ /failed password for \\w+/ and host.name not in ["bastion1" "bastion2"]; # rule %d\n'
+
+def tokenize_by_slicing(src):
+	tokenizer = tokenize.Tokenizer()
+	tokens = []
+	while src:
+		(src, token) = tokenizer.get_token(src)
+		if token is not None:
+			tokens.append(token)
+	return tokens
+
+for count in (100, 1000, 10000, 40000):
+	src = ''.join([rule % i for i in range(count)])
+
+	start = time.time()
+	tokenize.tokenize(src)
+	t_linear = time.time() - start
+
+	if count <= 10000:
+		start = time.time()
+		tokenize_by_slicing(src)
+		t_slicing = '%.3fs' % (time.time() - start)
+	else:
+		t_slicing = '(too slow)'
+
+	print '%6d rules, %8d bytes: tokenize %.3fs, slicing %s' % (count, len(src), t_linear, t_slicing)
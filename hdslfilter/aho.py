@@ -0,0 +1,75 @@
+
+#####################################################################################
+#####################################################################################
+## An Aho-Corasick automaton, which finds which of many literal strings occur
+## in a string in one pass over it.
+#####################################################################################
+#####################################################################################
+
+class Automaton(object):
+
+	"""Finds every one of a list of literal strings (the "keywords") which
+	occurs anywhere in a string, in time proportional to the length of the
+	string however many keywords there are. The automaton is built as a
+	DFA: each state maps only the characters which lead somewhere other
+	than the start state, with failure transitions already followed, so
+	scanning costs one dict lookup per character."""
+
+	def __init__(self, keywords):
+		self._keywords = list(keywords)
+
+		# the trie of keywords. State 0 is the start state.
+		goto = [{}]
+		# maps states to the numbers of the keywords ending there
+		output = [[]]
+		for (number, keyword) in enumerate(self._keywords):
+			if len(keyword)==0:
+				raise ValueError('keywords must not be empty')
+			state = 0
+			for char in keyword:
+				if char not in goto[state]:
+					goto.append({})
+					output.append([])
+					goto[state][char] = len(goto)-1
+				state = goto[state][char]
+			output[state].append(number)
+
+		# breadth first, so that a state's failure state (which is always
+		# shallower) is finished before the state is
+		fail = [0] * len(goto)
+		delta = [None] * len(goto)
+		queue = [0]
+		head = 0
+		while head < len(queue):
+			state = queue[head]
+			head += 1
+			if state==0:
+				delta[state] = dict(goto[state])
+			else:
+				delta[state] = dict(delta[fail[state]])
+				delta[state].update(goto[state])
+			for (char, child) in goto[state].iteritems():
+				if state!=0:
+					fail[child] = delta[fail[state]].get(char, 0)
+				output[child] = output[child] + output[fail[child]]
+				queue.append(child)
+
+		self._delta = delta
+		self._output = [tuple(numbers) for numbers in output]
+
+	def keywords(self):
+		return list(self._keywords)
+
+	def find(self, string):
+		"""Return the set of numbers (positions in the keywords list given
+		to the constructor) of the keywords which occur in string."""
+
+		delta = self._delta
+		output = self._output
+		found = set()
+		state = 0
+		for char in string:
+			state = delta[state].get(char, 0)
+			if output[state]:
+				found.update(output[state])
+		return found
@@ -0,0 +1,235 @@
+
+import threading
+import weakref
+
+import literalregex
+
+#####################################################################################
+#####################################################################################
+## Bounded caches, including the regex store every expression gets its
+## regexes from.
+#####################################################################################
+#####################################################################################
+
+# returned by LRUCache.get for keys which aren't in the cache, when no other
+# default is given (None may well be a cached value)
+missing = object()
+
+class LRUCache(object):
+	"""Maps keys to values, holding at most size of them: when it's full,
+	putting a new one in evicts the least recently used. Counts hits (gets
+	of keys in the cache), misses (gets of keys which aren't) and
+	evictions."""
+
+	def __init__(self, size):
+		if size < 1:
+			raise ValueError('cache size must be at least 1, got %s' % repr(size))
+		self.size = size
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		# maps keys to [previous, next, key, value] links of a circular
+		# list running from the least recently used to the most
+		self._links = {}
+		self._root = []
+		self._root[:] = [self._root, self._root, None, None]
+
+	def _use(self, link):
+		"""Move link to the most recently used end of the list."""
+		root = self._root
+		(previous, following) = (link[0], link[1])
+		previous[1] = following
+		following[0] = previous
+		last = root[0]
+		link[0] = last
+		link[1] = root
+		last[1] = link
+		root[0] = link
+
+	def get(self, key, default=missing):
+		"""Return the value for key, or default if it isn't cached."""
+		link = self._links.get(key)
+		if link is None:
+			self.misses += 1
+			return default
+		self.hits += 1
+		self._use(link)
+		return link[3]
+
+	def put(self, key, value):
+		"""Cache value for key, evicting the least recently used value if
+		the cache is full."""
+		link = self._links.get(key)
+		if link is not None:
+			link[3] = value
+			self._use(link)
+			return
+		if len(self._links) >= self.size:
+			self._evict()
+		root = self._root
+		last = root[0]
+		link = [last, root, key, value]
+		last[1] = link
+		root[0] = link
+		self._links[key] = link
+
+	def _evict(self):
+		"""Evict the least recently used value, returning its key."""
+		oldest = self._root[1]
+		oldest[0][1] = oldest[1]
+		oldest[1][0] = oldest[0]
+		del self._links[oldest[2]]
+		self.evictions += 1
+		return oldest[2]
+
+	def clear(self):
+		"""Empty the cache. The counts are kept."""
+		self._links = {}
+		self._root[:] = [self._root, self._root, None, None]
+
+	def __len__(self):
+		return len(self._links)
+
+	def __contains__(self, key):
+		return key in self._links
+
+	def stats(self):
+		"""Return a dict of the counts, the size, and how many values are
+		cached."""
+		return {
+			'hits': self.hits,
+			'misses': self.misses,
+			'evictions': self.evictions,
+			'size': self.size,
+			'length': len(self._links) }
+
+class SynchronizedLRUCache(LRUCache):
+	"""An LRUCache which can be shared between threads."""
+
+	def __init__(self, size):
+		LRUCache.__init__(self, size)
+		self._lock = threading.Lock()
+
+	def get(self, key, default=missing):
+		self._lock.acquire()
+		try:
+			return LRUCache.get(self, key, default)
+		finally:
+			self._lock.release()
+
+	def put(self, key, value):
+		self._lock.acquire()
+		try:
+			LRUCache.put(self, key, value)
+		finally:
+			self._lock.release()
+
+	def clear(self):
+		self._lock.acquire()
+		try:
+			LRUCache.clear(self)
+		finally:
+			self._lock.release()
+
+	def stats(self):
+		self._lock.acquire()
+		try:
+			return LRUCache.stats(self)
+		finally:
+			self._lock.release()
+
+class RegexStore(SynchronizedLRUCache):
+	"""Holds the searchers (see literalregex.searcher) for regexes, so that
+	a regex which appears in many expressions, or is used by every stage of
+	building a Sieve (the tokenizer, the expressions, the RegexSets), is
+	only compiled once.
+
+	Searchers which are still in use (by a parse tree's token, an
+	expression or a RegexSet) are found through weak references, however
+	many of them there are, so a regex is compiled again only if nothing
+	has used it since it was evicted. Of the others, the most recently
+	used are kept, up to size of them and max_bytes of pattern source (a
+	rough measure of the memory their compiled forms take)."""
+
+	def __init__(self, size, max_bytes=1<<20):
+		SynchronizedLRUCache.__init__(self, size)
+		if max_bytes < 1:
+			raise ValueError('max_bytes must be at least 1, got %s' % repr(max_bytes))
+		self.max_bytes = max_bytes
+		# the total length of the patterns held
+		self.bytes = 0
+		# how many times a pattern has been compiled
+		self.compiles = 0
+		# maps patterns to their searchers while anything uses them
+		self._live = weakref.WeakValueDictionary()
+
+	def get(self, pattern, default=missing):
+		self._lock.acquire()
+		try:
+			if pattern not in self._links:
+				search = self._live.get(pattern)
+				if search is not None:
+					# evicted, but still in use: it's held again
+					self._put(pattern, search)
+			return LRUCache.get(self, pattern, default)
+		finally:
+			self._lock.release()
+
+	def put(self, pattern, search):
+		self._lock.acquire()
+		try:
+			self._put(pattern, search)
+		finally:
+			self._lock.release()
+
+	def _put(self, pattern, search):
+		if pattern not in self._links:
+			self.bytes += len(pattern)
+		LRUCache.put(self, pattern, search)
+		self._live[pattern] = search
+		while self.bytes > self.max_bytes and len(self._links) > 1:
+			self._evict()
+
+	def _evict(self):
+		pattern = LRUCache._evict(self)
+		self.bytes -= len(pattern)
+		return pattern
+
+	def clear(self):
+		self._lock.acquire()
+		try:
+			LRUCache.clear(self)
+			self.bytes = 0
+			self._live = weakref.WeakValueDictionary()
+		finally:
+			self._lock.release()
+
+	def stats(self):
+		self._lock.acquire()
+		try:
+			stats = LRUCache.stats(self)
+			stats['compiles'] = self.compiles
+			stats['bytes'] = self.bytes
+			stats['max_bytes'] = self.max_bytes
+			return stats
+		finally:
+			self._lock.release()
+
+	def searcher(self, pattern):
+		"""Return the searcher for the regex pattern (a string), compiling
+		it if it isn't in the store. Raises re.error if it doesn't
+		compile."""
+		search = self.get(pattern)
+		if search is missing:
+			search = literalregex.searcher(pattern)
+			self._lock.acquire()
+			try:
+				self.compiles += 1
+				self._put(pattern, search)
+			finally:
+				self._lock.release()
+		return search
+
+# the process-wide RegexStore. Replace it with a larger RegexStore to keep
+# more regexes which aren't in use compiled.
+regexes = RegexStore(1024)
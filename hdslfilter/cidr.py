@@ -0,0 +1,159 @@
+
+import socket
+import binascii
+
+#####################################################################################
+#####################################################################################
+## IPv4 and IPv6 network membership, for the "in cidr" operator. Networks are
+## kept in a binary radix trie keyed on the bits of the network address, so
+## looking an address up costs one step per bit of the longest prefix in the
+## trie however many networks are in it.
+#####################################################################################
+#####################################################################################
+
+families = {
+	4: (socket.AF_INET, 32),
+	6: (socket.AF_INET6, 128) }
+
+def parse_address(s):
+	"""Given a string containing an IPv4 or IPv6 address, return a
+	(version, address) tuple where version is 4 or 6 and address is the
+	address as an integer. Returns None if s isn't an address."""
+
+	if not isinstance(s, basestring):
+		return None
+	if ':' in s:
+		version = 6
+	else:
+		version = 4
+	try:
+		packed = socket.inet_pton(families[version][0], s)
+	except (socket.error, ValueError, UnicodeError):
+		return None
+	return (version, int(binascii.hexlify(packed), 16))
+
+def parse_network(s):
+	"""Given a string containing a network in CIDR notation (ie,
+	"10.0.0.0/8" or "2001:db8::/32") or a single address, return a
+	(version, address, prefix length) tuple. Host bits set in the address
+	are ignored. Raises ValueError if s isn't a network."""
+
+	if '/' in s:
+		(address, length) = s.split('/', 1)
+		if not length.isdigit():
+			raise ValueError('invalid prefix length in network %s' % repr(s))
+		length = int(length)
+	else:
+		address = s
+		length = None
+
+	parsed = parse_address(address)
+	if parsed is None:
+		raise ValueError('invalid address in network %s' % repr(s))
+	(version, address) = parsed
+
+	width = families[version][1]
+	if length is None:
+		length = width
+	if length > width:
+		raise ValueError('prefix length too long in network %s' % repr(s))
+
+	mask = ((1 << length) - 1) << (width - length)
+	return (version, address & mask, length)
+
+class RadixTrie(object):
+
+	"""A binary trie of IPv4 and IPv6 networks, each network tagged with
+	any number of values. lookup() returns the tags of every network
+	containing an address. Each node is a [zero child, one child, tags]
+	list."""
+
+	def __init__(self):
+		# version -> [root node, length of the longest prefix]
+		self._roots = {4: [[None, None, ()], 0], 6: [[None, None, ()], 0]}
+
+	def add(self, network, tag):
+		"""Add network (a string, see parse_network) tagged with tag. Raises
+		ValueError if network isn't valid."""
+
+		(version, address, length) = parse_network(network)
+		width = families[version][1]
+		root = self._roots[version]
+		node = root[0]
+		for i in range(length):
+			bit = (address >> (width - 1 - i)) & 1
+			if node[bit] is None:
+				node[bit] = [None, None, ()]
+			node = node[bit]
+		if tag not in node[2]:
+			node[2] = node[2] + (tag,)
+		root[1] = max(root[1], length)
+
+	def lookup(self, address):
+		"""Given an address as a string, return a set of the tags of all
+		networks which contain it. Returns an empty set if the address
+		isn't valid."""
+
+		found = set()
+		parsed = parse_address(address)
+		if parsed is None:
+			return found
+		(version, address) = parsed
+
+		width = families[version][1]
+		(node, depth) = self._roots[version]
+		found.update(node[2])
+		shift = width - 1
+		for i in range(depth):
+			node = node[(address >> shift) & 1]
+			if node is None:
+				break
+			found.update(node[2])
+			shift -= 1
+		return found
+
+	def contains(self, address):
+		"""Return True if address (a string) is in any network in the
+		trie."""
+		return len(self.lookup(address)) > 0
+
+class NetworkSet(object):
+
+	"""All of the lists of networks which a Sieve checks one symbol against
+	with "in cidr", in one RadixTrie with each network tagged with the
+	numbers of the lists it's in. Each record's value for the symbol is
+	looked up once for all of the lists."""
+
+	def __init__(self):
+		self._trie = RadixTrie()
+		# maps tuples of networks to list numbers
+		self._numbers = {}
+
+	def add(self, networks):
+		"""Add a list of networks (strings) if it isn't already in the set
+		and return its number."""
+		key = tuple(networks)
+		if key not in self._numbers:
+			number = len(self._numbers)
+			for network in networks:
+				self._trie.add(network, number)
+			self._numbers[key] = number
+		return self._numbers[key]
+
+	def matcher(self, symbol, networks, negated=False):
+		"""Return a closure (see parse.Expression.closure) which evaluates
+		"symbol in cidr [networks]" (or "not in cidr" if negated). The
+		lookup of the symbol's value is kept in the symbol table's memo so
+		it happens once per record however many expressions use it."""
+
+		number = self.add(networks)
+		key = (self, symbol)
+		radix_trie = self._trie
+		def match(s):
+			memo = s.memo
+			if key in memo:
+				found = memo[key]
+			else:
+				found = memo[key] = radix_trie.lookup(s[symbol])
+			return (number in found) != negated
+		return match
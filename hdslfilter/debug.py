@@ -1,11 +1,29 @@
 
 class StdoutDebugLogger(object):
+	# messages given to this logger go somewhere, so callers should bother
+	# formatting them (see enabled())
+	enabled = True
+
 	def debug(self, s):
 		print 'DEBUG:',s
 
+	def write(self, msg):
+		self.debug(msg)
+
 class NullDebugLogger(object):
+	# messages given to this logger are thrown away, so callers shouldn't
+	# spend any time formatting them (see enabled())
+	enabled = False
+
 	def debug(self, s):
 		pass
 
 	def write(self, msg):
 		pass
+
+def enabled(logger):
+	"""Returns True if messages given to logger are used for anything.
+	Callers on hot paths check this before formatting a message so that a
+	disabled logger costs nothing. Loggers without an 'enabled' attribute
+	are assumed to be enabled."""
+	return getattr(logger, 'enabled', True)
@@ -91,6 +91,22 @@ class InconsistentListMemberType(TokenUserError):
 	def error(self):
 		return 'List member is not of a type consistent with other list members'
 
+class InvalidNetwork(TokenUserError):
+	def error(self):
+		return 'Invalid network %s' % repr(self._offending_token.data)
+
+class NonNumericOperand(TokenUserError):
+	def error(self):
+		return 'Operand %s of comparison is not a number' % repr(self._offending_token.data)
+
+class UnreadableValueFile(TokenUserError):
+	def __init__(self, offending_token, io_error):
+		self._offending_token = offending_token
+		self._io_error = io_error
+
+	def error(self):
+		return 'Cannot read value file %s: %s' % (repr(self._offending_token.data), str(self._io_error))
+
 class ExcessCloseParen(TokenUserError):
 	def error(self):
 		return 'Close parenthesis has no corresponding opener'
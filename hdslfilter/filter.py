@@ -1,22 +1,58 @@
 
 import sys
+import time
 import re
 import string
 import copy
+import marshal
+import cPickle
 
 import tokenize
 import debug
 import errors
 import parse
+import trie
+import index
+import regexset
+import cidr
+import valuefile
+import optimize
+import prune
+import ordering
+import specialize
+import cache
+import snapshot
 
 class RegexCache(object):
 	"""This is used in Expressions whenever the regex match operator is used
 	(=~). Expressions on this operator are compiled to the python code
 	"RC.match(<string>,<expr>)". So, when evaluating the compiled code there
-	must be one of these objects present in the namespace and named 'RC'."""
+	must be one of these objects present in the namespace and named 'RC'.
+	Regexes which are really literal strings are matched without the re
+	module (see literalregex). The compiled regexes come from the shared
+	cache.regexes store, which is bounded; only those of the literal
+	regexes in the expression (see prepare) are kept here, so that matching
+	them doesn't take the store's lock."""
 
 	def __init__(self):
-		self._cache = {}
+		self._literals = {}
+		# literal regexes to keep when they're first used (see defer)
+		self._deferred = set()
+
+	def prepare(self, regex):
+		"""Keep the compiled regex (a literal in the expression) at hand.
+		If it doesn't compile, nothing is kept, and match raises re.error
+		when it's used as it would for any other regex."""
+		try:
+			self._literals[regex] = cache.regexes.searcher(regex)
+		except re.error:
+			pass
+
+	def defer(self, regex):
+		"""prepare, but not until regex is first used, so that it isn't
+		compiled at all if it never is (ie, by an expression in a Sieve
+		loaded from a snapshot, which the Sieve evaluates itself)."""
+		self._deferred.add(regex)
 	
 	def match(self, string, regex):
 		if string is None or string==None:
@@ -25,13 +61,233 @@ class RegexCache(object):
 		# TODO: maybe make ints or other stuff here an Eval error?
 		string = str(string)
 		
-		if not self._cache.has_key(regex):
-			self._cache[regex] = re.compile(regex)
-		
-		if self._cache[regex].search(string) is None:
-			return False
-		else:
-			return True
+		search = self._literals.get(regex)
+		if search is None:
+			search = cache.regexes.searcher(regex)
+			if regex in self._deferred:
+				self._literals[regex] = search
+		return search(string)
+
+class NetworkCache(object):
+	"""This is used in Expressions whenever the "in cidr" operator is used.
+	Expressions on this operator are compiled to the python code
+	"NET.match(<address>,<networks>)". So, when evaluating the compiled code
+	there must be one of these objects present in the namespace and named
+	'NET'. It builds one cidr.RadixTrie per distinct list of networks."""
+
+	def __init__(self):
+		self._cache = {}
+
+	def trie(self, networks):
+		"""Return the cidr.RadixTrie of the given networks."""
+		key = tuple(networks)
+		if key not in self._cache:
+			radix_trie = cidr.RadixTrie()
+			for network in networks:
+				radix_trie.add(network, True)
+			self._cache[key] = radix_trie
+		return self._cache[key]
+
+	def match(self, address, networks):
+		return self.trie(networks).contains(address)
+
+class ValueSetCache(object):
+	"""This is used in Expressions whenever the "in" or "not in" operators
+	are used. Their lists are compiled to the python code "VS.set(<list>)"
+	where <list> is the python source of the list as a string, and value
+	files to "VS.file(<path>)". So, when evaluating the compiled code there
+	must be one of these objects present in the namespace and named 'VS'.
+	Each list is made into a frozenset the first time it's used, so
+	membership tests don't scan the list."""
+
+	def __init__(self):
+		self._cache = {}
+
+	def set(self, source):
+		try:
+			return self._cache[source]
+		except KeyError:
+			values = self._cache[source] = frozenset(eval(source, {}))
+			return values
+
+	def file(self, path):
+		try:
+			return self._cache[path, None]
+		except KeyError:
+			values = self._cache[path, None] = valuefile.load(path)
+			return values
+
+class NumericComparator(object):
+	"""This is used in Expressions whenever <, <=, > or >= are used. They
+	are compiled to the python code "CMP.<lt|le|gt|ge>(<left>,<right>)", so
+	when evaluating the compiled code there must be one of these objects
+	present in the namespace and named 'CMP'. Comparisons are only true
+	when both operands are numbers (see parse.numeric_types)."""
+
+	def _compare(self, ttype, left, right):
+		numeric = parse.numeric_types
+		return type(left) in numeric and type(right) in numeric and parse.comparisons[ttype](left, right)
+
+	def lt(self, left, right):
+		return self._compare('lt', left, right)
+
+	def le(self, left, right):
+		return self._compare('le', left, right)
+
+	def gt(self, left, right):
+		return self._compare('gt', left, right)
+
+	def ge(self, left, right):
+		return self._compare('ge', left, right)
+
+# NumericComparators keep no state, so all expressions share this one
+numeric_comparator = NumericComparator()
+
+class ClosureCompiler(object):
+	"""Builds the closures used by the 'closure' evaluation engine (see
+	parse.Expression.closure). Where the 'eval' engine looks regexes up in
+	a RegexCache by their source on every evaluation, this binds
+	everything that is known at compile time (compiled regexes, literals,
+	value lists) into the closures once.
+
+	shared is a set of the keys (see parse.Expression.key) of subtrees
+	which appear more than once in the parse trees being compiled (see
+	optimize.shared_subtrees). Each of them is compiled into a single
+	closure, however many times it appears, whose value is memoized in the
+	symbol table so it's evaluated at most once per record."""
+
+	def __init__(self, regex_cache, network_cache=None, shared=None):
+		self._rc = regex_cache
+		if network_cache is None:
+			network_cache = NetworkCache()
+		self._nc = network_cache
+		if shared is None:
+			shared = set()
+		self._shared = shared
+		# maps the keys in shared to their memoized closures
+		self._memoized = {}
+		# how many times a memoized value has been used rather than
+		# evaluating its subtree again (in a list so the closures can
+		# update it)
+		self._saved = [0]
+
+	def closure(self, expression):
+		"""Return the closure for the given parse.Expression."""
+		if len(self._shared):
+			key = expression.key()
+			if key in self._shared:
+				if key not in self._memoized:
+					self._memoized[key] = self.memoize(self.build(expression))
+				return self._memoized[key]
+		return self.build(expression)
+
+	def build(self, expression):
+		"""Return the closure for the given parse.Expression, without
+		memoization. Subclasses override this rather than closure."""
+		return expression.closure(self)
+
+	def memoize(self, closure):
+		"""Return a closure which evaluates closure once per record."""
+
+		memo_key = ('subtree', len(self._memoized))
+		saved = self._saved
+		def memoized(s):
+			memo = s.memo
+			if memo_key in memo:
+				saved[0] += 1
+				return memo[memo_key]
+			value = memo[memo_key] = closure(s)
+			return value
+		return memoized
+
+	def saved_evaluations(self):
+		"""Return how many evaluations of shared subtrees memoization has
+		saved so far."""
+		return self._saved[0]
+
+	def regex_cache(self):
+		"""Return the RegexCache used for regexes which are not known until
+		evaluation time."""
+		return self._rc
+
+	def regex(self, regex):
+		"""Return a callable taking one value which behaves the same as
+		RegexCache.match(value, regex)."""
+
+		if not isinstance(regex, basestring):
+			# let RegexCache fail on it the same way at eval time
+			match = self._rc.match
+			return lambda value: match(value, regex)
+
+		try:
+			search = cache.regexes.searcher(regex)
+		except re.error:
+			# as with the eval engine, a regex which doesn't compile only
+			# raises if it's used (see RegexCache.prepare)
+			match = self._rc.match
+			return lambda value: match(value, regex)
+		def match(value):
+			if value is None:
+				return False
+			return search(str(value))
+		return match
+
+	def networks(self, networks):
+		"""Return a callable taking one value which behaves the same as
+		NetworkCache.match(value, networks)."""
+		return self._nc.trie(networks).contains
+
+class SieveCompiler(ClosureCompiler):
+	"""Builds the closures a Sieve evaluates its FilterExpressions with.
+	Regexes matched against the same symbol by any expression in the Sieve
+	are gathered into one regexset.RegexSet per symbol, so each record's
+	value for the symbol is scanned once for all of them. Likewise networks
+	in "in cidr" lists are gathered into one cidr.NetworkSet per symbol.
+
+	If adaptive is True, chains of boolean 'and' or 'or' operands are
+	evaluated with ordering.Chains, which try the operands most likely to
+	decide the chain cheaply first."""
+
+	def __init__(self, regex_cache, network_cache=None, shared=None, adaptive=False):
+		ClosureCompiler.__init__(self, regex_cache, network_cache, shared)
+		self._adaptive = adaptive
+		# maps symbols to RegexSets
+		self._regex_sets = {}
+		# maps symbols to NetworkSets
+		self._network_sets = {}
+
+	def build(self, expression):
+		if issubclass(expression.__class__, parse.MatchExpression):
+			left = expression.left_expression()
+			right = expression.right_expression()
+			if issubclass(left.__class__, parse.SymbolExpression) \
+			and issubclass(right.__class__, parse.ValueExpression) \
+			and isinstance(right.token().data, basestring):
+				symbol = left.token().data
+				regex_set = self._regex_sets.setdefault(symbol, regexset.RegexSet())
+				return regex_set.matcher(symbol, right.token().data)
+
+		elif issubclass(expression.__class__, parse.CidrExpression):
+			left = expression.left_expression()
+			if issubclass(left.__class__, parse.SymbolExpression):
+				symbol = left.token().data
+				network_set = self._network_sets.setdefault(symbol, cidr.NetworkSet())
+				return network_set.matcher(symbol, expression.networks(), expression.negated())
+
+		elif issubclass(expression.__class__, parse.LogicalExpression):
+			if self._adaptive and optimize.boolean_valued(expression):
+				ttype = expression.token().ttype
+				operands = optimize.operands(expression, ttype)
+				closures = [self.closure(operand) for operand in operands]
+				return ordering.Chain(ttype, closures,
+					[operand.find_symbols() for operand in operands],
+					[optimize.may_raise(operand) for operand in operands])
+
+		return expression.closure(self)
+
+	def regex_sets(self):
+		"""Return a dict mapping symbols to their RegexSets."""
+		return self._regex_sets
 
 class EvalError(Exception):
 
@@ -84,32 +340,143 @@ class SymbolExpansionTypeError(EvalError):
 #   trying to use something in a FE that can't be. Same error handling procedure
 #   as above.
 
+# types a symbol's value may have to be usable in a filter expression
+symbol_value_types = frozenset((type(0), type(0.0), type(''), type(None), type(True), type(0L)))
+
+class SymbolTable(object):
+	"""Maps symbols to their values in one dict (one record). Symbols are
+	looked up (via a trie.PathTrie) the first time the evaluation asks for
+	them and cached for the rest of that evaluation, so a symbol which is
+	only used on the far side of an 'and' or 'or' which short-circuits is
+	never looked up at all. This is what is named SYMBOL when evaluating a
+	FilterExpression.
+
+	A Sieve uses one SymbolTable for all of its FilterExpressions, so each
+	symbol (and each dotted prefix shared by several symbols) is looked up
+	at most once per record. fe is the FilterExpression currently being
+	evaluated, which is used for error reporting and debug logging."""
+
+	def __init__(self, obj, path_trie, fe=None):
+		self.fe = fe
+		self._obj = obj
+		self._trie = path_trie
+		self._nodes = path_trie.values(obj)
+		self._values = {}
+
+		# anything else worth working out only once per record can be kept
+		# here (see SieveCompiler)
+		self.memo = {}
+
+	def __getitem__(self, symbol):
+		values = self._values
+		if symbol in values:
+			return values[symbol]
+
+		value = trie.resolve(self._trie.node(symbol), self._nodes)
+		if value is trie.MISSING:
+			fe = self.fe
+			if fe is not None and fe._debug:
+				fe._logger.debug('%s: %s not found in %s. Assuming None.' % (fe.origin, symbol, repr(self._obj)))
+			value = None
+		elif type(value) not in symbol_value_types:
+			raise SymbolExpansionTypeError(self.fe, self._obj, symbol, value)
+
+		values[symbol] = value
+		return value
+
+def literal_regexes(expression):
+	"""Return the regexes which are literal strings in the parse tree
+	rooted at expression (see RegexCache.prepare)."""
+
+	found = []
+	for subtree in optimize.subtrees(expression):
+		if issubclass(subtree.__class__, parse.MatchExpression):
+			right = subtree.right_expression()
+			if issubclass(right.__class__, parse.ValueExpression) and isinstance(right.token().data, basestring):
+				found.append(right.token().data)
+	return found
+
+def result_key(table, symbols):
+	"""Return the key results are cached under for a record (see
+	FilterExpression.cache_results): the type and value of each of the
+	symbols, looked up in SymbolTable table. Types are part of the key
+	since 1, 1.0 and True are equal but don't look the same to a regex, and
+	floats are keyed by their repr as 0.0 and -0.0 are and don't either."""
+
+	key = []
+	for symbol in symbols:
+		value = table[symbol]
+		if type(value) is type(0.0):
+			key.append((type(value), repr(value)))
+		else:
+			key.append((type(value), value))
+	return tuple(key)
+
 class FilterExpression(object):
-	def __init__(self, parse_tree, debug_logger = debug.NullDebugLogger()):
+
+	# ways match() can evaluate the parse tree. 'eval' evaluates the python
+	# source code from parse.Expression.compile, 'closure' calls the
+	# closures from parse.Expression.closure.
+	engines = ('eval', 'closure')
+
+	# the FilterExpressions built by from_string_cached, shared by the
+	# whole process. Replace it with a larger cache.SynchronizedLRUCache
+	# to cache more.
+	source_cache = cache.SynchronizedLRUCache(256)
+
+	def __init__(self, parse_tree, debug_logger = debug.NullDebugLogger(), engine='eval'):
 		"""Constructs a new FilterExrpression given its parse tree (which is
 		a hdsyslogd.filter.parse.Expression object representing the tree
 		root). You probably want to use the from_string or from_token_list
-		contructors to build a FilterExpression, not this directly."""
+		contructors to build a FilterExpression, not this directly. engine
+		is one of FilterExpression.engines; both give identical results."""
 		
 		if not issubclass(parse_tree.__class__, parse.Expression):
 			raise TypeError('parse.Expression object required for parse_tree argument, got %s', parse_tree.__class__)
+		if engine not in self.engines:
+			raise ValueError('engine must be one of %s, got %s' % (repr(self.engines), repr(engine)))
 		self._parse_tree = parse_tree
 		self._logger = debug_logger
+		self._debug = debug.enabled(debug_logger)
+		self._engine = engine
 
 		# origin is a string that can be set by the using code that
 		# describes where this filter was defined in user-friendly terms
 		# (ie, "/etc/hdsyslogd.conf:12"). It can be used in errors messages.
 		self.origin = None
 
+		# This thing performs regex matching, caching regexes as they are used.
+		self._rc = RegexCache()
+		# and this does the same for network matching
+		self._nc = NetworkCache()
+		# and this for the lists and value files of "in" and "not in"
+		self._vs = ValueSetCache()
+
+		# simplify the parse tree before compiling it (see optimize.optimize)
+		parse_tree = optimize.optimize(parse_tree, ClosureCompiler(self._rc, self._nc))
+		self._parse_tree = parse_tree
+		if self._debug:
+			for line in parse_tree.dump().split('\n'):
+				self._logger.debug('optimized: ' + line)
+
 		# _src_code contains a string representation of the python source
 		# code for this expression. _obj_code is that compiled.
 		self._src_code = parse_tree.compile()
-		self._logger.debug('_src_code=%s' % repr(self._src_code))
+		if self._debug:
+			self._logger.debug('_src_code=%s' % repr(self._src_code))
 		self._src_code = self._src_code.strip()
-		self._obj_code = compile(self._src_code, '<string>', 'eval')
-		
-		# This thing performs regex matching, caching regexes as they are used.
-		self._rc = RegexCache()
+
+		# _evaluate takes a symbol table (a SymbolTable, or the dict returned
+		# by _get_symdict) and returns the result of the expression.
+		if engine=='eval':
+			self._obj_code = compile(self._src_code, '<string>', 'eval')
+			self._evaluate = self._eval
+			for regex in literal_regexes(parse_tree):
+				self._rc.prepare(regex)
+		else:
+			self._obj_code = None
+			shared = optimize.shared_subtrees([parse_tree])
+			self._evaluate = ClosureCompiler(self._rc, self._nc, shared).closure(parse_tree)
 		
 		# This is what is returned by __repr__. It is altered by the alternate
 		# constructors from_string and from_token_list
@@ -121,20 +488,32 @@ class FilterExpression(object):
 		# _symbol_list is an array containing strings that are all the symbols
 		# used in the filter expression.
 		self._symbol_list = self._parse_tree.find_symbols()
-		self._logger.debug('_symbol_list=%s' % repr(self._symbol_list))
+		if self._debug:
+			self._logger.debug('_symbol_list=%s' % repr(self._symbol_list))
 		
-		# the _symbol2pydt maps symbols as they appear in the filter
-		# expression (ie, "aa.bb.cc") to python dictionary traversal code
-		# (ie, "['aa']['bb']['cc']"). Keys are the symbols in the filter
-		# expression, values are python code (strings).
-		self._symbol2pydt = {}
+		# the _symbol_paths maps symbols as they appear in the filter
+		# expression (ie, "aa.bb.cc") to the keys to traverse to find their
+		# values (ie, ('aa','bb','cc')).
+		self._symbol_paths = {}
 		for symbol in  self._symbol_list:
-			self._symbol2pydt[symbol] = '['+ string.join([repr(s) for s in symbol.split('.')],'][') +']'
-		self._logger.debug('_symbol2pydt=%s' % repr(self._symbol2pydt))
+			self._symbol_paths[symbol] = tuple(symbol.split('.'))
+		if self._debug:
+			self._logger.debug('_symbol_paths=%s' % repr(self._symbol_paths))
+
+		# the trie match() looks this expression's symbols up with
+		self._trie = trie.PathTrie(self._symbol_list)
 	
 		# this filter expression's original source code, if available
 		self.filterSource = None
+
+		# the results of match for recent combinations of symbol values, if
+		# enabled (see cache_results)
+		self._results = None
 	
+	def engine(self):
+		"""Return the name of the engine used by match()."""
+		return self._engine
+
 	def py_src_code(self):
 		"""Return the python source code for this filter expression."""
 		return self._src_code
@@ -148,7 +527,7 @@ class FilterExpression(object):
 		return self._parse_tree
 	
 	@classmethod
-	def from_token_list(cls, tokens, debug_logger = debug.NullDebugLogger()):
+	def from_token_list(cls, tokens, debug_logger = debug.NullDebugLogger(), engine='eval'):
 		
 		"""Return a FilterExpression built from the given array of
 		hdsyslogd.filter.tokenize.Token objects. This is used when we are
@@ -160,38 +539,58 @@ class FilterExpression(object):
 		if len(tokens)==0:
 			raise errors.NullExpressionError()
 
-		debug_logger.debug("begin from_token_list() constructor for %s" % repr(tokens))
-		debug_logger.debug("token list: %s" % [token.data for token in tokens])
+		if debug.enabled(debug_logger):
+			debug_logger.debug("begin from_token_list() constructor for %s" % repr(tokens))
+			debug_logger.debug("token list: %s" % [token.data for token in tokens])
 		tokens_orig = copy.copy(tokens)
 		parse_tree = parse.parse(tokens, debug_logger)
 		fe_repr = '%s.%s.from_token_list(%s)' % (cls.__module__, cls.__name__, repr(tokens))
-		fe = cls(parse_tree,debug_logger = debug_logger)
+		fe = cls(parse_tree,debug_logger = debug_logger, engine = engine)
 		fe.repr = fe_repr
 		fe._token_list = tokens_orig
 		return fe
 
 	@classmethod
-	def from_string(cls, string, debug_logger = debug.NullDebugLogger()):
+	def from_string(cls, string, debug_logger = debug.NullDebugLogger(), engine='eval'):
 		"""Return a FilterExpression given a string representation of its
 		filter expression source code (ie, "snort.src_addr='1.2.3.4'"). This
 		may throw a hdsyslogd.filter.errors.UserError exception if there are
 		any problems parsing the filter."""
-		debug_logger.debug("begin from_string() constructor for %s" % repr(string))
+		debugging = debug.enabled(debug_logger)
+		if debugging:
+			debug_logger.debug("begin from_string() constructor for %s" % repr(string))
 		tzr = tokenize.Tokenizer()
 		filterSource = string
 		tokens = []
 		fe_repr = '%s.%s.from_string(%s)' % (cls.__module__, cls.__name__, repr(string))
-		while string:
-			(rest, token) = tzr.get_token(string)
-			debug_logger.debug("got token: %s" % repr(token))
-			string = rest
+		pos = 0
+		while pos < len(string):
+			(token, pos) = tzr.scan(string, pos)
+			if debugging:
+				debug_logger.debug("got token: %s" % repr(token))
 			if token is not None:
 				tokens.append(token)
-		fe = cls.from_token_list(tokens, debug_logger)
+		fe = cls.from_token_list(tokens, debug_logger, engine)
 		fe.repr = fe_repr
 		fe.filterSource = filterSource
 		return fe
 
+	@classmethod
+	def from_string_cached(cls, string, engine='eval'):
+		"""from_string, returning the same FilterExpression for the same
+		source code (ignoring leading and trailing whitespace) as recent
+		earlier calls, so that repeated expressions aren't tokenized,
+		parsed and compiled again. The FilterExpressions are shared by
+		every caller, so they mustn't be modified (ie, by setting origin or
+		calling cache_results)."""
+
+		key = (cls, string.strip(), engine)
+		fe = cls.source_cache.get(key)
+		if fe is cache.missing:
+			fe = cls.from_string(string, engine=engine)
+			cls.source_cache.put(key, fe)
+		return fe
+
 	# TODO: make this raise one exception for KeyErrors and something more
 	# severe for other errors.
 	def _expand_symbol(self, symbol, obj): 
@@ -203,17 +602,19 @@ class FilterExpression(object):
 		this will attempt to evaluate obj['snort']['src_addr'] and return
 		it."""
 		
-		if symbol not in self._symbol_list:
+		if symbol not in self._symbol_paths:
 			raise ValueError("given symbol is not used in this expression")
-		assert self._symbol2pydt.has_key(symbol)
 		
+		value = obj
 		try:
-			value = eval('obj%s' % self._symbol2pydt[symbol])
+			for key in self._symbol_paths[symbol]:
+				value = value[key]
 		except KeyError, ke:
-			self._logger.debug('%s: KeyError %s while searching for %s in %s. Assuming None.' % (self.origin, ke, symbol, repr(obj)))
+			if self._debug:
+				self._logger.debug('%s: KeyError %s while searching for %s in %s. Assuming None.' % (self.origin, ke, symbol, repr(obj)))
 			return None
 		
-		if type(value) not in (type(0), type(0.0), type(''), type(None), type(True), type(0L) ):
+		if type(value) not in symbol_value_types:
 			raise SymbolExpansionTypeError(self, obj, symbol, value)
 		
 		return value
@@ -245,13 +646,85 @@ class FilterExpression(object):
 		if not issubclass(logMessage.__class__, dict):
 			raise TypeError('dict or dict subclass required for value to match against')
 
+		table = SymbolTable(logMessage, self._trie, self)
+		if self._results is not None:
+			return self._cached_evaluate(table)
+		return self._evaluate(table)
+
+	def _cached_evaluate(self, table):
+		try:
+			key = result_key(table, self._symbol_list)
+		except Exception:
+			# a symbol can't be looked up, but evaluating the expression
+			# might not need it (ie, on the far side of an 'or'), so the
+			# expression has to be evaluated to find out what happens
+			return self._evaluate(table)
+		value = self._results.get(key)
+		if value is cache.missing:
+			value = self._evaluate(table)
+			self._results.put(key, value)
+		return value
+
+	def cache_results(self, size=1024):
+		"""Have match cache its results for the last size distinct
+		combinations of values of the symbols this expression uses, so that
+		records which repeat a combination aren't evaluated again. A size of
+		0 turns caching off."""
+		if size:
+			self._results = cache.LRUCache(size)
+		else:
+			self._results = None
+
+	def result_cache(self):
+		"""Return the cache.LRUCache holding match's results (for its hit,
+		miss and eviction counts), or None if results aren't cached."""
+		return self._results
+
+	def _eval(self, symdict):
 		namespace = {
-			'SYMBOL': self._get_symdict(logMessage),
-			'RC': self._rc }
+			'SYMBOL': symdict,
+			'RC': self._rc,
+			'NET': self._nc,
+			'VS': self._vs,
+			'CMP': numeric_comparator }
 		
 		res = eval(self._obj_code, namespace)
 		return res
 
+	def __getstate__(self):
+		"""Return what pickle saves of this expression (see snapshot): its
+		code object is marshalled, and its evaluator, caches and debug
+		logger are left out, to be made again by __setstate__. Result
+		caching (see cache_results) is off for the unpickled expression."""
+
+		state = self.__dict__.copy()
+		for name in ('_logger', '_debug', '_rc', '_nc', '_vs', '_evaluate', '_results', '_symbol_paths', '_trie'):
+			del state[name]
+		if self._obj_code is not None:
+			state['_obj_code'] = marshal.dumps(self._obj_code)
+		return state
+
+	def __setstate__(self, state):
+		self.__dict__.update(state)
+		self._logger = debug.NullDebugLogger()
+		self._debug = False
+		self._symbol_paths = {}
+		for symbol in self._symbol_list:
+			self._symbol_paths[symbol] = tuple(symbol.split('.'))
+		self._trie = trie.PathTrie(self._symbol_list)
+		self._rc = RegexCache()
+		self._nc = NetworkCache()
+		self._vs = ValueSetCache()
+		if self._engine=='eval':
+			self._obj_code = marshal.loads(self._obj_code)
+			self._evaluate = self._eval
+			for regex in literal_regexes(self._parse_tree):
+				self._rc.defer(regex)
+		else:
+			shared = optimize.shared_subtrees([self._parse_tree])
+			self._evaluate = ClosureCompiler(self._rc, self._nc, shared).closure(self._parse_tree)
+		self._results = None
+
 	def matchLog(self, log):
 
 		"""Evaluate this expression against an hdsyslog.log.Log object in
@@ -272,19 +745,153 @@ class FilterExpression(object):
 	
 class Sieve(object):
 	"""A Sieve is comprised of zero or more FilterExpressions. LogMessages
-	can be passed through it to see if they pass all filters or not."""
-	def __init__(self, filter_expressions = []):
+	can be passed through it to see if they pass all filters or not.
+
+	If adaptive is True, match tries the expressions in the order most
+	likely to find a match soonest, going by how often each has matched
+	and how long each has taken so far, rather than in order, and chains
+	of boolean 'and' and 'or' operands are reordered the same way (see
+	ordering). Since match only says whether any expression matched,
+	the order doesn't change its result (or the exceptions it raises).
+	match_trace always tries the expressions in order, so it reports the
+	first one which matches."""
+
+	# the Sieves built by from_str_cached, shared by the whole process (see
+	# FilterExpression.source_cache)
+	source_cache = cache.SynchronizedLRUCache(64)
+
+	def __init__(self, filter_expressions = [], adaptive=False):
 		for fe in filter_expressions:
 			if not issubclass(FilterExpression, fe.__class__):
 				raise TypeError('filter_expressions must be a list composed only of FilterExpressions')
 		self._filter_exprs = filter_expressions
 		self._onexc = True
 
-	def from_string(cls, s):
-		return cls.from_str(s)
+		# one trie of every symbol used by every expression, so that
+		# symbols are looked up once per record rather than once per
+		# expression (see SymbolTable).
+		self._trie = trie.PathTrie()
+		symbols = set()
+		for fe in filter_expressions:
+			for symbol in fe._symbol_list:
+				self._trie.add(symbol)
+				symbols.add(symbol)
+		self._symbols = sorted(symbols)
+
+		# expressions which can never be the first to match a record (see
+		# prune.dead_expressions), as (number, reason, by) tuples. They're
+		# only candidates for records in which one of their symbols can't
+		# be looked up (see index.DispatchIndex.add_dead), so they are
+		# rarely evaluated.
+		self._pruned = prune.dead_expressions([fe.parse_tree() for fe in filter_expressions])
+		dead = set([number for (number, reason, by) in self._pruned])
+
+		# finds the expressions which can possibly match a record from the
+		# values of the symbols they compare to literals with ==, in, <, <=,
+		# > or >=, so that the rest need not be evaluated at all.
+		self._index = index.DispatchIndex()
+		for (i, fe) in enumerate(filter_expressions):
+			if i in dead:
+				self._index.add_dead(i, fe._symbol_list)
+			else:
+				self._index.add(i, fe.parse_tree())
+		# dead expressions still match records, so match_all needs an index
+		# of all of them
+		if len(dead):
+			self._all_index = index.DispatchIndex()
+			for (i, fe) in enumerate(filter_expressions):
+				self._all_index.add(i, fe.parse_tree())
+		else:
+			self._all_index = self._index
+
+		# finds the expressions which use a symbol, for update_results
+		self._dependencies = index.DependencyIndex()
+		for (i, fe) in enumerate(filter_expressions):
+			self._dependencies.add(i, fe._symbol_list)
+
+		# subtrees which appear in more than one place (ie, the same
+		# 'program == "sshd"' clause in many expressions) are evaluated at
+		# most once per record, however many expressions they're in
+		self._shared = optimize.shared_subtrees([fe.parse_tree() for fe in filter_expressions])
+
+		# whether each expression may raise an exception other than by
+		# looking a symbol up (see ordering.forced)
+		self._may_raise = [optimize.may_raise(fe.parse_tree()) for fe in filter_expressions]
+
+		self._adaptive = adaptive
+		self._compile()
+
+	def _compile(self, plans={}):
+		"""Build the closures which match evaluates the expressions with,
+		and start adaptive ordering and result caching afresh. plans maps
+		symbols to the plans (see regexset.RegexSet.plan) of the RegexSets
+		of the regexes matched against them, if they're known."""
+
+		# the Sieve evaluates each expression with its own closure rather
+		# than the expression's engine so that work can be shared between
+		# expressions (see SieveCompiler)
+		self._rc = RegexCache()
+		self._compiler = SieveCompiler(self._rc, shared=self._shared, adaptive=self._adaptive)
+		self._closures = [self._compiler.closure(fe.parse_tree()) for fe in self._filter_exprs]
+		for (symbol, regex_set) in self._compiler.regex_sets().iteritems():
+			regex_set.compile(plans.get(symbol))
+
+		# how often each expression has been evaluated and matched, for
+		# adaptive ordering, and each expression's position in that order
+		self._statistics = ordering.Statistics(len(self._filter_exprs))
+		self._guards = ordering.guards([fe._symbol_list for fe in self._filter_exprs])
+		self._forced = ordering.forced(self._may_raise)
+		self._ranks = range(len(self._filter_exprs))
+		self._count = 0
+
+		# the results of match for recent combinations of symbol values, if
+		# enabled (see cache_results)
+		self._results = None
+
+	def __getstate__(self):
+		"""Return what pickle saves of this Sieve (see snapshot): what
+		_compile makes is left out, to be made again by __setstate__, but
+		for the plans of its RegexSets, which save it analyzing every regex
+		again."""
+
+		state = self.__dict__.copy()
+		for name in ('_rc', '_compiler', '_closures', '_statistics', '_guards', '_forced', '_ranks', '_count', '_results'):
+			del state[name]
+		plans = {}
+		for (symbol, regex_set) in self._compiler.regex_sets().iteritems():
+			plans[symbol] = regex_set.plan()
+		state['_regex_plans'] = plans
+		return state
+
+	def __setstate__(self, state):
+		plans = state.pop('_regex_plans')
+		self.__dict__.update(state)
+		self._compile(plans)
+
+	def _symbol_table(self, d):
+		if not issubclass(d.__class__, dict):
+			raise TypeError('dict or dict subclass required for value to match against')
+		return SymbolTable(d, self._trie)
+
+	def from_string(cls, s, adaptive=False):
+		return cls.from_str(s, adaptive)
 	from_string = classmethod(from_string)
 
-	def from_str(cls, s):
+	def from_str_cached(cls, s, adaptive=False):
+		"""from_str, returning the same Sieve for the same source code
+		(ignoring leading and trailing whitespace) as recent earlier calls
+		(see FilterExpression.from_string_cached). The Sieves are shared by
+		every caller, so they mustn't be modified."""
+
+		key = (cls, s.strip(), adaptive)
+		sieve = cls.source_cache.get(key)
+		if sieve is cache.missing:
+			sieve = cls.from_str(s, adaptive)
+			cls.source_cache.put(key, sieve)
+		return sieve
+	from_str_cached = classmethod(from_str_cached)
+
+	def from_str(cls, s, adaptive=False):
 		"""Return s new Sieve based on expression source code in the string s."""
 		tokens = tokenize.tokenize(s)
 		filter_exprs = []
@@ -292,13 +899,24 @@ class Sieve(object):
 			#print expr_tokens
 			fe = FilterExpression.from_token_list(expr_tokens)
 			filter_exprs.append(fe)
-		return cls(filter_exprs)
+		return cls(filter_exprs, adaptive)
 	from_str = classmethod(from_str)
 	
-	def from_file(cls, path):
-		"""Return s new Sieve based on expression source code in the string s."""
+	def from_file(cls, path, adaptive=False, snapshot_path=None):
+		"""Return s new Sieve based on expression source code in the string s.
+
+		If snapshot_path is given, the Sieve is loaded from the snapshot
+		file there (see snapshot) if it was saved from the same source code
+		(and path, adaptive setting, and version of hdslfilter); otherwise
+		it's built from the source and saved there for next time."""
 		src = file(path).read()
 
+		if snapshot_path is not None:
+			key = snapshot.key(src, path, adaptive)
+			sieve = snapshot.load(snapshot_path, key)
+			if sieve is not None:
+				return sieve
+
 		token_sets = tokenize.tokenize(src)
 		filter_exprs = []
 		for tokens in token_sets:
@@ -307,33 +925,293 @@ class Sieve(object):
 			fe = FilterExpression.from_token_list(tokens)
 			fe.origin = 'file %s lines %d-%d' % (path, start_line, end_line)
 			filter_exprs.append(fe)
-		sieve = Sieve(filter_exprs)
+		sieve = Sieve(filter_exprs, adaptive)
 		sieve.src_file = path
+
+		if snapshot_path is not None:
+			try:
+				snapshot.save(sieve, snapshot_path, key)
+			except (IOError, OSError, RuntimeError, cPickle.PicklingError, TypeError):
+				# the snapshot is only there to save time; if it can't be
+				# written (or the parse trees are too deep to pickle, or
+				# something in them can't be pickled), the sieve is built
+				# from source next time too
+				pass
 		return sieve
 	from_file = classmethod(from_file)
 	
 	def match(self, d):
 		"""Returns True if dict object matches a FilterExpression or False
 		if it matches None. The FilterExpressions are tested in order and
-		evaluation is stopped upon the first match."""
+		evaluation is stopped upon the first match (but see adaptive,
+		above)."""
 
-		for fe in self._filter_exprs:
-			rv = fe.match(d)
+		table = self._symbol_table(d)
+		if self._results is not None:
+			try:
+				key = result_key(table, self._symbols)
+			except Exception:
+				# see FilterExpression._cached_evaluate
+				return self._match_table(table)
+			rv = self._results.get(key)
+			if rv is cache.missing:
+				rv = self._match_table(table)
+				self._results.put(key, rv)
+			return rv
+		return self._match_table(table)
+
+	def _match_table(self, table):
+		"""match, given the record's SymbolTable."""
+
+		if self._adaptive:
+			return self._adaptive_match(table)
+		exprs = self._filter_exprs
+		closures = self._closures
+		for i in self._index.candidates(table.__getitem__):
+			table.fe = exprs[i]
+			rv = closures[i](table)
 			if rv==True:	
 				return True
 		return False
 
+	def _adaptive_match(self, table):
+		"""match, trying the expressions in adaptive order and keeping the
+		statistics the order is worked out from."""
+
+		self._count += 1
+		if self._count % ordering.reorder_interval == 0:
+			self._ranks = self._statistics.ranks()
+		timing = self._count % ordering.sample_interval == 0
+		statistics = self._statistics
+
+		exprs = self._filter_exprs
+		closures = self._closures
+		candidates = self._index.candidates(table.__getitem__)
+		ranks = self._ranks
+		try:
+			for i in sorted(candidates, key=ranks.__getitem__):
+				table.fe = exprs[i]
+				statistics.evaluations[i] += 1
+				if timing:
+					start = time.time()
+					rv = closures[i](table)
+					statistics.timed[i] += 1
+					statistics.seconds[i] += time.time() - start
+				else:
+					rv = closures[i](table)
+				if rv==True:
+					statistics.decisive[i] += 1
+					# an earlier expression might have raised an exception
+					# before this one was reached if one of its symbols
+					# can't be looked up (see ordering)
+					for symbol in self._guards[i]:
+						table[symbol]
+					# likewise if it may raise (see ordering), so the
+					# earlier candidates which may and haven't been tried
+					# yet are evaluated
+					if len(self._forced[i]):
+						for j in self._forced[i]:
+							if ranks[j] > ranks[i] and j in candidates:
+								table.fe = exprs[j]
+								closures[j](table)
+					return True
+			return False
+		except Exception:
+			for i in candidates:
+				table.fe = exprs[i]
+				if closures[i](table)==True:
+					return True
+			return False
+
 	def match_trace(self, d):
 		"""Returns True if dict object matches a FilterExpression or False
 		if it matches None. The FilterExpressions are tested in order and
 		evaluation is stopped upon the first match."""
 
-		for fe in self._filter_exprs:
-			rv = fe.match(d)
+		table = self._symbol_table(d)
+		exprs = self._filter_exprs
+		closures = self._closures
+		for i in self._index.candidates(table.__getitem__):
+			fe = exprs[i]
+			table.fe = fe
+			rv = closures[i](table)
 			if rv==True:	
 				return (True,fe)
 		return (False,None)
 
+	def _matching(self, d):
+		"""Return the numbers of all the expressions which match dict object
+		d, in order."""
+
+		table = self._symbol_table(d)
+		exprs = self._filter_exprs
+		closures = self._closures
+		found = []
+		for i in self._all_index.candidates(table.__getitem__):
+			table.fe = exprs[i]
+			if closures[i](table)==True:
+				found.append(i)
+		return found
+
+	def match_all(self, d):
+		"""Returns a list of every FilterExpression which dict object d
+		matches, in order. They're all evaluated in one pass, so symbols
+		are looked up and shared subexpressions evaluated once for all of
+		them."""
+		exprs = self._filter_exprs
+		return [exprs[i] for i in self._matching(d)]
+
+	def results(self, d):
+		"""Returns a list of whether dict object d matches each of the
+		FilterExpressions, in order (see match_all)."""
+		found = [False] * len(self._filter_exprs)
+		for i in self._matching(d):
+			found[i] = True
+		return found
+
+	def update_results(self, d, results, changed):
+		"""Given the list results which results returned for dict object d,
+		and a list of the paths (ie, "geo" or "geo.country") of the parts
+		of d which have been changed since, return the list results would
+		now return, evaluating only the FilterExpressions which use a
+		changed path (or a symbol above or below one)."""
+
+		if not issubclass(d.__class__, dict):
+			raise TypeError('dict or dict subclass required for value to match against')
+		if len(results) != len(self._filter_exprs):
+			raise ValueError('results must have one entry per FilterExpression, got %d for %d' % (len(results), len(self._filter_exprs)))
+		found = list(results)
+		dependents = self._dependencies.dependents(changed)
+		if len(dependents)==0:
+			return found
+		# the dependents which aren't candidates (see index.DispatchIndex)
+		# can't match, just as in results. The others' candidacy depends
+		# on symbols which haven't changed.
+		dependent = set(dependents)
+		for i in dependents:
+			found[i] = False
+		table = self._symbol_table(d)
+		exprs = self._filter_exprs
+		closures = self._closures
+		for i in self._all_index.candidates(table.__getitem__):
+			if i in dependent:
+				table.fe = exprs[i]
+				found[i] = closures[i](table)==True
+		return found
+
+	def dependents(self, paths):
+		"""Return the FilterExpressions which use a symbol at, below or
+		above any of the paths in the list paths (see update_results), in
+		order."""
+		exprs = self._filter_exprs
+		return [exprs[i] for i in self._dependencies.dependents(paths)]
+
+	def match_bits(self, d):
+		"""Returns match_all as an int with bit i set if the ith
+		FilterExpression (counting from 0) matches."""
+		bits = 0
+		for i in self._matching(d):
+			bits |= 1 << i
+		return bits
+
+	def pruned(self):
+		"""Return a list of (FilterExpression, reason, FilterExpression or
+		None) tuples for the expressions which are never evaluated because
+		they can't be the first to match a record: reason is 'duplicate' or
+		'subsumed' (the second FilterExpression being the earlier one which
+		matches everything it does), or 'never matches'."""
+		exprs = self._filter_exprs
+		return [(exprs[number], reason, by is not None and exprs[by] or None) for (number, reason, by) in self._pruned]
+
+	def pruning_report(self):
+		"""Return a string describing the expressions in pruned(), one per
+		line, using their origin (ie, "file /etc/hdsyslogd.sieve lines
+		10-11") where it's set."""
+
+		def describe(number):
+			origin = self._filter_exprs[number].origin
+			if origin is None:
+				origin = 'expression %d' % (number+1)
+			return origin
+
+		lines = []
+		for (number, reason, by) in self._pruned:
+			if reason=='duplicate':
+				lines.append('%s: duplicate of %s' % (describe(number), describe(by)))
+			elif reason=='subsumed':
+				lines.append('%s: subsumed by %s' % (describe(number), describe(by)))
+			else:
+				lines.append('%s: never matches' % describe(number))
+		return ''.join([line + '\n' for line in lines])
+
+	def cache_results(self, size=1024):
+		"""Have match cache its results for the last size distinct
+		combinations of values of the symbols the Sieve's expressions use
+		(see FilterExpression.cache_results). A size of 0 turns caching
+		off."""
+		if size:
+			self._results = cache.LRUCache(size)
+		else:
+			self._results = None
+
+	def result_cache(self):
+		"""Return the cache.LRUCache holding match's results (for its hit,
+		miss and eviction counts), or None if results aren't cached."""
+		return self._results
+
+	def specialize(self, bindings):
+		"""Return a new Sieve which matches the same records as this one
+		among those in which the symbols in the dict bindings (ie,
+		{'customer': 'acme'}) have the given values, for use with streams of
+		records in which those fields never change. Clauses which only use
+		bound symbols are evaluated once here rather than for every record,
+		and expressions which then can't match are left out."""
+
+		for (symbol, value) in bindings.iteritems():
+			if type(value) not in symbol_value_types:
+				raise TypeError('value for %s is of a type which can not be used in a filter expression: %s' % (symbol, repr(value)))
+
+		compiler = ClosureCompiler(self._rc)
+		filter_exprs = []
+		for fe in self._filter_exprs:
+			tree = specialize.specialize(fe.parse_tree(), bindings, compiler)
+			(is_constant, value) = optimize.constant(tree)
+			if is_constant and value != True:
+				continue
+			specialized = FilterExpression(tree, fe._logger, fe.engine())
+			specialized.origin = fe.origin
+			specialized.filterSource = fe.filterSource
+			filter_exprs.append(specialized)
+
+		sieve = Sieve(filter_exprs, self._adaptive)
+		if hasattr(self, 'src_file'):
+			sieve.src_file = self.src_file
+		return sieve
+
+	def statistics(self):
+		"""Return a list of (FilterExpression, evaluations, matches, seconds)
+		tuples, in order, for an adaptive Sieve: how many times match has
+		evaluated each expression, how many of those it matched, and the
+		average time an evaluation took (None if none has been timed yet).
+		The expressions are tried in ascending order of seconds over the
+		chance of matching."""
+
+		statistics = self._statistics
+		found = []
+		for (i, fe) in enumerate(self._filter_exprs):
+			seconds = None
+			if statistics.timed[i]:
+				seconds = statistics.seconds[i] / statistics.timed[i]
+			found.append((fe, statistics.evaluations[i], statistics.decisive[i], seconds))
+		return found
+
+	def saved_evaluations(self):
+		"""Return how many times, over all records matched so far, a
+		subexpression shared by several FilterExpressions has been evaluated
+		once for a record and its value reused rather than evaluated
+		again."""
+		return self._compiler.saved_evaluations()
+
 	def test_message(self, log_message):
 		"""Returns True if log_message matches a FilterExpression or False
 		if it matches None. The FilterExpressions are tested in order and
@@ -344,3 +1222,90 @@ class Sieve(object):
 			if rv==True:	
 				return True
 		return False
+
+class Router(object):
+	"""Matches records against many named Sieves at once (ie, one per
+	tenant), returning the names of those which match. The Sieves'
+	expressions are evaluated together as if they were one Sieve: each
+	symbol is looked up once per record, regexes matched against the same
+	symbol by any of the Sieves are scanned for together, subexpressions
+	they have in common are evaluated once, and one index finds the
+	candidate expressions of every Sieve. Each Sieve's result is the same
+	as its match would give."""
+
+	def __init__(self, sieves):
+		"""sieves is a dict mapping names to Sieves."""
+
+		self._names = sorted(sieves.keys())
+		self._filter_exprs = []
+		# maps expression numbers to the position in _names of their Sieve
+		self._owners = []
+		dead = set()
+		for (position, name) in enumerate(self._names):
+			sieve = sieves[name]
+			if not issubclass(sieve.__class__, Sieve):
+				raise TypeError('sieves must be a dict mapping names to Sieves')
+			offset = len(self._filter_exprs)
+			# expressions which can't be the first in their Sieve to match
+			for (number, reason, by) in sieve._pruned:
+				dead.add(offset + number)
+			for fe in sieve._filter_exprs:
+				self._filter_exprs.append(fe)
+				self._owners.append(position)
+
+		self._trie = trie.PathTrie()
+		for fe in self._filter_exprs:
+			for symbol in fe._symbol_list:
+				self._trie.add(symbol)
+
+		self._index = index.DispatchIndex()
+		trees = []
+		for (i, fe) in enumerate(self._filter_exprs):
+			if i in dead:
+				self._index.add_dead(i, fe._symbol_list)
+			else:
+				self._index.add(i, fe.parse_tree())
+				trees.append(fe.parse_tree())
+
+		self._rc = RegexCache()
+		self._compiler = SieveCompiler(self._rc, shared=optimize.shared_subtrees(trees))
+		self._closures = [self._compiler.closure(fe.parse_tree()) for fe in self._filter_exprs]
+		for regex_set in self._compiler.regex_sets().itervalues():
+			regex_set.compile()
+
+	def names(self):
+		"""Return the names of the Sieves, sorted."""
+		return list(self._names)
+
+	def match(self, d):
+		"""Returns the set of the names of the Sieves which dict object d
+		matches. An exception any of the Sieves would raise for d is raised
+		(and the other Sieves' results are lost)."""
+
+		if not issubclass(d.__class__, dict):
+			raise TypeError('dict or dict subclass required for value to match against')
+		table = SymbolTable(d, self._trie)
+		exprs = self._filter_exprs
+		closures = self._closures
+		owners = self._owners
+		names = self._names
+		# whether each Sieve has matched, after which the rest of its
+		# expressions are skipped as its own match would skip them
+		matched = [False] * len(names)
+		found = set()
+		for i in self._index.candidates(table.__getitem__):
+			owner = owners[i]
+			if matched[owner]:
+				continue
+			table.fe = exprs[i]
+			if closures[i](table)==True:
+				matched[owner] = True
+				found.add(names[owner])
+		return found
+
+	def saved_evaluations(self):
+		"""Return how many times a subexpression shared by several
+		expressions (of the same Sieve or of different ones) has been
+		evaluated once for a record and its value reused (see
+		Sieve.saved_evaluations)."""
+		return self._compiler.saved_evaluations()
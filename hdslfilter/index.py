@@ -0,0 +1,367 @@
+
+import parse
+import optimize
+
+#####################################################################################
+#####################################################################################
+## Indexes a Sieve uses to find which of its expressions can possibly match a
+## record without evaluating all of them. Expressions are identified by their
+## position in the Sieve, and candidates are always returned in that order so
+## that the first match is the same as when every expression is tried.
+#####################################################################################
+#####################################################################################
+
+def equality_constraint(expression):
+	"""If expression is "symbol == literal" (or "literal == symbol")
+	return a (symbol, [literal]) tuple. If it is "symbol in [...]" return a
+	(symbol, [literals...]) tuple. Otherwise return None. In either case,
+	expression can only be true if the symbol's value equals one of the
+	literals."""
+
+	if issubclass(expression.__class__, parse.EqualExpression):
+		if expression.token().ttype != 'equal':
+			return None
+		left = expression.left_expression()
+		right = expression.right_expression()
+		if issubclass(left.__class__, parse.ValueExpression):
+			(left, right) = (right, left)
+		if issubclass(left.__class__, parse.SymbolExpression) and issubclass(right.__class__, parse.ValueExpression):
+			return (left.token().data, [right.token().data])
+
+	elif issubclass(expression.__class__, parse.InExpression):
+		if expression.token().ttype != 'in':
+			return None
+		left = expression.left_expression()
+		right = expression.right_expression()
+		# value files are left out; they can be too big to index
+		if issubclass(left.__class__, parse.SymbolExpression) and issubclass(right.__class__, parse.ValueListExpression):
+			return (left.token().data, right.values())
+
+	return None
+
+def range_constraint(expression):
+	"""If expression is a comparison of a symbol to an integer (ie,
+	"symbol < 10" or "10 <= symbol") return a (symbol, low, high) tuple
+	where low and high are the (inclusive) bounds the symbol's value must
+	be within for expression to be true, either of which may be None for
+	no bound. Otherwise return None. Strict comparisons are treated as
+	inclusive, which only makes the range a little larger than it has
+	to be."""
+
+	if not issubclass(expression.__class__, parse.CompareExpression):
+		return None
+	bound = expression.bound()
+	if bound is None:
+		return None
+	(symbol, ttype, value) = bound
+	if ttype in ('gt', 'ge'):
+		return (symbol, value, None)
+	else:
+		return (symbol, None, value)
+
+class EqualityIndex(object):
+	"""Maps (symbol, value) pairs to the expressions which can only match
+	records in which the symbol has that value."""
+
+	def __init__(self):
+		# maps symbols to dicts mapping values to lists of expression
+		# numbers
+		self._fields = {}
+
+	def add(self, number, symbol, values):
+		"""Index expression number, which can only match when symbol's
+		value is one of values. Expressions must be added in order."""
+		buckets = self._fields.setdefault(symbol, {})
+		for value in values:
+			bucket = buckets.setdefault(value, [])
+			if len(bucket)==0 or bucket[-1]!=number:
+				bucket.append(number)
+
+	def symbols(self):
+		"""Return the symbols which expressions are indexed by."""
+		return self._fields.keys()
+
+	def candidates(self, symbol, value):
+		"""Return a list of the numbers of the expressions indexed by symbol
+		which can match a record in which symbol's value is value."""
+		return self._fields[symbol].get(value, [])
+
+	def all_candidates(self, symbol):
+		"""Return a list of the numbers of all the expressions indexed by
+		symbol."""
+		numbers = set()
+		for bucket in self._fields[symbol].itervalues():
+			numbers.update(bucket)
+		return list(numbers)
+
+# stand-ins for missing bounds
+below_everything = float('-inf')
+above_everything = float('inf')
+
+class IntervalNode(object):
+	"""A node of a centered interval tree. It holds the intervals which
+	contain its center, sorted by their low bounds and by their high
+	bounds (descending). Intervals entirely below or above the center are
+	in the left or right subtree."""
+
+	def __init__(self, intervals):
+		"""intervals is a list of (low, high, number) tuples, and must not
+		be empty."""
+
+		points = sorted([low for (low, high, number) in intervals if low != below_everything] +
+			[high for (low, high, number) in intervals if high != above_everything])
+		if len(points):
+			self.center = points[len(points)//2]
+		else:
+			self.center = 0
+
+		here = []
+		left = []
+		right = []
+		for interval in intervals:
+			if interval[1] < self.center:
+				left.append(interval)
+			elif interval[0] > self.center:
+				right.append(interval)
+			else:
+				here.append(interval)
+
+		self.by_low = sorted(here)
+		self.by_high = sorted(here, key=lambda interval: interval[1], reverse=True)
+		self.left = left and IntervalNode(left) or None
+		self.right = right and IntervalNode(right) or None
+
+	def stab(self, value, found):
+		"""Append the numbers of all intervals containing value to found."""
+		node = self
+		while node is not None:
+			if value < node.center:
+				for (low, high, number) in node.by_low:
+					if low > value:
+						break
+					found.append(number)
+				node = node.left
+			else:
+				for (low, high, number) in node.by_high:
+					if high < value:
+						break
+					found.append(number)
+				node = node.right
+
+class IntervalIndex(object):
+	"""Maps symbols to the expressions which can only match records in
+	which the symbol's value is a number within some range, kept in a
+	centered interval tree (see IntervalNode) per symbol so that finding
+	the expressions whose ranges contain a value costs O(log n) plus the
+	number found."""
+
+	def __init__(self):
+		# maps symbols to lists of (low, high, number)
+		self._intervals = {}
+		# maps symbols to IntervalNodes, built when first needed
+		self._trees = {}
+
+	def add(self, number, symbol, low, high):
+		"""Index expression number, which can only match when symbol's
+		value is a number between low and high (inclusive, either of
+		which may be None for no bound)."""
+		if low is None:
+			low = below_everything
+		if high is None:
+			high = above_everything
+		intervals = self._intervals.setdefault(symbol, [])
+		if low <= high:
+			# otherwise no value is in the range, so it can never match
+			intervals.append((low, high, number))
+		self._trees.pop(symbol, None)
+
+	def symbols(self):
+		"""Return the symbols which expressions are indexed by."""
+		return self._intervals.keys()
+
+	def candidates(self, symbol, value):
+		"""Return a list of the numbers of the expressions indexed by symbol
+		which can match a record in which symbol's value is value."""
+
+		if type(value) not in parse.numeric_types:
+			return []
+		if symbol not in self._trees:
+			intervals = self._intervals[symbol]
+			self._trees[symbol] = intervals and IntervalNode(intervals) or None
+		found = []
+		if self._trees[symbol] is not None:
+			self._trees[symbol].stab(value, found)
+		return found
+
+	def all_candidates(self, symbol):
+		"""Return a list of the numbers of all the (possibly matching)
+		expressions indexed by symbol."""
+		return [number for (low, high, number) in self._intervals[symbol]]
+
+class DispatchIndex(object):
+	"""Files each expression in a Sieve under one of its top level (and-ed
+	together with everything else) clauses: a "symbol == literal" or
+	"symbol in [...]" clause in an EqualityIndex, failing that a range of a
+	symbol's value formed by comparisons to integers in an IntervalIndex.
+	Expressions with no such clause are residual and are candidates for
+	every record.
+
+	An expression which isn't a candidate is never evaluated, so the
+	clauses before the one it's indexed by aren't either, though
+	evaluating them might have raised an exception. So no clause after one
+	which may raise other than by looking a symbol up (see
+	optimize.may_raise) is indexed, and an expression indexed by a clause
+	after others is a candidate for any record in which one of those
+	others' symbols can't be looked up (they're its guards)."""
+
+	def __init__(self):
+		self._equality = EqualityIndex()
+		self._intervals = IntervalIndex()
+		self._residual = []
+		# maps symbols to the numbers of the expressions they guard
+		self._guards = {}
+
+	def add(self, number, parse_tree):
+		"""Index expression number (its position in the Sieve) whose parse
+		tree is parse_tree. Expressions must be added in order. Returns
+		True if it was indexed, False if it is residual."""
+
+		conjuncts = parse_tree.conjuncts()
+		# (symbol, values, position) tuples
+		equalities = []
+		# maps symbols to [low, high, position of the last clause]
+		ranges = {}
+		for (position, conjunct) in enumerate(conjuncts):
+			if optimize.may_raise(conjunct):
+				break
+			constraint = equality_constraint(conjunct)
+			if constraint is not None:
+				equalities.append(constraint + (position,))
+				continue
+			constraint = range_constraint(conjunct)
+			if constraint is not None:
+				(symbol, low, high) = constraint
+				bounds = ranges.setdefault(symbol, [None, None, position])
+				if low is not None and (bounds[0] is None or low > bounds[0]):
+					bounds[0] = low
+				if high is not None and (bounds[1] is None or high < bounds[1]):
+					bounds[1] = high
+				bounds[2] = position
+
+		if len(equalities):
+			# the fewer values a clause allows, the fewer records the
+			# expression is a candidate for
+			(symbol, values, position) = min(equalities, key=lambda c: len(c[1]))
+			self._equality.add(number, symbol, values)
+			self._guard(number, conjuncts[:position])
+			return True
+
+		if len(ranges):
+			# prefer ranges bounded on both sides
+			symbol = max(ranges, key=lambda symbol: len([b for b in ranges[symbol][:2] if b is not None]))
+			(low, high, position) = ranges[symbol]
+			self._intervals.add(number, symbol, low, high)
+			self._guard(number, conjuncts[:position])
+			return True
+
+		self._residual.append(number)
+		return False
+
+	def add_dead(self, number, symbols):
+		"""Index expression number, which can't be the first to match a
+		record (see prune.dead_expressions) but which uses the symbols in
+		the list symbols. It's a candidate only for records in which one of
+		them can't be looked up, since evaluating it might then raise where
+		the expression which makes it dead doesn't."""
+
+		for symbol in symbols:
+			self._guard_symbol(number, symbol)
+
+	def _guard(self, number, conjuncts):
+		"""Make the symbols of conjuncts (the clauses before the one
+		expression number is indexed by) its guards."""
+
+		for conjunct in conjuncts:
+			for symbol in conjunct.find_symbols():
+				self._guard_symbol(number, symbol)
+
+	def _guard_symbol(self, number, symbol):
+		numbers = self._guards.setdefault(symbol, [])
+		if len(numbers)==0 or numbers[-1]!=number:
+			numbers.append(number)
+
+	def candidates(self, lookup):
+		"""Return the numbers of the expressions which can possibly match a
+		record, in order. lookup is called with a symbol and returns its
+		value in the record."""
+
+		found = [self._residual]
+		guarded = False
+		for (symbol, numbers) in self._guards.iteritems():
+			try:
+				lookup(symbol)
+			except Exception:
+				found.append(numbers)
+				guarded = True
+		for index in (self._equality, self._intervals):
+			for symbol in index.symbols():
+				try:
+					value = lookup(symbol)
+				except Exception:
+					# the value can't be compared (ie, it's of a type not
+					# allowed in expressions). Let every expression using
+					# it find that out for itself when it's evaluated.
+					found.append(index.all_candidates(symbol))
+					continue
+				numbers = index.candidates(symbol, value)
+				if len(numbers):
+					found.append(numbers)
+
+		if len(found)==1:
+			return found[0]
+		candidates = []
+		for numbers in found:
+			candidates.extend(numbers)
+		if guarded:
+			# a guarded expression may be found twice
+			candidates = list(set(candidates))
+		candidates.sort()
+		return candidates
+
+class DependencyIndex(object):
+	"""Finds the expressions whose value may change when parts of a record
+	change: those which use a symbol at, below or above a changed path (a
+	symbol, ie, "geo" or "geo.country"). Paths only match on dot
+	boundaries, so a change to "geo" affects "geo.country" but not
+	"geography"."""
+
+	def __init__(self):
+		# maps symbols, and every dotted prefix of them, to the numbers of
+		# the expressions using symbols at or below them
+		self._below = {}
+		# maps symbols to the numbers of the expressions using them
+		self._exact = {}
+
+	def add(self, number, symbols):
+		"""Index expression number, which uses the symbols in the list
+		symbols."""
+
+		for symbol in symbols:
+			self._exact.setdefault(symbol, set()).add(number)
+			parts = symbol.split('.')
+			for i in range(1, len(parts)+1):
+				self._below.setdefault('.'.join(parts[:i]), set()).add(number)
+
+	def dependents(self, paths):
+		"""Return the numbers of the expressions using a symbol at, below or
+		above any of the paths in paths, in order."""
+
+		found = set()
+		for path in paths:
+			found.update(self._below.get(path, ()))
+			# symbols above path: a changed "geo.country" changes the value
+			# of "geo"
+			parts = path.split('.')
+			for i in range(1, len(parts)):
+				found.update(self._exact.get('.'.join(parts[:i]), ()))
+		return sorted(found)
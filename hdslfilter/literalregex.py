@@ -0,0 +1,97 @@
+
+import re
+import sre_parse
+import sre_constants
+
+#####################################################################################
+#####################################################################################
+## Many regexes in filters are really just literal strings, perhaps anchored:
+## /Doe/, /^John/, /\.exe$/, /^exact$/. Searching for those with str methods
+## (in, startswith, endswith, ==) is much cheaper than running the regex
+## engine, and gives the same answers.
+#####################################################################################
+#####################################################################################
+
+# flags which don't change what a literal pattern matches (the pattern has
+# already been parsed, so VERBOSE's effect on it is accounted for)
+harmless_flags = sre_constants.SRE_FLAG_IGNORECASE | sre_constants.SRE_FLAG_DOTALL | sre_constants.SRE_FLAG_VERBOSE
+
+# maps ASCII upper case letters to lower case, as the re module does for
+# IGNORECASE (str.lower may depend on the locale)
+ascii_lower = ''.join([chr(c + (65 <= c <= 90 and 32 or 0)) for c in range(256)])
+
+def analyze(pattern):
+	"""If the regex pattern (a string) only matches one literal string,
+	optionally anchored at the start and/or end, return a (literal, start,
+	end, ignorecase) tuple where start is True if the pattern is anchored
+	at the start, end is None if it isn't anchored at the end, '$' if it is
+	anchored with $ (which also matches before a newline at the end of the
+	string) or 'Z' if it is anchored with \\Z. Otherwise return None."""
+
+	try:
+		parsed = sre_parse.parse(pattern)
+	except (re.error, TypeError):
+		return None
+	flags = parsed.pattern.flags
+	if flags & ~harmless_flags:
+		return None
+
+	items = list(parsed)
+	start = False
+	end = None
+	if len(items) and items[0][0]==sre_constants.AT \
+	and items[0][1] in (sre_constants.AT_BEGINNING, sre_constants.AT_BEGINNING_STRING):
+		start = True
+		items = items[1:]
+	if len(items) and items[-1][0]==sre_constants.AT:
+		if items[-1][1]==sre_constants.AT_END:
+			end = '$'
+		elif items[-1][1]==sre_constants.AT_END_STRING:
+			end = 'Z'
+		else:
+			return None
+		items = items[:-1]
+
+	chars = []
+	for (op, av) in items:
+		# non-ascii characters case fold differently under IGNORECASE
+		if op != sre_constants.LITERAL or av >= 128:
+			return None
+		chars.append(chr(av))
+
+	return (''.join(chars), start, end, bool(flags & sre_constants.SRE_FLAG_IGNORECASE))
+
+def searcher(pattern):
+	"""Return a callable taking a string which returns True if the regex
+	pattern matches anywhere in it (as re.search would) and False if not.
+	Literal patterns (see analyze) are searched for with str methods,
+	others with the re module."""
+
+	analysis = analyze(pattern)
+	if analysis is None:
+		search = re.compile(pattern).search
+		return lambda string: search(string) is not None
+
+	(literal, start, end, ignorecase) = analysis
+	if ignorecase:
+		string_search = searcher_for(literal.translate(ascii_lower), start, end)
+		return lambda string: string_search(string.translate(ascii_lower))
+	return searcher_for(literal, start, end)
+
+def searcher_for(literal, start, end):
+	"""Return the callable for searcher for a literal, as analyzed by
+	analyze."""
+
+	if end=='$':
+		# $ matches at the end of the string and before a newline there
+		endings = (literal, literal + '\n')
+	else:
+		endings = (literal,)
+
+	if start and end is not None:
+		return lambda string: string in endings
+	if start:
+		return lambda string: string.startswith(literal)
+	if end is not None:
+		return lambda string: string.endswith(endings)
+	return lambda string: literal in string
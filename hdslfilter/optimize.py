@@ -0,0 +1,283 @@
+
+import re
+
+import tokenize
+import parse
+import cache
+
+#####################################################################################
+#####################################################################################
+## The optimizer rewrites a parse tree (see parse.build_expressions) into a
+## simpler one which evaluates to the same thing for every record, before it
+## is compiled. Rewrites never skip the evaluation of anything which would
+## have been evaluated before, so errors (ie, SymbolExpansionTypeError) are
+## raised for the same records as they would be without optimization.
+#####################################################################################
+#####################################################################################
+
+# types of values which a ConstantExpression can hold
+constant_types = frozenset((type(None), type(True), type(0), type(0L), type(0.0), type('')))
+
+def boolean_valued(expression):
+	"""Returns True if expression always evaluates to True or False, rather
+	than to the value of a symbol or literal (as 'and' and 'or' can)."""
+
+	for boolean_class in (parse.EqualExpression, parse.InExpression, parse.MatchExpression,
+		parse.CidrExpression, parse.CompareExpression, parse.NotExpression):
+		if issubclass(expression.__class__, boolean_class):
+			return True
+	if issubclass(expression.__class__, parse.LogicalExpression):
+		for operand in expression.operands():
+			if not boolean_valued(operand):
+				return False
+		return True
+	if issubclass(expression.__class__, parse.ConstantExpression):
+		return type(expression.value()) is type(True)
+	return False
+
+def constant(expression):
+	"""Returns a (True, value) tuple if expression's value is known at
+	compile time, otherwise (False, None)."""
+
+	if issubclass(expression.__class__, parse.ConstantExpression):
+		return (True, expression.value())
+	if issubclass(expression.__class__, parse.ValueExpression):
+		return (True, expression.token().data)
+	return (False, None)
+
+def operands(expression, ttype):
+	"""Returns the operands of a chain of ttype ('and' or 'or') operators,
+	ie, [a, b, c] for "a and (b and c)". Returns [expression] if it isn't a
+	ttype operator."""
+
+	if issubclass(expression.__class__, parse.LogicalExpression) and expression.token().ttype==ttype:
+		return expression.operands()
+	return [expression]
+
+def chain(operator, operands):
+	"""The reverse of operands: joins a list of Expressions with operator (a
+	parse.LogicalOperator), ie, "(a and b) and c"."""
+
+	expression = operands[0]
+	for operand in operands[1:]:
+		expression = parse.LogicalExpression(operator, expression, operand)
+	return expression
+
+def fold(expression, compiler):
+	"""If expression uses no symbols, return a parse.ConstantExpression of
+	its value. Otherwise, or if evaluating it fails (in which case it will
+	fail the same way for every record), return expression. compiler is a
+	filter.ClosureCompiler to evaluate it with."""
+
+	if issubclass(expression.__class__, parse.TerminalExpression):
+		return expression
+	if len(expression.find_symbols()):
+		return expression
+	try:
+		value = compiler.closure(expression)(None)
+	except Exception:
+		return expression
+	if type(value) not in constant_types:
+		return expression
+	return parse.ConstantExpression(value, expression.token())
+
+# equality ttypes which are merged in chains of each logical operator, and
+# the ttype of the membership test they're merged into
+merged_ttypes = {
+	'or': ('equal', 'in'),
+	'and': ('notequal', 'notin') }
+
+def equality(expression, ttype):
+	"""If expression is "symbol <ttype> literal" (or "literal <ttype>
+	symbol") where ttype is 'equal' or 'notequal' and literal is an int or
+	a string, return a (SymbolExpression, literal Token) tuple. Otherwise
+	return None."""
+
+	if not issubclass(expression.__class__, parse.EqualExpression) or expression.token().ttype != ttype:
+		return None
+	left = expression.left_expression()
+	right = expression.right_expression()
+	if issubclass(left.__class__, parse.ValueExpression):
+		(left, right) = (right, left)
+	if issubclass(left.__class__, parse.SymbolExpression) and issubclass(right.__class__, parse.ValueExpression) \
+	and right.token().ttype in ('int', 'string'):
+		return (left, right.token())
+	return None
+
+def merge_equalities(operands, ttype):
+	"""Given the operands of a chain of ttype operators, merge runs of
+	adjacent "symbol == literal" operands of an 'or' chain into "symbol in
+	[literals]", and runs of "symbol != literal" operands of an 'and' chain
+	into "symbol not in [literals]". Only adjacent operands are merged, so
+	nothing is evaluated in a different order."""
+
+	(equal_ttype, in_ttype) = merged_ttypes[ttype]
+	merged = []
+	i = 0
+	while i < len(operands):
+		first = equality(operands[i], equal_ttype)
+		j = i + 1
+		if first is not None:
+			(symbol, token) = first
+			tokens = [token]
+			while j < len(operands):
+				following = equality(operands[j], equal_ttype)
+				if following is None or following[0].token().data != symbol.token().data \
+				or following[1].ttype != token.ttype:
+					break
+				if following[1].data not in [t.data for t in tokens]:
+					tokens.append(following[1])
+				j += 1
+
+		if j - i > 1:
+			operator_token = operands[i].token()
+			operator = parse.InOperator(tokenize.Token(in_ttype, in_ttype=='in' and 'in' or 'not in',
+				operator_token.lineno, operator_token.linepos))
+			values = parse.ValueListExpression(tokenize.TokenList(tokens))
+			merged.append(parse.InExpression(operator, symbol, values))
+		else:
+			merged.append(operands[i])
+		i = j
+	return merged
+
+def optimize_chain(expression, compiler):
+	"""Optimize a chain of 'and' or 'or' operators (see optimize)."""
+
+	ttype = expression.token().ttype
+	flat = []
+	for operand in operands(expression, ttype):
+		flat.extend(operands(optimize(operand, compiler), ttype))
+
+	# 'and' stops at the first false operand and 'or' at the first true one,
+	# so operands after a constant which stops the chain are never evaluated
+	# and constants which don't can go. The last operand is the chain's
+	# value if it's reached, so a constant there can only go if the operand
+	# before it would have been reached with the same value (ie, "x and
+	# True" where x is boolean).
+	kept = []
+	for (i, operand) in enumerate(flat):
+		(is_constant, value) = constant(operand)
+		if not is_constant:
+			kept.append(operand)
+		elif bool(value) == (ttype=='or'):
+			kept.append(operand)
+			break
+		elif i == len(flat)-1 and (len(kept)==0 or not boolean_valued(kept[-1]) or type(value) is not type(True)):
+			kept.append(operand)
+
+	# once a boolean operand has been evaluated, evaluating it again
+	# further along the chain can only give the same answer
+	if len([operand for operand in kept if not boolean_valued(operand)])==0:
+		seen = set()
+		unique = []
+		for operand in kept:
+			key = operand.key()
+			if key not in seen:
+				seen.add(key)
+				unique.append(operand)
+		kept = unique
+
+	kept = merge_equalities(kept, ttype)
+
+	if len(kept)==1:
+		return kept[0]
+	return chain(expression.operator(), kept)
+
+def optimize(expression, compiler):
+	"""Return an optimized version of the parse tree rooted at expression
+	(which is left unchanged). compiler is a filter.ClosureCompiler to
+	evaluate constant subexpressions with. The optimizations are:
+
+	- subexpressions which use no symbols are evaluated (see fold)
+	- nested 'and' and 'or' chains are flattened, constants removed from
+	  them, and repeated boolean operands removed
+	- "s == 1 or s == 2" becomes "s in [1, 2]" and "s != 1 and s != 2"
+	  becomes "s not in [1, 2]" (see merge_equalities)
+	- "not not x" becomes x, if x is boolean."""
+
+	if issubclass(expression.__class__, parse.LogicalExpression):
+		return optimize_chain(expression, compiler)
+
+	if issubclass(expression.__class__, parse.NotExpression):
+		right = optimize(expression.right_expression(), compiler)
+		if issubclass(right.__class__, parse.NotExpression) and boolean_valued(right.right_expression()):
+			return right.right_expression()
+		if right is not expression.right_expression():
+			expression = parse.NotExpression(expression.operator(), right)
+		return fold(expression, compiler)
+
+	if issubclass(expression.__class__, parse.BinaryExpression):
+		left = optimize(expression.left_expression(), compiler)
+		right = optimize(expression.right_expression(), compiler)
+		if left is not expression.left_expression() or right is not expression.right_expression():
+			expression = parse.build_expression(expression.operator(), left, right)
+		return fold(expression, compiler)
+
+	return expression
+
+def subtrees(expression):
+	"""Return a list of every non-terminal Expression in the parse tree
+	rooted at expression, including expression itself. A chain of 'and' or
+	'or' operators is one Expression, its root (see
+	parse.LogicalExpression.operands)."""
+
+	found = []
+	pending = [expression]
+	while pending:
+		expression = pending.pop()
+		if issubclass(expression.__class__, parse.LogicalExpression):
+			pending.extend(expression.operands())
+		elif issubclass(expression.__class__, parse.BinaryExpression):
+			pending.append(expression.left_expression())
+			pending.append(expression.right_expression())
+		elif issubclass(expression.__class__, parse.NotExpression):
+			pending.append(expression.right_expression())
+		else:
+			continue
+		found.append(expression)
+	return found
+
+def may_raise(expression):
+	"""Returns True if evaluating expression can raise an exception even
+	when every symbol it uses can be looked up: if it matches against a
+	regex which isn't a literal string (ie, "m =~ p", where p's value may
+	not be a string, or not a valid regex) or is one which doesn't
+	compile."""
+
+	for subtree in subtrees(expression):
+		if issubclass(subtree.__class__, parse.MatchExpression):
+			right = subtree.right_expression()
+			if not issubclass(right.__class__, parse.ValueExpression) \
+			or not isinstance(right.token().data, basestring):
+				return True
+			try:
+				cache.regexes.searcher(right.token().data)
+			except re.error:
+				return True
+	return False
+
+def cheap(expression):
+	"""Returns True if looking up a memoized value for expression would
+	cost about as much as evaluating it: it's a simple comparison of
+	symbols and literals (or the negation of one)."""
+
+	if issubclass(expression.__class__, parse.NotExpression):
+		return cheap(expression.right_expression())
+	for cheap_class in (parse.EqualExpression, parse.CompareExpression, parse.InExpression):
+		if issubclass(expression.__class__, cheap_class):
+			return issubclass(expression.left_expression().__class__, parse.TerminalExpression) \
+			and issubclass(expression.right_expression().__class__, parse.TerminalExpression)
+	return False
+
+def shared_subtrees(trees):
+	"""Return the set of keys (see parse.Expression.key) of the subtrees
+	which appear more than once in the list of parse trees trees, and which
+	are worth evaluating only once per record (see cheap)."""
+
+	counts = {}
+	for tree in trees:
+		for expression in subtrees(tree):
+			if not cheap(expression):
+				key = expression.key()
+				counts[key] = counts.get(key, 0) + 1
+	return set([key for (key, count) in counts.iteritems() if count > 1])
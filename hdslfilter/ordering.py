@@ -0,0 +1,175 @@
+
+import time
+
+#####################################################################################
+#####################################################################################
+## Adaptive evaluation order (see Sieve). When any of several things (the
+## operands of an 'or', the expressions of a Sieve) deciding the outcome ends
+## the evaluation, the order they're tried in doesn't change the outcome, but
+## trying cheap ones which often decide it first makes evaluation faster.
+## These keep count of how often each one decides the outcome and how long it
+## takes, and periodically reorder them.
+##
+## The order can change whether an exception is raised, though: in order, "a
+## or b" raises if a does, even when b is true. Most exceptions come from
+## looking symbols up (see filter.SymbolTable), so once something decides the
+## outcome, the symbols of everything before it (in the original order) are
+## looked up too. The rest come from matching against regexes which aren't
+## known until evaluation time (see optimize.may_raise), so anything before
+## it which does that and hasn't been evaluated yet is evaluated too. If
+## anything raises, the evaluation is done again in the original order, so
+## the outcome, or the exception, is always the same as it would have been.
+#####################################################################################
+#####################################################################################
+
+# one evaluation in this many is timed
+sample_interval = 16
+# the order is worked out again after this many evaluations
+reorder_interval = 1024
+
+class Statistics(object):
+	"""How often each of a number of alternatives has been evaluated, how
+	often it decided the outcome, and how long the timed evaluations of it
+	took."""
+
+	def __init__(self, count):
+		self.evaluations = [0] * count
+		self.decisive = [0] * count
+		self.timed = [0] * count
+		self.seconds = [0.0] * count
+
+	def order(self):
+		"""Return the numbers of the alternatives in the order which should
+		decide the outcome soonest: by ascending expected time per decision
+		(cost divided by the chance of deciding), which is the best order
+		for independent alternatives. Ties keep their original order."""
+
+		count = len(self.evaluations)
+		costs = [self.seconds[i] / self.timed[i] for i in range(count) if self.timed[i]]
+		if len(costs):
+			default_cost = sum(costs) / len(costs)
+		else:
+			default_cost = 1.0
+
+		scores = []
+		for i in range(count):
+			if self.timed[i]:
+				cost = self.seconds[i] / self.timed[i]
+			else:
+				cost = default_cost
+			# counting one extra decision and one extra miss, so that a
+			# seldom tried alternative isn't written off (or trusted) on
+			# the strength of a few evaluations
+			chance = (self.decisive[i] + 1.0) / (self.evaluations[i] + 2.0)
+			scores.append((cost / chance, i))
+		scores.sort()
+		return [i for (score, i) in scores]
+
+	def ranks(self):
+		"""Return a list mapping the number of each alternative to its
+		position in order()."""
+		return positions(self.order())
+
+def guards(symbol_lists):
+	"""Given the lists of symbols used by each of several things in order,
+	return a list of tuples of the symbols used by the things before each
+	one."""
+
+	found = []
+	before = []
+	for symbols in symbol_lists:
+		found.append(tuple(before))
+		for symbol in symbols:
+			if symbol not in before:
+				before.append(symbol)
+	return found
+
+def forced(raising):
+	"""Given a list of whether each of several things in order may raise
+	an exception other than by looking a symbol up (see
+	optimize.may_raise), return a list of tuples of the numbers of the
+	things before each one which may."""
+
+	found = []
+	before = []
+	for (i, may_raise) in enumerate(raising):
+		found.append(tuple(before))
+		if may_raise:
+			before.append(i)
+	return found
+
+def positions(order):
+	"""Return a list mapping the number of each thing to its position in
+	order (a list of their numbers)."""
+	found = [0] * len(order)
+	for (position, i) in enumerate(order):
+		found[i] = position
+	return found
+
+class Chain(object):
+	"""Evaluates an 'and' or 'or' chain of boolean operands, given their
+	closures (see parse.Expression.closure) and the symbols each uses,
+	trying the operands in the order most likely to end the chain soonest.
+	Only boolean operands (see optimize.boolean_valued) may be reordered,
+	since the value of a chain of other operands depends on which is
+	evaluated last. raising is a list of whether each operand may raise an
+	exception other than by looking a symbol up (see optimize.may_raise)."""
+
+	def __init__(self, ttype, closures, symbol_lists, raising):
+		# an operand with this truth value ends the chain
+		self._stop = ttype=='or'
+		self._closures = closures
+		self._guards = guards(symbol_lists)
+		self._forced = forced(raising)
+		self._order = range(len(closures))
+		self._ranks = range(len(closures))
+		self._statistics = Statistics(len(closures))
+		self._count = 0
+
+	def __call__(self, s):
+		self._count += 1
+		if self._count % reorder_interval == 0:
+			self._order = self._statistics.order()
+			self._ranks = positions(self._order)
+		timing = self._count % sample_interval == 0
+		statistics = self._statistics
+		closures = self._closures
+		stop = self._stop
+
+		try:
+			for i in self._order:
+				statistics.evaluations[i] += 1
+				if timing:
+					start = time.time()
+					value = closures[i](s)
+					statistics.timed[i] += 1
+					statistics.seconds[i] += time.time() - start
+				else:
+					value = closures[i](s)
+				if bool(value)==stop:
+					statistics.decisive[i] += 1
+					for symbol in self._guards[i]:
+						s[symbol]
+					# the operands before this one which may raise, and are
+					# after it in the current order
+					for j in self._forced[i]:
+						if self._ranks[j] > self._ranks[i]:
+							closures[j](s)
+					return value
+			return value
+		except Exception:
+			return self.in_order(s)
+
+	def in_order(self, s):
+		"""Evaluate the chain in its original order."""
+		stop = self._stop
+		for closure in self._closures:
+			value = closure(s)
+			if bool(value)==stop:
+				return value
+		return value
+
+	def order(self):
+		"""Return the order the operands (by their position in the chain)
+		are currently tried in."""
+		return list(self._order)
@@ -1,14 +1,19 @@
 import re
+from operator import lt, le, gt, ge
 
 import tokenize
 import debug
 import errors
+import cidr
+import valuefile
 
 
 ##################################################################################
 ##################################################################################
 # These functions massage lists of Tokens in various ways to prepare for further
-# processing
+# processing. parse now builds parse trees in a single pass (see Parser), and
+# only uses these (along with nodeify and build_expressions) for input Parser
+# doesn't accept, so that errors are reported as they always have been.
 ##################################################################################
 ##################################################################################
 
@@ -17,22 +22,28 @@ def listify(tokens):
 	transforms them into TokenList objects. The returned list will contain 
 	Token and TokenList objects."""
 
+	# tokens are consumed from the end of a reversed copy, as popping them
+	# from the front of the list takes time proportional to its length
+	pending = tokens[::-1]
 	new_list = []
-	#for i in range(0,len(tokens)):
-	while len(tokens)>0:
-		token = tokens.pop(0)
-		if token.ttype=='openbracket':
-			token_list = tokenize.TokenList()
-			token = tokens.pop(0)
-			while token.ttype!='closebracket':
-				if token.ttype == 'comma':
-					pass
-				else:
-					token_list.add_token(token)
-				token = tokens.pop(0)
-			new_list.append(token_list)
-		else:
-			new_list.append(token)
+	try:
+		while len(pending)>0:
+			token = pending.pop()
+			if token.ttype=='openbracket':
+				token_list = tokenize.TokenList()
+				token = pending.pop()
+				while token.ttype!='closebracket':
+					if token.ttype == 'comma':
+						pass
+					else:
+						token_list.add_token(token)
+					token = pending.pop()
+				new_list.append(token_list)
+			else:
+				new_list.append(token)
+	finally:
+		# the tokens which have been dealt with are removed from the list
+		del tokens[:len(tokens)-len(pending)]
 	return new_list		
 
 
@@ -40,14 +51,24 @@ def listify(tokens):
 def parenthesize(tokens,root=True):
 	""" takes an array of Tokens, returns an array with further arrays
 	of tokens. The groupings are by parenthesis tokens in the array."""
-	
+
+	pending = tokens[::-1]
+	try:
+		return parenthesize_reversed(pending, root)
+	finally:
+		del tokens[:len(tokens)-len(pending)]
+
+def parenthesize_reversed(tokens, root):
+	"""parenthesize, for tokens in reverse order (the next one is the last
+	in the list)."""
+
 	list = []
 
 	while len(tokens)!=0:
-		token = tokens.pop(0)
+		token = tokens.pop()
 		if issubclass(token.__class__, tokenize.Token):
 			if token.ttype=='oparen':
-				list.append( parenthesize(tokens,False) )
+				list.append( parenthesize_reversed(tokens,False) )
 			elif token.ttype=='cparen':
 				if root:
 					raise errors.ExcessCloseParen(token)
@@ -65,10 +86,98 @@ def parenthesize(tokens,root=True):
 	else:
 		raise errors.UnclosedParen(token)
 
+def tokenless(tokens):
+	"""Return True if the list tokens (from parenthesize) holds no tokens,
+	only lists which hold none either: empty parentheses (which aren't
+	valid input). All such lists of the same shape are equal to each
+	other."""
+	for element in tokens:
+		if type(element) != type([]) or not tokenless(element):
+			return False
+	return True
+
+def ambiguous(tokens):
+	"""Return True if more than one element of the list tokens is a list
+	of no tokens (see tokenless), so that list.index and list.remove may
+	find the wrong one."""
+	return len([element for element in tokens if type(element)==type([]) and tokenless(element)]) > 1
+
 def apply_precedence_2(tokens):
 	"""takes an array of Tokens, returns the array with certain higher
 	precedence operations grouped into subarrays. This applies precedence
-	for second level precedence operators (not)."""
+	for second level precedence operators (not). It's done in one pass
+	over the array, which is changed in place."""
+	assert type(tokens) == type([])
+
+	if ambiguous(tokens):
+		return apply_precedence_2_by_equality(tokens)
+
+	grouped = []
+	i = 0
+	while i != len(tokens):
+		token = tokens[i]
+
+		if type(token) == type([]):
+			apply_precedence_2(token)
+
+		elif not issubclass(token.__class__, tokenize.TokenList) and token.ttype == 'not':
+			if i == len(tokens)-1:
+				raise errors.MissingOperand(token, 'right')
+			# the operand isn't looked at again, so "not not a" groups
+			# the two nots together
+			right_operand = tokens[i+1]
+			if type(right_operand)==type([]):
+				apply_precedence_2(right_operand)
+			token = [token, right_operand]
+			i+=1
+
+		grouped.append(token)
+		i+=1
+
+	tokens[:] = grouped
+	return tokens
+
+def apply_precedence_1(tokens):
+	"""takes an array of Tokens, returns the array with certain higher
+	precedence operations grouped into subarrays. This applies precedence
+	for highest precedence operators (ordinary binary operators). It's
+	done in one pass over the array, which is changed in place."""
+
+	assert type(tokens) == type([])
+
+	if ambiguous(tokens):
+		return apply_precedence_1_by_equality(tokens)
+
+	grouped = []
+	i = 0
+	while i != len(tokens):
+		token = tokens[i]
+
+		if type(token) == type([]):
+			apply_precedence_1(token)
+
+		elif not issubclass(token.__class__, tokenize.TokenList) and token.ttype in ('equal', 'match', 'notequal', 'stringequal', 'stringnotequal','in','notin','incidr','notincidr','lt','le','gt','ge'):
+			if len(grouped)==0:
+				raise errors.MissingOperand(token,'left')
+			if i==len(tokens)-1:
+				raise errors.MissingOperand(token,'right')
+			# the left operand is the last thing grouped, which may be an
+			# operation itself (so they're grouped left to right); the
+			# right operand isn't looked at again
+			grouped[-1] = [grouped[-1], token, tokens[i+1]]
+			i+=2
+			continue
+
+		grouped.append(token)
+		i+=1
+
+	tokens[:] = grouped
+	return tokens
+
+def apply_precedence_2_by_equality(tokens):
+	"""apply_precedence_2 as it was always done, finding operators and
+	operands with list.index and list.remove (see
+	apply_precedence_1_by_equality)."""
 	assert type(tokens) == type([])
 	
 	i = 0
@@ -110,10 +219,13 @@ def apply_precedence_2(tokens):
 		i+=1
 	return tokens
 
-def apply_precedence_1(tokens):
-	"""takes an array of Tokens, returns the array with certain higher
-	precedence operations grouped into subarrays. This applies precedence
-	for highest precedence operators (ordinary binary operators)."""
+def apply_precedence_1_by_equality(tokens):
+	"""apply_precedence_1 as it was always done, finding operators and
+	operands with list.index and list.remove. Those find the first element
+	equal to the one wanted, which isn't always the one meant when a list
+	holds more than one empty pair of parentheses (see tokenless). Each
+	lookup takes time proportional to the length of tokens, so the whole
+	takes time proportional to its square."""
 
 	assert type(tokens) == type([])
 	
@@ -129,7 +241,7 @@ def apply_precedence_1(tokens):
 		if type(token) == type([]):
 			tokens[ tokens.index(token) ] = apply_precedence_1(token)
 
-		elif token.ttype in ('equal', 'match', 'notequal', 'stringequal', 'stringnotequal','in','notin'):
+		elif token.ttype in ('equal', 'match', 'notequal', 'stringequal', 'stringnotequal','in','notin','incidr','notincidr','lt','le','gt','ge'):
 			if tokens.index(token)==0:
 				raise errors.MissingOperand(token,'left')
 			if tokens.index(token)==len(tokens)-1:
@@ -199,6 +311,14 @@ class InOperator(BinaryOperator):
 	def token_types(self):
 		return ('in','notin')
 
+class CidrOperator(BinaryOperator):
+	def token_types(self):
+		return ('incidr','notincidr')
+
+class CompareOperator(BinaryOperator):
+	def token_types(self):
+		return ('lt','le','gt','ge')
+
 class UnaryOperator(Operator):
 	def want_left_operand(self):
 		return False
@@ -243,6 +363,34 @@ class Expression(object):
 		used in this parse tree."""
 
 		raise NotImplementedError()
+
+	def conjuncts(self):
+
+		"""Returns a list of the Expressions which must all be true for this
+		one to be true: the operands of a chain of 'and' operators, or just
+		this Expression if it isn't one."""
+
+		return [self]
+
+	def key(self):
+
+		"""Returns a hashable value which is equal for two Expressions if
+		and only if their parse trees are the same (but for how a chain
+		of 'and' or 'or' operators is grouped), so that they always
+		evaluate to the same thing for the same record."""
+
+		raise NotImplementedError()
+
+	def closure(self, compiler):
+
+		"""Returns a python callable which evaluates this parse tree. The
+		callable takes one argument, the symbol table (the same thing that
+		is named SYMBOL in the namespace of the code returned by compile)
+		and returns what evaluating compile()'s code would. compiler is a
+		filter.ClosureCompiler; subexpressions must be built by calling its
+		closure method, not by calling their closure methods directly."""
+
+		raise NotImplementedError()
 	
 class BinaryExpression(Expression):
 	def dump(self, ilevel=0):
@@ -256,6 +404,18 @@ class BinaryExpression(Expression):
 
 	def token(self):
 		return self._operator.token()
+
+	def operator(self):
+		return self._operator
+
+	def left_expression(self):
+		return self._left_expression
+
+	def right_expression(self):
+		return self._right_expression
+
+	def key(self):
+		return (self.token().ttype, self._left_expression.key(), self._right_expression.key())
 	
 	def __repr__(self):
 		return '%s.%s(%s,%s,%s)' % (
@@ -292,6 +452,17 @@ class MatchExpression(BinaryExpression):
 	def compile(self):
 		return 'RC.match(%s,%s)' % (self._left_expression.compile(), self._right_expression.compile())
 
+	def closure(self, compiler):
+		left = compiler.closure(self._left_expression)
+		if issubclass(self._right_expression.__class__, ValueExpression):
+			# regex is known now, so it can be compiled now
+			match = compiler.regex(self._right_expression.token().data)
+			return lambda s: match(left(s))
+
+		right = compiler.closure(self._right_expression)
+		match = compiler.regex_cache().match
+		return lambda s: match(left(s), right(s))
+
 class LogicalExpression(BinaryExpression):
 	def __init__(self, operator, left_expression, right_expression):
 		if not issubclass(operator.__class__, LogicalOperator):
@@ -305,12 +476,117 @@ class LogicalExpression(BinaryExpression):
 		self._left_expression = left_expression
 		self._right_expression = right_expression
 
+	# A chain of the same operator ("a or b or c ...") is a left-nested
+	# tree as deep as it is long, and a sieve can have thousands of
+	# operands in one (a list of hosts, say). So chains are walked, keyed,
+	# compiled and evaluated as one list of operands, never recursively,
+	# which would run out of stack.
+
+	def operands(self):
+		"""Returns the operands of the chain of operators of this one's
+		ttype which this is the root of, ie, [a, b, c] for "a and (b and
+		c)"."""
+
+		ttype = self.token().ttype
+		found = []
+		pending = [self]
+		while pending:
+			expression = pending.pop()
+			if issubclass(expression.__class__, LogicalExpression) and expression.token().ttype==ttype:
+				pending.append(expression._right_expression)
+				pending.append(expression._left_expression)
+			else:
+				found.append(expression)
+		return found
+
+	def find_symbols(self):
+		symbols = []
+		for operand in self.operands():
+			symbols.extend(operand.find_symbols())
+		return symbols
+
+	def key(self):
+		return tuple([self.token().ttype] + [operand.key() for operand in self.operands()])
+
+	def __repr__(self):
+		# the same as BinaryExpression's, built from a stack of the parts
+		# still to be written
+		parts = []
+		pending = [self]
+		while pending:
+			expression = pending.pop()
+			if issubclass(expression.__class__, str):
+				parts.append(expression)
+			elif issubclass(expression.__class__, LogicalExpression):
+				pending.extend([')', expression._right_expression, ',', expression._left_expression,
+					'%s.%s(%s,' % (expression.__module__, expression.__class__.__name__, repr(expression._operator))])
+			else:
+				parts.append(repr(expression))
+		return ''.join(parts)
+
+	def __reduce__(self):
+		# pickled as the links of the chain down its left side (which is
+		# how optimize.chain builds them), so that pickle doesn't recurse
+		# once per operand
+		links = []
+		expression = self
+		while issubclass(expression.__class__, LogicalExpression):
+			links.append((expression._operator, expression._right_expression))
+			expression = expression._left_expression
+		links.reverse()
+		return (join_links, (expression, links))
+
+	def compile(self):
+		# the token data may be '&&' or '||', which python doesn't know
+		return '(%s)' % (' %s ' % self.token().ttype).join([operand.compile() for operand in self.operands()])
+
+	def conjuncts(self):
+		if self.token().ttype=='and':
+			return self.operands()
+		else:
+			return [self]
+
+	def closure(self, compiler):
+		closures = [compiler.closure(operand) for operand in self.operands()]
+		if len(closures)==2:
+			(left, right) = closures
+			if self.token().ttype=='and':
+				return lambda s: left(s) and right(s)
+			else:
+				return lambda s: left(s) or right(s)
+
+		last = closures.pop()
+		if self.token().ttype=='and':
+			def closure(s):
+				for operand in closures:
+					value = operand(s)
+					if not value:
+						return value
+				return last(s)
+		else:
+			def closure(s):
+				for operand in closures:
+					value = operand(s)
+					if value:
+						return value
+				return last(s)
+		return closure
+
+def join_links(expression, links):
+	"""Rebuild a chain of LogicalExpressions pickled by
+	LogicalExpression.__reduce__: expression is the leftmost operand and
+	links a list of (LogicalOperator, right operand) tuples."""
+
+	for (operator, right_expression) in links:
+		expression = LogicalExpression(operator, expression, right_expression)
+	return expression
+
 class InExpression(BinaryExpression):
 	def __init__(self, operator, left_expression, right_expression):
 		if not issubclass(operator.__class__, InOperator):
 			raise TypeError('InOperator subclass required')
-		if not issubclass(right_expression.__class__, ValueListExpression):
-			raise TypeError('ValueListExpression required for right operand')
+		if not issubclass(right_expression.__class__, ValueListExpression) and not issubclass(right_expression.__class__, ValueFileExpression):
+			raise TypeError('ValueListExpression or ValueFileExpression required for right operand')
 		
 		if not issubclass(SymbolExpression, left_expression.__class__) and not issubclass(ValueExpression, left_expression.__class__):
 			raise TypeError('ValueExpression or SymbolExpression required for left operand')
@@ -329,6 +605,126 @@ class InExpression(BinaryExpression):
 			self._left_expression.compile(), 
 			text,
 			self._right_expression.compile() )
+
+	def closure(self, compiler):
+		left = compiler.closure(self._left_expression)
+		values = self._right_expression.value_set()
+		if self._operator.token().ttype=='in':
+			return lambda s: left(s) in values
+		else:
+			return lambda s: left(s) not in values
+	
+class CidrExpression(BinaryExpression):
+	def __init__(self, operator, left_expression, right_expression):
+		if not issubclass(operator.__class__, CidrOperator):
+			raise TypeError('CidrOperator subclass required')
+		if not issubclass(right_expression.__class__, ValueListExpression):
+			raise TypeError('ValueListExpression required for right operand')
+		
+		if not issubclass(SymbolExpression, left_expression.__class__) and not issubclass(ValueExpression, left_expression.__class__):
+			raise TypeError('ValueExpression or SymbolExpression required for left operand')
+
+		# catch bad networks now rather than at eval time
+		for token in right_expression.token().contents():
+			if token.ttype != 'string':
+				raise errors.InvalidNetwork(token)
+			try:
+				cidr.parse_network(token.data)
+			except ValueError:
+				raise errors.InvalidNetwork(token)
+
+		self._operator = operator
+		self._left_expression = left_expression
+		self._right_expression = right_expression
+
+	def negated(self):
+		"""Returns True for "not in cidr", False for "in cidr"."""
+		return self._operator.token().ttype=='notincidr'
+
+	def networks(self):
+		"""Returns the list of networks (strings) in the right operand."""
+		return self._right_expression.values()
+
+	def compile(self):
+		text = 'NET.match(%s,%s)' % (
+			self._left_expression.compile(),
+			self._right_expression.token().python_repr() )
+		if self.negated():
+			return '(not %s)' % text
+		else:
+			return text
+
+	def closure(self, compiler):
+		left = compiler.closure(self._left_expression)
+		contains = compiler.networks(self.networks())
+		if self.negated():
+			return lambda s: not contains(left(s))
+		else:
+			return lambda s: contains(left(s))
+	
+# types of values which <, <=, > and >= compare. Comparisons involving
+# anything else (ie, None for a missing symbol, or a string) are false.
+numeric_types = frozenset((type(0), type(0L), type(0.0)))
+
+# python functions for the comparison operators' token types
+comparisons = {
+	'lt': lt,
+	'le': le,
+	'gt': gt,
+	'ge': ge }
+
+# the comparison with its operands swapped, ie, "1 < x" is "x > 1"
+swapped_comparisons = {
+	'lt': 'gt',
+	'le': 'ge',
+	'gt': 'lt',
+	'ge': 'le' }
+
+class CompareExpression(BinaryExpression):
+	def __init__(self, operator, left_expression, right_expression):
+		if not issubclass(operator.__class__, CompareOperator):
+			raise TypeError('CompareOperator subclass required')
+
+		for operand in (left_expression, right_expression):
+			if not issubclass(SymbolExpression, operand.__class__) and not issubclass(ValueExpression, operand.__class__):
+				raise TypeError('ValueExpression or SymbolExpression required for operands')
+			if issubclass(ValueExpression, operand.__class__) and operand.token().ttype != 'int':
+				raise errors.NonNumericOperand(operand.token())
+
+		self._operator = operator
+		self._left_expression = left_expression
+		self._right_expression = right_expression
+
+	def compile(self):
+		return 'CMP.%s(%s,%s)' % (
+			self.token().ttype,
+			self._left_expression.compile(),
+			self._right_expression.compile() )
+
+	def closure(self, compiler):
+		left = compiler.closure(self._left_expression)
+		right = compiler.closure(self._right_expression)
+		compare = comparisons[self.token().ttype]
+		def closure(s):
+			l = left(s)
+			r = right(s)
+			return type(l) in numeric_types and type(r) in numeric_types and compare(l, r)
+		return closure
+
+	def bound(self):
+		"""If this is "symbol <op> integer" or "integer <op> symbol", return
+		a (symbol, op, integer) tuple with the symbol on the left (op being
+		a token type, swapped if need be). Otherwise return None."""
+
+		left = self._left_expression
+		right = self._right_expression
+		ttype = self.token().ttype
+		if issubclass(left.__class__, ValueExpression):
+			(left, right) = (right, left)
+			ttype = swapped_comparisons[ttype]
+		if issubclass(left.__class__, SymbolExpression) and issubclass(right.__class__, ValueExpression):
+			return (left.token().data, ttype, right.token().data)
+		return None
 	
 class EqualExpression(BinaryExpression):
 	def __init__(self, operator, left_expression, right_expression):
@@ -343,6 +739,22 @@ class EqualExpression(BinaryExpression):
 		self._left_expression = left_expression
 		self._right_expression = right_expression
 
+	def closure(self, compiler):
+		left = compiler.closure(self._left_expression)
+		equal = self.token().ttype=='equal'
+		if issubclass(self._right_expression.__class__, ValueExpression):
+			value = self._right_expression.token().data
+			if equal:
+				return lambda s: left(s) == value
+			else:
+				return lambda s: left(s) != value
+
+		right = compiler.closure(self._right_expression)
+		if equal:
+			return lambda s: left(s) == right(s)
+		else:
+			return lambda s: left(s) != right(s)
+
 class NotExpression(Expression):
 	def __init__(self, operator, right_expression):
 		if not issubclass(operator.__class__, NotOperator):
@@ -359,6 +771,15 @@ class NotExpression(Expression):
 	def token(self):
 		return self._operator.token()
 
+	def operator(self):
+		return self._operator
+
+	def right_expression(self):
+		return self._right_expression
+
+	def key(self):
+		return ('not', self._right_expression.key())
+
 	def dump(self,ilevel=0):
 		rv= '%s%s\n' % (Expression.dump_space*ilevel, self.dump_repr())
 		rv += self._right_expression.dump(ilevel+1)
@@ -369,6 +790,10 @@ class NotExpression(Expression):
 	
 	def compile(self):
 		return '(not %s)' % self._right_expression.compile()
+
+	def closure(self, compiler):
+		right = compiler.closure(self._right_expression)
+		return lambda s: not right(s)
 	
 class TerminalExpression(Expression):
 	def token(self):
@@ -399,8 +824,15 @@ class SymbolExpression(TerminalExpression):
 	def find_symbols(self):
 		return [self._value_token.data]
 
+	def key(self):
+		return ('symbol', self._value_token.data)
+
 	def compile(self):
 		return ' SYMBOL[%s] ' % repr(self._value_token.data)
+
+	def closure(self, compiler):
+		symbol = self._value_token.data
+		return lambda s: s[symbol]
 	
 class ValueListExpression(TerminalExpression):
 	def __init__(self,value_token):
@@ -409,11 +841,65 @@ class ValueListExpression(TerminalExpression):
 		self._value_token = value_token
 	
 	def compile(self):
-		return self._value_token.python_repr()
+		return 'VS.set(%s)' % repr(self._value_token.python_repr())
+
+	def values(self):
+		"""Returns the python values of the list members."""
+		return [token.data for token in self._value_token.contents()]
+
+	def value_set(self):
+		"""Returns the python values of the list members as a frozenset."""
+		return frozenset(self.values())
+
+	def key(self):
+		return ('list', self._value_token.type(), tuple(self.values()))
+
+	def closure(self, compiler):
+		values = self.value_set()
+		return lambda s: values
 	
 	def __repr__(self):
 		return '%s.%s(%s)' % (self.__module__, self.__class__.__name__, repr(self._value_token))
 
+class ValueFileExpression(TerminalExpression):
+	"""A value file (@"/path/to/file"), which holds one string value per
+	line. The file is read when the expression is built, so that a missing
+	or unreadable file is a compile time error."""
+
+	def __init__(self, value_token):
+		if not issubclass(tokenize.Token, value_token.__class__):
+			raise TypeError('tokenize.Token sublcass required')
+		if value_token.ttype != 'valuefile':
+			raise ValueError('valuefile token type required')
+		self._value_token = value_token
+		try:
+			self._values = valuefile.load(value_token.data)
+		except (IOError, OSError), e:
+			raise errors.UnreadableValueFile(value_token, e)
+
+	def __getstate__(self):
+		# the file is read again when unpickled (see snapshot), as it may
+		# have changed since
+		return self._value_token
+
+	def __setstate__(self, value_token):
+		self.__init__(value_token)
+
+	def compile(self):
+		return 'VS.file(%s)' % repr(self._value_token.data)
+
+	def key(self):
+		return ('valuefile', self._values.path)
+
+	def value_set(self):
+		"""Returns the values in the file, as something which supports 'in'
+		(see valuefile.load)."""
+		return self._values
+
+	def closure(self, compiler):
+		values = self._values
+		return lambda s: values
+
 class ValueExpression(TerminalExpression):
 	def __init__(self, value_token):
 		if not issubclass(tokenize.Token, value_token.__class__):
@@ -425,6 +911,41 @@ class ValueExpression(TerminalExpression):
 	def compile(self):
 		return repr(self._value_token.data)
 
+	def key(self):
+		return (self._value_token.ttype, self._value_token.data)
+
+	def closure(self, compiler):
+		value = self._value_token.data
+		return lambda s: value
+
+class ConstantExpression(TerminalExpression):
+	"""An expression whose value was worked out at compile time (see
+	optimize.fold). token is the token of the expression it replaced, for
+	error messages."""
+
+	def __init__(self, value, token):
+		self._value = value
+		self._value_token = token
+
+	def value(self):
+		return self._value
+
+	def compile(self):
+		return repr(self._value)
+
+	def key(self):
+		return ('constant', type(self._value), self._value)
+
+	def closure(self, compiler):
+		value = self._value
+		return lambda s: value
+
+	def __repr__(self):
+		return '%s.%s(%s,%s)' % (self.__module__, self.__class__.__name__, repr(self._value), repr(self._value_token))
+
+	def dump_repr(self):
+		return 'ConstantExpression(%s)' % repr(self._value)
+
 ###############################################################################
 
 def nodeify(tokens):
@@ -442,10 +963,16 @@ def nodeify(tokens):
 				tokens[i] = EqualOperator(tokens[i])
 			elif tokens[i].ttype in ('in','notin'):
 				tokens[i] = InOperator(tokens[i])
+			elif tokens[i].ttype in ('incidr','notincidr'):
+				tokens[i] = CidrOperator(tokens[i])
+			elif tokens[i].ttype in ('lt','le','gt','ge'):
+				tokens[i] = CompareOperator(tokens[i])
 			elif tokens[i].ttype in ('int','string','regex'):
 				tokens[i] = ValueExpression(tokens[i])
 			elif tokens[i].ttype in ('symbol'):
 				tokens[i] = SymbolExpression(tokens[i])
+			elif tokens[i].ttype == 'valuefile':
+				tokens[i] = ValueFileExpression(tokens[i])
 			elif tokens[i].ttype in ('and','or'):
 				tokens[i] = LogicalOperator(tokens[i])
 			elif tokens[i].ttype in ('not'):
@@ -503,6 +1030,10 @@ def build_expression(operator, left_operand=None, right_operand=None):
 			return MatchExpression(operator, left_operand, right_operand)
 		elif issubclass(operator.__class__, InOperator):
 			return InExpression(operator, left_operand, right_operand)
+		elif issubclass(operator.__class__, CidrOperator):
+			return CidrExpression(operator, left_operand, right_operand)
+		elif issubclass(operator.__class__, CompareOperator):
+			return CompareExpression(operator, left_operand, right_operand)
 
 	if issubclass(operator.__class__, NotOperator):
 		if left_operand is not None or right_operand is None:
@@ -524,8 +1055,9 @@ def build_expressions(node_list):
 		if type(node_list[i]) == type([]):
 			node_list[i] = build_expressions(node_list[i])
 
-	while len(node_list)>0:
-		node = node_list.pop(0)
+	pending = node_list[::-1]
+	while len(pending)>0:
+		node = pending.pop()
 
 		if issubclass(node.__class__, Operator):
 			if node.want_left_operand():
@@ -546,17 +1078,17 @@ def build_expressions(node_list):
 
 			if node.want_right_operand():
 
-				if len(node_list)==0:
+				if len(pending)==0:
 					#raise InsufficientOperands(node,'right')
 					raise errors.MissingOperand(node.token(), 'right')
-				if not issubclass(node_list[0].__class__, Expression):
-					if issubclass(node_list[0].__class__, Operator):
+				if not issubclass(pending[-1].__class__, Expression):
+					if issubclass(pending[-1].__class__, Operator):
 						#raise ValueError('wanted an expr, got operator')
 						raise errors.OperatorInsteadOfOperand(node.token(), 'right')
 					else:
-						raise TypeError('Unknown object in node list: %s' % str(node_list[0]))
+						raise TypeError('Unknown object in node list: %s' % str(pending[-1]))
 						
-				right_operand = node_list.pop(0)
+				right_operand = pending.pop()
 			else:
 				right_operand = None
 			
@@ -575,6 +1107,148 @@ def build_expressions(node_list):
 	
 	return left_node_list[0]
 
+###############################################################################
+
+class IrregularInput(Exception):
+	"""Raised by Parser for input it doesn't accept."""
+
+# the Operator subclass for each type of operator token, as in nodeify
+operator_classes = {
+	'equal': EqualOperator, 'notequal': EqualOperator,
+	'in': InOperator, 'notin': InOperator,
+	'incidr': CidrOperator, 'notincidr': CidrOperator,
+	'lt': CompareOperator, 'le': CompareOperator, 'gt': CompareOperator, 'ge': CompareOperator,
+	'match': MatchOperator }
+
+# the TerminalExpression subclass for each type of operand token, as in
+# nodeify
+operand_classes = {
+	'int': ValueExpression, 'string': ValueExpression, 'regex': ValueExpression,
+	'symbol': SymbolExpression,
+	'valuefile': ValueFileExpression }
+
+class Parser(object):
+	"""Builds a parse tree from a list of Tokens in a single pass over them
+	(by precedence climbing), so that parsing takes time linear in the
+	number of tokens. The operators bind, from tightest to loosest:
+
+	    ==, !=, =~, in, not in, in cidr, not in cidr, <, <=, >, >=
+	        (left to right)
+	    not
+	    and, or (left to right, and with the same precedence)
+
+	Parser builds the same trees that listify, parenthesize,
+	apply_precedence_1, apply_precedence_2, nodeify and build_expressions
+	do between them, but only for the input which those handle in the
+	regular way. Everything else - input with errors, or on which they
+	behave oddly (ie, "not not a", or an operator in parentheses which are
+	themselves an operand of one of the first group of operators, which
+	build_expressions treats as if it had the same precedence as and and
+	or) - makes parse raise IrregularInput, and is left to them."""
+
+	def __init__(self, tokens):
+		self._tokens = tokens
+		self._pos = 0
+
+	def parse(self):
+		"""Return the root of the parse tree, or None if there are no
+		tokens. Raises IrregularInput if the tokens aren't regular input."""
+
+		if len(self._tokens)==0:
+			return None
+		root = self.clauses(False)
+		if self._pos != len(self._tokens):
+			raise IrregularInput()
+		return root
+
+	def build(self, operator, left_operand, right_operand):
+		"""build_expression, raising IrregularInput if the operator doesn't
+		take the operands (so the stages report it)."""
+		try:
+			return build_expression(operator, left_operand, right_operand)
+		except (TypeError, errors.UserError):
+			raise IrregularInput()
+
+	def next_ttype(self):
+		if self._pos < len(self._tokens):
+			return self._tokens[self._pos].ttype
+		return None
+
+	def clauses(self, raw):
+		"""Parse operands joined by and and or. raw is True within
+		parentheses which are an operand of a comparison operator."""
+
+		tokens = self._tokens
+		left = self.negation(raw)
+		while self._pos < len(tokens) and tokens[self._pos].ttype in ('and','or'):
+			operator = LogicalOperator(tokens[self._pos])
+			self._pos += 1
+			left = self.build(operator, left, self.negation(raw))
+		return left
+
+	def negation(self, raw):
+		"""Parse a comparison, with or without a not before it."""
+
+		if self.next_ttype()=='not':
+			operator = NotOperator(self._tokens[self._pos])
+			self._pos += 1
+			return self.build(operator, None, self.comparison(raw))
+		return self.comparison(raw)
+
+	def comparison(self, raw):
+		"""Parse an operand, and any comparison operators applied to it."""
+
+		tokens = self._tokens
+		left = self.operand(raw)
+		while self._pos < len(tokens) and tokens[self._pos].ttype in operator_classes:
+			if raw:
+				raise IrregularInput()
+			operator = operator_classes[tokens[self._pos].ttype](tokens[self._pos])
+			self._pos += 1
+			left = self.build(operator, left, self.operand(True))
+		return left
+
+	def operand(self, raw):
+		"""Parse a value, symbol, list or parenthesized expression."""
+
+		ttype = self.next_ttype()
+		token = ttype is not None and self._tokens[self._pos]
+		self._pos += 1
+
+		if ttype in operand_classes:
+			try:
+				return operand_classes[ttype](token)
+			except errors.UserError:
+				# ie, an unreadable value file
+				raise IrregularInput()
+
+		if ttype=='openbracket':
+			token_list = tokenize.TokenList()
+			ttype = self.next_ttype()
+			while ttype!='closebracket':
+				if ttype is None:
+					raise IrregularInput()
+				if ttype!='comma':
+					# members add_token would refuse
+					if ttype not in ('int','string') or token_list.type() not in (None, ttype):
+						raise IrregularInput()
+					token_list.add_token(self._tokens[self._pos])
+				self._pos += 1
+				ttype = self.next_ttype()
+			self._pos += 1
+			return ValueListExpression(token_list)
+
+		if ttype=='oparen':
+			if self.next_ttype()=='cparen':
+				raise IrregularInput()
+			expression = self.clauses(raw)
+			if self.next_ttype()!='cparen':
+				raise IrregularInput()
+			self._pos += 1
+			return expression
+
+		raise IrregularInput()
+
 ##################################################################################
 ##################################################################################
 ## These things are for compiling and executing the parsed statement.
@@ -616,38 +1290,60 @@ def parse(tokens, logger=debug.NullDebugLogger()):
 	"""Takes a list of Tokens and assembles it into a parse tree. Returns
 	the Expression object at the root of the parse tree."""
 
-	logger.debug('---- begin parse.parse ----')
-	logger.debug('---- listify -------------')
+	debugging = debug.enabled(logger)
+	if debugging:
+		logger.debug('---- begin parse.parse ----')
 
-	tokens = listify(tokens)
-	logger.debug(str(tokens))
+	try:
+		root = Parser(tokens).parse()
+	except IrregularInput:
+		# whatever is wrong with the input is reported as parsing it in
+		# stages always has
+		root = parse_in_stages(tokens, logger)
+	else:
+		# the stages consume the token list, and so does this
+		del tokens[:]
+
+	if debugging and root is not None:
+		dump = root.dump()
+		for line in dump.split('\n'):
+			logger.debug(line)
+	if debugging:
+		logger.debug('---- end parse.parse ----')
 
-	logger.debug('---- parenthesize ----')
+	return root
+
+def parse_in_stages(tokens, logger=debug.NullDebugLogger()):
+	"""parse, by listify, parenthesize, apply_precedence_1,
+	apply_precedence_2, nodeify and build_expressions in turn (see Parser
+	for the difference)."""
+
+	debugging = debug.enabled(logger)
+	if debugging:
+		logger.debug('---- listify -------------')
+
+	tokens = listify(tokens)
+	if debugging:
+		logger.debug(str(tokens))
+		logger.debug('---- parenthesize ----')
 	
 	tokens = parenthesize(tokens)
-	logger.debug(str(tokens))
-
-	logger.debug('---apply_precedence--------------------')
+	if debugging:
+		logger.debug(str(tokens))
+		logger.debug('---apply_precedence--------------------')
 	
 	tokens = apply_precedence_1(tokens)
 	tokens = apply_precedence_2(tokens)
-	logger.debug('precedence applied: '+str(tokens))
-
-	logger.debug('---nodeify--------------------')
+	if debugging:
+		logger.debug('precedence applied: '+str(tokens))
+		logger.debug('---nodeify--------------------')
 	
 	nodes = nodeify(tokens)
-	logger.debug(str(nodes))
-
-	logger.debug('----build_expressions-----------------------')
+	if debugging:
+		logger.debug(str(nodes))
+		logger.debug('----build_expressions-----------------------')
 
 	if len(nodes)==0:
 		return None
 	
-	root = build_expressions(nodes)
-	dump = root.dump()
-	for line in dump.split('\n'):
-		logger.debug(line)
-
-	logger.debug('---- end parse.parse ----')
-	return root
-
+	return build_expressions(nodes)
@@ -0,0 +1,277 @@
+
+import parse
+import optimize
+
+#####################################################################################
+#####################################################################################
+## Finds the dead expressions in a Sieve: those which can never be the first
+## to match a record, because they're duplicates of an earlier expression, or
+## because an earlier expression matches every record they do (ie, 'host ==
+## "a" and prog == "b"' after 'host == "a"'), or because they never match at
+## all. Only simple implications between clauses are recognized, so not every
+## dead expression is found, but every one found is dead.
+#####################################################################################
+#####################################################################################
+
+def membership(expression):
+	"""If expression is "symbol == literal", "symbol != literal", "symbol
+	in [...]" or "symbol not in [...]", return a (symbol, negated, values)
+	tuple where values is a frozenset of the literals. Otherwise return
+	None."""
+
+	if issubclass(expression.__class__, parse.EqualExpression):
+		ttype = expression.token().ttype
+		left = expression.left_expression()
+		right = expression.right_expression()
+		if issubclass(left.__class__, parse.ValueExpression):
+			(left, right) = (right, left)
+		if issubclass(left.__class__, parse.SymbolExpression) and issubclass(right.__class__, parse.ValueExpression):
+			return (left.token().data, ttype=='notequal', frozenset([right.token().data]))
+
+	elif issubclass(expression.__class__, parse.InExpression):
+		left = expression.left_expression()
+		right = expression.right_expression()
+		if issubclass(left.__class__, parse.SymbolExpression) and issubclass(right.__class__, parse.ValueListExpression):
+			return (left.token().data, expression.token().ttype=='notin', right.value_set())
+
+	return None
+
+def bound_implies(a, b):
+	"""Given two (symbol, ttype, int) comparison bounds (see
+	parse.CompareExpression.bound), return True if the first being true
+	means the second is."""
+
+	(a_symbol, a_ttype, a_value) = a
+	(b_symbol, b_ttype, b_value) = b
+	if a_symbol != b_symbol:
+		return False
+	if a_ttype in ('gt', 'ge') and b_ttype in ('gt', 'ge'):
+		if a_ttype=='ge' and b_ttype=='gt':
+			return a_value > b_value
+		return a_value >= b_value
+	if a_ttype in ('lt', 'le') and b_ttype in ('lt', 'le'):
+		if a_ttype=='le' and b_ttype=='lt':
+			return a_value < b_value
+		return a_value <= b_value
+	return False
+
+def implies(a, b):
+	"""Returns True if whenever Expression a is true (or any true value) b
+	is True. False means it couldn't be shown, not that it isn't so."""
+
+	if not optimize.boolean_valued(b):
+		return False
+	return boolean_implies(a, b)
+
+def boolean_implies(a, b):
+	"""implies, for a b already known to be boolean valued."""
+
+	a_or = optimize.operands(a, 'or')
+	if len(a_or) > 1:
+		for operand in a_or:
+			if not boolean_implies(operand, b):
+				return False
+		return True
+	b_and = optimize.operands(b, 'and')
+	if len(b_and) > 1:
+		for operand in b_and:
+			if not boolean_implies(a, operand):
+				return False
+		return True
+	a_and = optimize.operands(a, 'and')
+	if len(a_and) > 1:
+		for operand in a_and:
+			if boolean_implies(operand, b):
+				return True
+		return False
+	b_or = optimize.operands(b, 'or')
+	if len(b_or) > 1:
+		for operand in b_or:
+			if boolean_implies(a, operand):
+				return True
+		return False
+
+	if issubclass(a.__class__, parse.NotExpression):
+		if issubclass(b.__class__, parse.NotExpression):
+			# "not x" implies "not y" if y implies x
+			return implies(b.right_expression(), a.right_expression())
+		return a.key()==b.key()
+
+	a_membership = membership(a)
+	if a_membership is not None:
+		b_membership = membership(b)
+		if b_membership is not None:
+			(a_symbol, a_negated, a_values) = a_membership
+			(b_symbol, b_negated, b_values) = b_membership
+			if a_symbol != b_symbol:
+				return False
+			if not a_negated and not b_negated:
+				return a_values <= b_values
+			if a_negated and b_negated:
+				return b_values <= a_values
+			if not a_negated and b_negated:
+				return len(a_values & b_values)==0
+			return False
+
+	if issubclass(a.__class__, parse.CompareExpression) and issubclass(b.__class__, parse.CompareExpression):
+		a_bound = a.bound()
+		b_bound = b.bound()
+		if a_bound is not None and b_bound is not None and bound_implies(a_bound, b_bound):
+			return True
+
+	return a.key()==b.key()
+
+# An expression is described for finding which expressions it might imply
+# by its probes, a set of signatures:
+#
+# - ('key', key) for each clause it's an 'and' of (see parse.Expression.key)
+# - ('symbol', symbol) for each membership test (see membership) or
+#   comparison of symbol
+# - ('value', symbol, value) for each value of a "symbol == literal" or
+#   "symbol in [...]" clause
+# - ('not', symbol) for each negated membership test
+#
+# An expression can only be shown to imply another if its probes include at
+# least one of the alternatives (see alternatives) of each of the other's
+# clauses.
+
+def probes(tree):
+	"""Return the set of signatures describing the clauses of tree (a parse
+	tree)."""
+
+	found = set()
+	for conjunct in tree.conjuncts():
+		found.add(('key', conjunct.key()))
+		if issubclass(conjunct.__class__, parse.NotExpression):
+			m = membership(conjunct.right_expression())
+			if m is not None:
+				found.add(('not', m[0]))
+			continue
+		m = membership(conjunct)
+		if m is not None:
+			(symbol, negated, values) = m
+			found.add(('symbol', symbol))
+			if not negated:
+				for value in values:
+					found.add(('value', symbol, value))
+		elif issubclass(conjunct.__class__, parse.CompareExpression) and conjunct.bound() is not None:
+			found.add(('symbol', conjunct.bound()[0]))
+	return found
+
+def alternatives(expression):
+	"""Return a set of signatures at least one of which is among the probes
+	of any expression which can be shown to imply expression, or None if
+	there's no telling."""
+
+	found = set([('key', expression.key())])
+
+	if issubclass(expression.__class__, parse.LogicalExpression):
+		if expression.token().ttype=='and':
+			return alternatives(optimize.operands(expression, 'and')[0])
+		for operand in optimize.operands(expression, 'or'):
+			operand_alternatives = alternatives(operand)
+			if operand_alternatives is None:
+				return None
+			found.update(operand_alternatives)
+		return found
+
+	if issubclass(expression.__class__, parse.NotExpression):
+		m = membership(expression.right_expression())
+		if m is not None:
+			found.add(('not', m[0]))
+		return found
+
+	m = membership(expression)
+	if m is not None:
+		found.add(('symbol', m[0]))
+	elif issubclass(expression.__class__, parse.CompareExpression) and expression.bound() is not None:
+		found.add(('symbol', expression.bound()[0]))
+	return found
+
+def dead_expressions(trees):
+	"""Given the parse trees of a Sieve's expressions in order, return a
+	list of (number, reason, by) tuples for the dead ones, where number is
+	the expression's position, reason is 'duplicate', 'subsumed' or 'never
+	matches', and by is the position of the earlier expression which makes
+	it dead (or None).
+
+	An expression which may raise an exception other than by looking a
+	symbol up (see optimize.may_raise) is never dead, other than after one
+	which matches everything: it might raise where the earlier expression
+	is false. Nor can a dead one be skipped for a record in which one of its
+	symbols can't be looked up (see index.DispatchIndex.add_dead)."""
+
+	dead = []
+	# maps keys of whole trees to the first expression with that tree
+	first = {}
+	# maps signatures to the live expressions filed under them
+	filed = {}
+	# live expressions which can't be filed, and must be tried against
+	# every expression after them
+	unfiled = []
+	# maps live expressions to the alternatives of their clauses
+	required = {}
+	# the number of an expression which matches everything
+	always = None
+
+	for (number, tree) in enumerate(trees):
+		if always is not None:
+			dead.append((number, 'subsumed', always))
+			continue
+
+		(is_constant, value) = optimize.constant(tree)
+		if is_constant:
+			if value==True:
+				always = number
+			else:
+				dead.append((number, 'never matches', None))
+			continue
+
+		raises = optimize.may_raise(tree)
+		key = tree.key()
+		if key in first and not raises:
+			dead.append((number, 'duplicate', first[key]))
+			continue
+		first.setdefault(key, number)
+
+		own_probes = probes(tree)
+		candidates = set(unfiled)
+		for probe in own_probes:
+			candidates.update(filed.get(probe, ()))
+		subsumed_by = None
+		if raises:
+			candidates = ()
+		for earlier in sorted(candidates):
+			for alternative in required[earlier]:
+				if not (alternative & own_probes):
+					break
+			else:
+				if implies(tree, trees[earlier]):
+					subsumed_by = earlier
+					break
+		if subsumed_by is not None:
+			dead.append((number, 'subsumed', subsumed_by))
+			continue
+
+		# file it under all the alternatives of one of its clauses, so that
+		# it's found by every expression which might imply it, choosing the
+		# clause which will have it tried least often. The values of a
+		# "symbol == literal" or "symbol in [...]" clause will do as well.
+		required[number] = []
+		options = []
+		for conjunct in tree.conjuncts():
+			conjunct_alternatives = alternatives(conjunct)
+			if conjunct_alternatives is not None:
+				required[number].append(conjunct_alternatives)
+				options.append(conjunct_alternatives)
+			m = membership(conjunct)
+			if m is not None and not m[1]:
+				options.append([('value', m[0], value) for value in m[2]])
+		if len(options):
+			option = min(options, key=lambda option: sum([len(filed.get(signature, ())) for signature in option]))
+			for signature in option:
+				filed.setdefault(signature, []).append(number)
+		else:
+			unfiled.append(number)
+
+	return dead
@@ -0,0 +1,291 @@
+
+import re
+import sre_parse
+import sre_constants
+
+import aho
+import cache
+
+#####################################################################################
+#####################################################################################
+## A RegexSet holds all of the regexes which a Sieve matches against one
+## symbol, so that the symbol's value is converted once and scanned by one
+## combined regex per record instead of once per regex per expression.
+#####################################################################################
+#####################################################################################
+
+# the re module refuses patterns with more groups than this
+max_groups = 99
+
+def _references_groups(parsed):
+	"""Returns True if the sre_parse.SubPattern parsed contains a
+	backreference (\\1, (?P=name) or (?(1)...))."""
+
+	for (op, av) in parsed:
+		if op in (sre_constants.GROUPREF, sre_constants.GROUPREF_EXISTS):
+			return True
+		pending = [av]
+		while pending:
+			item = pending.pop()
+			if isinstance(item, sre_parse.SubPattern):
+				if _references_groups(item):
+					return True
+			elif isinstance(item, (tuple, list)):
+				pending.extend(item)
+	return False
+
+def required_literals(parsed):
+
+	"""Returns a list of strings which every match of the sre_parse.SubPattern
+	parsed must contain: runs of literal characters in the top level of the
+	pattern, in groups, and in repeats which must occur at least once."""
+
+	literals = []
+	run = []
+	for (op, av) in parsed:
+		if op == sre_constants.LITERAL and av < 256:
+			run.append(chr(av))
+			continue
+
+		if len(run):
+			literals.append(''.join(run))
+			run = []
+
+		if op == sre_constants.SUBPATTERN:
+			literals.extend(required_literals(av[-1]))
+		elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT) and av[0] >= 1:
+			literals.extend(required_literals(av[2]))
+
+	if len(run):
+		literals.append(''.join(run))
+	return literals
+
+# required literals shorter than this are too common to be worth looking for
+min_literal_length = 3
+
+def prefilter_literal(parsed):
+	"""Returns the longest string which every match of the sre_parse.SubPattern
+	parsed must contain, or None if there isn't one worth looking for."""
+
+	if parsed.pattern.flags & sre_constants.SRE_FLAG_IGNORECASE:
+		return None
+	literals = required_literals(parsed)
+	if len(literals)==0:
+		return None
+	literal = max(literals, key=len)
+	if len(literal) < min_literal_length:
+		return None
+	return literal
+
+def uncompileable(pattern):
+	"""Return a searcher (see literalregex.searcher) for the regex pattern,
+	which doesn't compile: it raises re.error."""
+	def search(string):
+		return cache.regexes.searcher(pattern)(string)
+	return search
+
+class RegexSet(object):
+
+	"""The distinct regexes matched against one symbol. Regexes which can
+	be are combined into alternations ("chunks") grouped by their flags,
+	each alternative wrapped in a capturing group. Scanning a value with a
+	chunk answers for all of its regexes at once when nothing matches
+	(by far the most common case for log messages) and the group which
+	matched says which regex matched when something does; the rest are
+	only searched for individually when some expression asks about them.
+	Regexes with backreferences or named groups can't be renumbered into
+	an alternation (nor can verbose ones be wrapped in one) and are always
+	searched for individually.
+
+	Regexes which require some literal string (ie, /sshd\[\d+\]: Failed/
+	requires "]: Failed") aren't put in chunks. Instead one Aho-Corasick
+	automaton (see aho.Automaton) finds which of those literals are in the
+	value, and only regexes whose literal is there are searched for.
+
+	Regexes which don't compile are left out of the chunks too. Searching
+	for one raises re.error, as RegexCache.match would, so an expression
+	using it only raises when it's evaluated.
+
+	What compile works out about the regexes can be kept (see plan) and
+	given to a RegexSet of the same regexes (ie, in a Sieve loaded from a
+	snapshot), which then only compiles its chunks, and each regex when
+	it's first searched for individually."""
+
+	def __init__(self):
+		self._patterns = []
+		self._numbers = {}
+		self._searchers = None
+		self._chunks = None
+		self._sources = None
+		self._literals = None
+		self._unknown = None
+		self._automaton = None
+		self._literal_numbers = None
+
+	def add(self, pattern):
+		"""Add a regex (its source) to the set if it isn't already in it
+		and return its number."""
+		if pattern not in self._numbers:
+			self._numbers[pattern] = len(self._patterns)
+			self._patterns.append(pattern)
+			self._chunks = None
+		return self._numbers[pattern]
+
+	def patterns(self):
+		return list(self._patterns)
+
+	def plan(self):
+		"""Return what compile works out about the regexes, which can be
+		pickled: the set's regexes, the sources of its chunks (with the
+		regexes each group of them stands for), the literals which regexes
+		require, and which regexes must be searched for individually."""
+		if self._chunks is None:
+			self.compile()
+		return (list(self._patterns), self._sources, self._literals, self._unknown)
+
+	def compile(self, plan=None):
+		"""Build the combined regexes. This is done automatically the first
+		time the set is used after regexes are added. plan is what plan
+		returned for a RegexSet of the same regexes, if there was one."""
+
+		if plan is not None and plan[0]==self._patterns:
+			(patterns, sources, literals, unknown) = plan
+			self._use([(re.compile(source), group2number, numbers) for (source, group2number, numbers) in sources],
+				sources, [None] * len(patterns), literals, unknown)
+			return
+
+		# maps flags to lists of (number, groups) for combinable regexes
+		combinable = {}
+		# maps required literals to the numbers of the regexes requiring them
+		literals = {}
+		unknown = [False] * len(self._patterns)
+		searchers = []
+		for (number, pattern) in enumerate(self._patterns):
+			try:
+				searchers.append(cache.regexes.searcher(pattern))
+			except re.error:
+				searchers.append(uncompileable(pattern))
+				unknown[number] = None
+				continue
+			parsed = sre_parse.parse(pattern)
+			literal = prefilter_literal(parsed)
+			if literal is not None:
+				literals.setdefault(literal, []).append(number)
+				continue
+			groups = parsed.pattern.groups - 1
+			if parsed.pattern.groupdict or _references_groups(parsed) or groups >= max_groups or parsed.pattern.flags & sre_constants.SRE_FLAG_VERBOSE:
+				unknown[number] = None
+				continue
+			combinable.setdefault(parsed.pattern.flags, []).append((number, groups))
+
+		# a chunk is (regex, maps group numbers to regex numbers, regex numbers)
+		chunks = []
+		# and its source in place of the regex
+		sources = []
+		for members in combinable.itervalues():
+			start = 0
+			while start < len(members):
+				# each alternative has its own groups plus the wrapper
+				end = start
+				groups = 0
+				while end < len(members) and groups + members[end][1] + 1 <= max_groups:
+					groups += members[end][1] + 1
+					end += 1
+				alternatives = []
+				group2number = {}
+				group = 1
+				for (number, member_groups) in members[start:end]:
+					alternatives.append('(%s)' % self._patterns[number])
+					group2number[group] = number
+					group += member_groups + 1
+				numbers = [number for (number, member_groups) in members[start:end]]
+				sources.append(('|'.join(alternatives), group2number, numbers))
+				chunks.append((re.compile(sources[-1][0]), group2number, numbers))
+				start = end
+
+		self._use(chunks, sources, searchers, literals, unknown)
+
+	def _use(self, chunks, sources, searchers, literals, unknown):
+		"""Start using what compile has made. searchers has a searcher
+		for each regex, or None for those which haven't been compiled
+		yet."""
+
+		self._searchers = searchers
+		self._sources = sources
+		self._literals = literals
+		if len(literals):
+			keywords = literals.keys()
+			self._automaton = aho.Automaton(keywords)
+			self._literal_numbers = [literals[keyword] for keyword in keywords]
+		else:
+			self._automaton = None
+			self._literal_numbers = None
+		# results for a value before any regex has been tried against it:
+		# False for combined and prefiltered regexes (until their chunk
+		# matches or their literal is found), None (unknown) for the others
+		self._unknown = unknown
+		# last, as scan compiles the set until this is set
+		self._chunks = chunks
+
+	def scan(self, value):
+		"""Scan value (a symbol's value) with the combined regexes. Returns
+		a list whose first item is the value as a string (or None) and
+		whose other items are True or False if it's known whether that
+		regex (by number, plus one) matches, or None if not."""
+
+		if self._chunks is None:
+			self.compile()
+
+		if value is None:
+			return [None] + [False] * len(self._patterns)
+
+		string = str(value)
+		results = [string] + self._unknown
+		if self._automaton is not None:
+			literal_numbers = self._literal_numbers
+			for keyword in self._automaton.find(string):
+				for number in literal_numbers[keyword]:
+					results[number+1] = None
+		for (chunk, group2number, numbers) in self._chunks:
+			m = chunk.search(string)
+			if m is None:
+				continue
+			for number in numbers:
+				results[number+1] = None
+			results[group2number[m.lastindex]+1] = True
+		return results
+
+	def search(self, number, results):
+		"""Return whether regex number matches, given the results of scan
+		for the value, updating those results."""
+
+		found = results[number+1]
+		if found is None:
+			search = self._searchers[number]
+			if search is None:
+				# raises re.error if it doesn't compile (and so isn't
+				# kept), as uncompileable's searchers do
+				search = cache.regexes.searcher(self._patterns[number])
+				self._searchers[number] = search
+			found = results[number+1] = search(results[0])
+		return found
+
+	def matcher(self, symbol, pattern):
+		"""Return a closure (see parse.Expression.closure) which evaluates
+		"symbol =~ /pattern/". The scan of symbol's value is kept in the
+		symbol table's memo so it happens once per record however many
+		expressions match against the symbol."""
+
+		number = self.add(pattern)
+		key = (self, symbol)
+		def match(s):
+			memo = s.memo
+			if key in memo:
+				results = memo[key]
+			else:
+				results = memo[key] = self.scan(s[symbol])
+			found = results[number+1]
+			if found is None:
+				found = self.search(number, results)
+			return found
+		return match
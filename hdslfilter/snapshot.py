@@ -0,0 +1,99 @@
+
+import os
+import sys
+import gc
+import hashlib
+import cPickle
+
+import hdslfilter
+
+#####################################################################################
+#####################################################################################
+## Snapshots of compiled Sieves, so that a process which loads the same sieve
+## file every time it starts (or every worker it forks) needn't tokenize, parse,
+## optimize, index and compile it every time (see Sieve.from_file).
+##
+## A snapshot is a file holding a key on its first line and the pickled Sieve
+## after it: the parse trees, marshalled code objects, symbol lists, pruning
+## and indexes. The closures and compiled regexes can't be pickled; they're
+## built again from the parse trees when the Sieve is unpickled (see
+## Sieve.__setstate__), as are the values of value files, which are read
+## from the files again. The plans of its RegexSets are pickled, so only
+## their combined regexes are compiled then; each regex on its own is
+## compiled when it's first needed.
+#####################################################################################
+#####################################################################################
+
+# the first line of a snapshot, followed by its key
+header = 'hdslfilter sieve snapshot '
+
+# the version of what's pickled, which is part of the key. It changes
+# whenever what a Sieve (or anything in it) pickles does, so that a
+# snapshot saved by another version of this package isn't loaded.
+format_version = 2
+
+def key(source, *args):
+	"""Return the key of a snapshot of a Sieve built from the source code
+	source, and args (ie, the path it was read from and whether it's
+	adaptive), which must all have reprs which are the same every time. The
+	key also depends on the versions of hdslfilter and of its snapshots
+	(format_version; its internals are pickled) and python (whose code
+	objects are marshalled)."""
+
+	digest = hashlib.sha1()
+	digest.update(repr((hdslfilter.__version__, format_version, sys.version, args)))
+	digest.update(source)
+	return digest.hexdigest()
+
+def save(sieve, path, key):
+	"""Write a snapshot of sieve, with the key key (see key), to the file
+	path. The snapshot is written to a temporary file which is then
+	renamed, so that a process loading it never sees half of it. If
+	anything goes wrong (including pickling the Sieve) the temporary file
+	is removed and the exception raised."""
+
+	temporary = '%s.%d.tmp' % (path, os.getpid())
+	f = open(temporary, 'wb')
+	try:
+		try:
+			f.write('%s%s\n' % (header, key))
+			cPickle.dump(sieve, f, cPickle.HIGHEST_PROTOCOL)
+		finally:
+			f.close()
+		os.rename(temporary, path)
+	except:
+		(exception_class, exception, traceback) = sys.exc_info()
+		try:
+			os.remove(temporary)
+		except OSError:
+			pass
+		raise exception_class, exception, traceback
+
+def load(path, key):
+	"""Return the Sieve in the snapshot file path if its key is key (see
+	key), or None if the file doesn't exist, has another key or can't be
+	loaded."""
+
+	try:
+		f = open(path, 'rb')
+	except IOError:
+		return None
+	try:
+		if f.readline() != '%s%s\n' % (header, key):
+			return None
+		# unpickling makes a great many objects, none of them garbage, so
+		# the garbage collector would only be wasting its time
+		enabled = gc.isenabled()
+		gc.disable()
+		try:
+			return cPickle.load(f)
+		except Exception:
+			# the file is truncated or otherwise broken, or a value file
+			# can no longer be read; building the Sieve from source will
+			# report the problem if there is one
+			return None
+		finally:
+			if enabled:
+				gc.enable()
+	finally:
+		f.close()
@@ -0,0 +1,94 @@
+
+import tokenize
+import parse
+import errors
+import optimize
+
+#####################################################################################
+#####################################################################################
+## Partial evaluation of parse trees against symbols whose values are known in
+## advance (ie, fields which are the same for every record of a stream), so
+## that clauses which depend only on them are evaluated once rather than for
+## every record (see Sieve.specialize).
+#####################################################################################
+#####################################################################################
+
+class Bindings(object):
+	"""Stands in for a filter.SymbolTable when evaluating a subexpression
+	whose symbols are all bound."""
+
+	def __init__(self, bindings):
+		self._bindings = bindings
+		self.memo = {}
+		self.fe = None
+
+	def __getitem__(self, symbol):
+		return self._bindings[symbol]
+
+def literal(value, token):
+	"""Return an Expression for value (a symbol's value) in place of the
+	SymbolExpression whose token is token: a ValueExpression for strings
+	and ints, so that it can be used anywhere a literal can, otherwise a
+	parse.ConstantExpression."""
+
+	if type(value) is type(''):
+		return parse.ValueExpression(tokenize.Token('string', value, token.lineno, token.linepos))
+	if type(value) in (type(0), type(0L)):
+		return parse.ValueExpression(tokenize.Token('int', value, token.lineno, token.linepos))
+	return parse.ConstantExpression(value, token)
+
+def bind(expression, bindings, compiler):
+	"""Return the parse tree rooted at expression with the symbols in the
+	dict bindings replaced by their values. Subexpressions whose symbols
+	are all bound are evaluated, unless that fails. compiler is a filter.ClosureCompiler to
+	evaluate them with."""
+
+	if issubclass(expression.__class__, parse.SymbolExpression):
+		symbol = expression.token().data
+		if symbol in bindings:
+			return literal(bindings[symbol], expression.token())
+		return expression
+	if issubclass(expression.__class__, parse.TerminalExpression):
+		return expression
+
+	symbols = expression.find_symbols()
+	if len(symbols) and len([symbol for symbol in symbols if symbol not in bindings])==0:
+		try:
+			value = compiler.closure(expression)(Bindings(bindings))
+		except Exception:
+			# it will fail the same way for every record (ie, a bound
+			# regex which doesn't compile), so it's left to do so
+			return expression
+		if type(value) in optimize.constant_types:
+			return parse.ConstantExpression(value, expression.token())
+		return expression
+
+	if issubclass(expression.__class__, parse.NotExpression):
+		right = bind(expression.right_expression(), bindings, compiler)
+		if right is expression.right_expression():
+			return expression
+		return parse.NotExpression(expression.operator(), right)
+
+	if issubclass(expression.__class__, parse.LogicalExpression):
+		operands = expression.operands()
+		bound = [bind(operand, bindings, compiler) for operand in operands]
+		if len([i for i in range(len(operands)) if bound[i] is not operands[i]])==0:
+			return expression
+		return optimize.chain(expression.operator(), bound)
+
+	left = bind(expression.left_expression(), bindings, compiler)
+	right = bind(expression.right_expression(), bindings, compiler)
+	if left is expression.left_expression() and right is expression.right_expression():
+		return expression
+	try:
+		return parse.build_expression(expression.operator(), left, right)
+	except (TypeError, errors.NonNumericOperand):
+		# the operator doesn't take the value in place of the symbol (ie,
+		# "a < b" with a bound to a string), so it's looked up as before
+		return expression
+
+def specialize(expression, bindings, compiler):
+	"""Return an optimized (see optimize.optimize) version of the parse
+	tree rooted at expression for records in which the symbols in the dict
+	bindings have the given values."""
+	return optimize.optimize(bind(expression, bindings, compiler), compiler)
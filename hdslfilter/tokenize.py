@@ -3,6 +3,7 @@ import re
 
 import errors
 import debug
+import cache
 
 #####################################################################################
 #####################################################################################
@@ -17,10 +18,16 @@ def find_endsquote(s,quotechar):
 	quoted string (quoted by quotechar), find the index of the close
 	quote."""
 
+	return find_endsquote_at(s, 0, quotechar)
+
+def find_endsquote_at(source, begin, quotechar):
+	"""find_endsquote(source[begin:], quotechar), without copying the rest
+	of source."""
+
 	start=0
 	while True:
-		idx = s.index(quotechar,start)
-		if idx>1 and s[idx-1]!='\\':
+		idx = source.index(quotechar,begin+start) - begin
+		if idx>1 and source[begin+idx-1]!='\\':
 			return idx+1
 		elif idx<=1:
 			return idx+1
@@ -37,6 +44,11 @@ class Token(object):
 		self.linepos = linepos
 		self._first = False
 		self._last = False
+
+	def __reduce__(self):
+		# pickled as the arguments to the constructor, which is smaller and
+		# quicker to load than the instance dict (see snapshot)
+		return (self.__class__, (self.ttype, self.data, self.lineno, self.linepos))
 	
 	def __repr__(self):
 		return '%s.%s(%s, %s, %s, %s)' % ( self.__module__, self.__class__.__name__, repr(self.ttype), repr(self.data), repr(self.lineno), repr(self.linepos) )
@@ -86,17 +98,21 @@ class TokenList(object):
 
 class Tokenizer(object):
 	"""Chops a string (containing the expressions to compile) into tokens -
-	the smallest bits that contain any meaning."""
+	the smallest bits that contain any meaning. The tokenizer works along
+	the string by position rather than slicing off what's left of it after
+	each token, so tokenizing takes time linear in the string's length."""
 
 	def __init__(self):
 		self._lineno=1
 		self._linepos=1
 
-		self._exp_comment=re.compile('^#[^\n]*\n(.*)', re.DOTALL)
-		self._exp_white=re.compile('^[ \t]+(.*)', re.DOTALL)
-		self._exp_word = re.compile('^([_a-zA-Z]{1}[._a-zA-Z0-9]*)(.*)', re.DOTALL)
-		self._exp_int = re.compile('^([0-9]+)(.*)', re.DOTALL)
-		self._exp_notinop = re.compile('^(not[ \t]+in)(.*)', re.DOTALL)
+		# these are matched at a position in the string (see scan)
+		self._exp_white=re.compile('[ \t]+')
+		self._exp_word = re.compile('[_a-zA-Z]{1}[._a-zA-Z0-9]*')
+		self._exp_int = re.compile('[0-9]+')
+		self._exp_notinop = re.compile('not[ \t]+in')
+		self._exp_incidrop = re.compile('in[ \t]+cidr(?![_.a-zA-Z0-9])')
+		self._exp_notincidrop = re.compile('not[ \t]+in[ \t]+cidr(?![_.a-zA-Z0-9])')
 
 		self._exp_midsymchars = re.compile('^[_.a-zA-Z0-9]+', re.DOTALL)
 		self._midsymchars = [chr(i) for i in range(65,91)] + [chr(i) for i in range(97,123)] + [str(i) for i in range(0,10)] + ['_','.']
@@ -107,169 +123,232 @@ class Tokenizer(object):
 		Token object and the second item of which is the rest of the input
 		string."""
 
-		if data[0] in ('"', "'", '/'):
+		(token, end) = self.scan(data, 0)
+		return (data[end:], token)
+
+	def tokens(self, source):
+		"""Return a list of all the Tokens in source (a string)."""
+
+		tokens = []
+		pos = 0
+		while pos < len(source):
+			(token, pos) = self.scan(source, pos)
+			if token is not None:
+				tokens.append(token)
+		return tokens
+
+	def scan(self, source, pos):
+		"""Return a (token, end) tuple for the token starting at position
+		pos in source: the Token (or None for whitespace, newlines and
+		comments, which aren't tokens) and the position just after it.
+		Errors report the rest of source from pos."""
+
+		c = source[pos]
+
+		if c in ('"', "'", '/'):
 			try:
-				close_quote_idx = find_endsquote(data[1:],data[0])
+				close_quote_idx = find_endsquote_at(source, pos+1, c)
 			except ValueError, ve:
-				if data[0]=='/':
-					raise errors.UnclosedREError(data, self._lineno)
+				if c=='/':
+					raise errors.UnclosedREError(source[pos:], self._lineno)
 				else:
-					raise errors.UnclosedQuoteError(data, self._lineno)
+					raise errors.UnclosedQuoteError(source[pos:], self._lineno)
 			
-			s = data[1:close_quote_idx]
-			rest=data[close_quote_idx+1:]
+			s = source[pos+1:pos+close_quote_idx]
+			end = pos+close_quote_idx+1
 
-			if data[0]=='/':
+			if c=='/':
 				ttype='regex'
 			else:
 				ttype='string'
 
 			if ttype=='regex':
-				# test compile the regex, just to see if it works
-				# best to determine this at compile time, easier to report,
-				# better for the user.
+				# compile the regex, to see if it works: best to determine
+				# this at compile time, easier to report, better for the
+				# user. The token keeps the searcher, so that it stays in the
+				# regex store for when the expression is compiled.
 				try:
-					re.compile(s)
+					search = cache.regexes.searcher(s)
 				except re.error, ree:
 					raise errors.UncompileableRegexError(s, self._lineno, ree)
 
 			t = Token(ttype,s, self._lineno, self._linepos)
-			self._linepos += len(data) - len(rest)
+			if ttype=='regex':
+				t.searcher = search
+			self._linepos += end - pos
 
-			return (rest, t)
+			return (t, end)
 			
-		if data[0]=='[':
+		if c=='@' and source[pos+1:pos+2] in ('"', "'"):
+			# a value file: @"/path/to/file"
+			try:
+				close_quote_idx = find_endsquote_at(source, pos+2, source[pos+1])
+			except ValueError, ve:
+				raise errors.UnclosedQuoteError(source[pos:], self._lineno)
+
+			s = source[pos+2:pos+close_quote_idx+1]
+			end = pos+close_quote_idx+2
+
+			t = Token('valuefile',s, self._lineno, self._linepos)
+			self._linepos += end - pos
+
+			return (t, end)
+
+		if c=='[':
 			self._linepos += 1
-			return (data[1:], Token('openbracket', '[', self._lineno, self._linepos))
+			return (Token('openbracket', '[', self._lineno, self._linepos), pos+1)
 		
-		if data[0]==']':
+		if c==']':
 			self._linepos += 1
-			return (data[1:], Token('closebracket', ']', self._lineno, self._linepos))
+			return (Token('closebracket', ']', self._lineno, self._linepos), pos+1)
 
-		if data[0]==',':
+		if c==',':
 			self._linepos += 1
-			return (data[1:], Token('comma', ',', self._lineno, self._linepos))
+			return (Token('comma', ',', self._lineno, self._linepos), pos+1)
 
-		if data[0]=='\n':
+		if c=='\n':
 			self._lineno+=1
 			self._linepos=1
-			return (data[1:], None)
+			return (None, pos+1)
 			
-		mg = self._exp_white.match(data)
-		if mg:
-			self._linepos += len(data) - len(mg.group(1))
-			return (mg.group(1),None)
-
-		mg = self._exp_comment.match(data)
-		if mg:
-			self._lineno+=1
-			self._linepos=1
-			return (mg.group(1), None)
-		#print 'NO comment match on',repr(data)
-
-		if data[0]=='#' and '\n' not in data:
-			#print 'comment to END!'
-			self._linepos+=len(data)
-			return ('', None)
-
-		mg = self._exp_notinop.match(data)
-		if mg:
-			t = Token('notin', mg.group(1), self._lineno, self._linepos)
-			self._linepos += len(mg.group(1))
-			return (mg.group(2), t)
+		# each regex is only tried where the character it must start with
+		# is found
+		if c in ' \t':
+			mg = self._exp_white.match(source, pos)
+			self._linepos += mg.end() - pos
+			return (None, mg.end())
+
+		if c=='#':
+			newline = source.find('\n', pos)
+			if newline >= 0:
+				self._lineno+=1
+				self._linepos=1
+				return (None, newline+1)
+			# comment to the end
+			self._linepos += len(source) - pos
+			return (None, len(source))
+
+		if c=='n':
+			mg = self._exp_notincidrop.match(source, pos)
+			if mg:
+				t = Token('notincidr', mg.group(), self._lineno, self._linepos)
+				self._linepos += mg.end() - pos
+				return (t, mg.end())
+
+			mg = self._exp_notinop.match(source, pos)
+			if mg:
+				t = Token('notin', mg.group(), self._lineno, self._linepos)
+				self._linepos += mg.end() - pos
+				return (t, mg.end())
 		
-		if data[0]=='(':
-			t = Token('oparen', data[0], self._lineno, self._linepos)
+		if c=='(':
+			t = Token('oparen', c, self._lineno, self._linepos)
 			self._linepos += 1
-			return (data[1:], t)
+			return (t, pos+1)
 
-		if data[0]==')':
-			t = Token('cparen', data[0], self._lineno, self._linepos)
+		if c==')':
+			t = Token('cparen', c, self._lineno, self._linepos)
 			self._linepos += 1
-			return (data[1:], t)
+			return (t, pos+1)
 		
-		mg = self._exp_int.match(data)
-		if mg:
-			t = Token('int', int(mg.group(1)), self._lineno, self._linepos)
-			self._linepos += len(data) - len(mg.group(2))
-			return (mg.group(2), t)
+		if c in '0123456789':
+			mg = self._exp_int.match(source, pos)
+			t = Token('int', int(mg.group()), self._lineno, self._linepos)
+			self._linepos += mg.end() - pos
+			return (t, mg.end())
 		
-		if data[0]==';':
-			t = Token('semicolon', data[0], self._lineno, self._linepos)
+		if c==';':
+			t = Token('semicolon', c, self._lineno, self._linepos)
 			self._linepos += 1
-			return (data[1:], t)
-		
-		if data[0:2]=='==':
-			t = Token('equal', data[0:2], self._lineno, self._linepos)
+			return (t, pos+1)
+
+		pair = source[pos:pos+2]
+		if pair=='==':
+			t = Token('equal', pair, self._lineno, self._linepos)
 			self._linepos += 2
-			return (data[2:], t)
+			return (t, pos+2)
 
-		if data[0:2]=='!=':
-			t = Token('notequal', data[0:2], self._lineno, self._linepos)
+		if pair=='!=':
+			t = Token('notequal', pair, self._lineno, self._linepos)
 			self._linepos += 2
-			return (data[2:], t)
+			return (t, pos+2)
 
-		if data[0:2]=='&&':
-			t = Token('and', data[0:2], self._lineno, self._linepos)
+		if pair=='<=':
+			t = Token('le', pair, self._lineno, self._linepos)
 			self._linepos += 2
-			return (data[2:], t)
-
-		if data[0:3]=='and':
-			if len(data)>3:
-				if data[3] not in self._midsymchars:
-					t = Token('and', data[0:3], self._lineno, self._linepos)
-					self._linepos += 3
-					return (data[3:], t)
-			else:
-				t = Token('and', data[0:3], self._lineno, self._linepos)
-				self._linepos += 3
-				return (data[3:], t)
-				
-
-		if data[0:2]=='or':
-			if len(data)>2:
-				if data[2] not in self._midsymchars:
-					t = Token('or', data[0:2], self._lineno, self._linepos)
-					self._linepos += 2
-					return (data[2:], t)
-			else:
-				t = Token('or', data[0:2], self._lineno, self._linepos)
-				self._linepos += 2
-				return (data[2:], t)
+			return (t, pos+2)
+
+		if pair=='>=':
+			t = Token('ge', pair, self._lineno, self._linepos)
+			self._linepos += 2
+			return (t, pos+2)
+
+		if c=='<':
+			t = Token('lt', c, self._lineno, self._linepos)
+			self._linepos += 1
+			return (t, pos+1)
+
+		if c=='>':
+			t = Token('gt', c, self._lineno, self._linepos)
+			self._linepos += 1
+			return (t, pos+1)
+
+		if pair=='&&':
+			t = Token('and', pair, self._lineno, self._linepos)
+			self._linepos += 2
+			return (t, pos+2)
 
-		if data[0:2]=='||':
-			t = Token('or', data[0:2], self._lineno, self._linepos)
+		# 'and' and 'or' at the end of the input, or not followed by
+		# something which would make them part of a symbol
+		if source.startswith('and', pos) and (pos+3 >= len(source) or source[pos+3] not in self._midsymchars):
+			t = Token('and', 'and', self._lineno, self._linepos)
+			self._linepos += 3
+			return (t, pos+3)
+
+		if pair=='or' and (pos+2 >= len(source) or source[pos+2] not in self._midsymchars):
+			t = Token('or', pair, self._lineno, self._linepos)
 			self._linepos += 2
-			return (data[2:], t)
+			return (t, pos+2)
+
+		if pair=='||':
+			t = Token('or', pair, self._lineno, self._linepos)
+			self._linepos += 2
+			return (t, pos+2)
 		
-		if data[0:3]=='not' and data[3] not in self._midsymchars:
-			t = Token('not', data[0:3], self._lineno, self._linepos)
+		if source.startswith('not', pos) and source[pos+3] not in self._midsymchars:
+			t = Token('not', 'not', self._lineno, self._linepos)
 			self._linepos += 3
-			return (data[3:], t)
+			return (t, pos+3)
 		
-		if data[0]=='!':
-			t = Token('not', data[0], self._lineno, self._linepos)
+		if c=='!':
+			t = Token('not', c, self._lineno, self._linepos)
 			self._linepos += 1
-			return (data[1:], t)
+			return (t, pos+1)
 			
-		if data[0:2]=='=~':
-			t = Token('match', data[0:2], self._lineno, self._linepos)
+		if pair=='=~':
+			t = Token('match', pair, self._lineno, self._linepos)
 			self._linepos += 2
-			return (data[2:], t)
+			return (t, pos+2)
 		
-		if data[0:2]=='in' and data[2] not in self._midsymchars:
-			t = Token('in', data[0:2], self._lineno, self._linepos)
+		if c=='i':
+			mg = self._exp_incidrop.match(source, pos)
+			if mg:
+				t = Token('incidr', mg.group(), self._lineno, self._linepos)
+				self._linepos += mg.end() - pos
+				return (t, mg.end())
+
+		if pair=='in' and source[pos+2] not in self._midsymchars:
+			t = Token('in', pair, self._lineno, self._linepos)
 			self._linepos += 2
-			return (data[2:], t)
+			return (t, pos+2)
 
-		
-		mg = self._exp_word.match(data)
+		mg = self._exp_word.match(source, pos)
 		if mg:
-			t = Token('symbol', mg.group(1), self._lineno, self._linepos)
-			self._linepos += len(mg.group(1))
-			return (mg.group(2), t )
+			t = Token('symbol', mg.group(), self._lineno, self._linepos)
+			self._linepos += mg.end() - pos
+			return (t, mg.end())
 		
-		raise errors.UnknownTokenError(data, self._lineno)
+		raise errors.UnknownTokenError(source[pos:], self._lineno)
 
 def divide_expressions(token_list):
 	"""Takes a list of Tokens. This list will divide the tokens for multiple
@@ -299,18 +378,22 @@ def tokenize(input, debugLogger=debug.NullDebugLogger()):
 	expressions (separated based on semicolons). This is only used for
 	building sieves, not standalone filters."""
 
+	debugging = debug.enabled(debugLogger)
 	tzr = Tokenizer()
 	tokens = []
-	while input:
-		(rest, token) = tzr.get_token(input)
-		input = rest
+	pos = 0
+	while pos < len(input):
+		(token, pos) = tzr.scan(input, pos)
 		if token:
-			debugLogger.write('* '+str(token))
+			if debugging:
+				debugLogger.write('* '+str(token))
 			tokens.append(token)
 
-	debugLogger.write('post-tokenize: '+str(tokens))
+	if debugging:
+		debugLogger.write('post-tokenize: '+str(tokens))
 	tokens = divide_expressions(tokens)
-	debugLogger.write('post-divide: '+str(tokens))
+	if debugging:
+		debugLogger.write('post-divide: '+str(tokens))
 	
 	return tokens
 	
\ No newline at end of file
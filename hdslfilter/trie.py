@@ -0,0 +1,115 @@
+
+#####################################################################################
+#####################################################################################
+## A trie of the dotted symbols (ie, "location.country") used by filter
+## expressions. Symbols which share a prefix share the trie nodes for it, so
+## looking them all up in one record looks each prefix up only once.
+#####################################################################################
+#####################################################################################
+
+class Missing(object):
+	"""The type of MISSING."""
+	def __repr__(self):
+		return 'MISSING'
+
+# the value resolve() gives for a path which does not exist in the record
+MISSING = Missing()
+
+class PathNode(object):
+	"""One dotted path prefix in a PathTrie. For "location.country" there
+	is a node for "location" whose child is a node for "location.country".
+	The root node represents the record itself and has no key."""
+
+	def __init__(self, key=None, parent=None):
+		self.key = key
+		self.parent = parent
+		self.children = {}
+		if parent is None:
+			self.path = ()
+		else:
+			self.path = parent.path + (key,)
+
+	def symbol(self):
+		"""Return the dotted symbol this node represents."""
+		return '.'.join(self.path)
+
+	def __repr__(self):
+		return '%s.%s(%s)' % (self.__module__, self.__class__.__name__, repr(self.symbol()))
+
+class PathTrie(object):
+	"""A trie of dotted symbols. Use add() to put symbols in it and
+	resolve() to look them up in a record."""
+
+	def __init__(self, symbols=()):
+		self.root = PathNode()
+		# maps symbols to their PathNodes
+		self._nodes = {}
+		for symbol in symbols:
+			self.add(symbol)
+
+	def add(self, symbol):
+		"""Add a dotted symbol to the trie if it isn't already there and
+		return its PathNode."""
+
+		if symbol in self._nodes:
+			return self._nodes[symbol]
+
+		node = self.root
+		for key in symbol.split('.'):
+			if key not in node.children:
+				node.children[key] = PathNode(key, node)
+			node = node.children[key]
+
+		self._nodes[symbol] = node
+		return node
+
+	def node(self, symbol):
+		"""Return the PathNode for symbol, adding it if needed."""
+		node = self._nodes.get(symbol)
+		if node is None:
+			node = self.add(symbol)
+		return node
+
+	def symbols(self):
+		"""Return all symbols which have been added to the trie."""
+		return self._nodes.keys()
+
+	def values(self, obj):
+		"""Return a new dict to hand to resolve() for looking symbols up in
+		the record obj."""
+		return {self.root: obj}
+
+def resolve(node, values):
+
+	"""Return the value of the path represented by node (a PathNode) in a
+	record. values maps the PathNodes already looked up in that record to
+	their values and must at least contain the trie root (see
+	PathTrie.values); anything looked up here is added to it. Returns
+	MISSING if some key along the path does not exist.
+
+	Keys are looked up in plain dicts without raising KeyError. Anything
+	else is indexed as usual, so dict subclasses behave as they would when
+	indexed and indexing things which aren't dicts raises just as it
+	would."""
+
+	if node in values:
+		return values[node]
+
+	parent = node.parent
+	if parent in values:
+		container = values[parent]
+	else:
+		container = resolve(parent, values)
+
+	if container is MISSING:
+		value = MISSING
+	elif type(container) is dict:
+		value = container.get(node.key, MISSING)
+	else:
+		try:
+			value = container[node.key]
+		except KeyError:
+			value = MISSING
+
+	values[node] = value
+	return value
@@ -0,0 +1,133 @@
+
+import os
+import mmap
+import array
+import threading
+
+#####################################################################################
+#####################################################################################
+## Value files hold the values for 'symbol in @"/path/to/file"', one per line.
+## Each file is loaded once per process (per version of the file) and shared
+## by every expression which references it.
+#####################################################################################
+#####################################################################################
+
+# files at least this big whose values are already sorted are searched in
+# place (memory mapped) rather than loaded into a set
+mmap_threshold = 16*1024*1024
+
+def _is_value(line):
+	"""Returns True if line (already stripped) holds a value, rather than
+	being blank or a comment."""
+	return len(line) > 0 and line[0] != '#'
+
+class ValueSet(object):
+	"""The values in a value file, held in a frozenset."""
+
+	def __init__(self, path):
+		self.path = path
+		f = open(path)
+		try:
+			self._values = frozenset([line for line in [line.strip() for line in f] if _is_value(line)])
+		finally:
+			f.close()
+
+	def __contains__(self, value):
+		return isinstance(value, basestring) and value in self._values
+
+	def __len__(self):
+		return len(self._values)
+
+class MappedValueSet(object):
+	"""The values in a large value file whose values are in sorted order,
+	searched by bisection in a memory mapping of the file. Only the
+	offsets of the values are held in memory."""
+
+	def __init__(self, path, data, starts, ends):
+		self.path = path
+		self._data = data
+		self._starts = starts
+		self._ends = ends
+
+	def __contains__(self, value):
+		if not isinstance(value, basestring):
+			return False
+		data = self._data
+		starts = self._starts
+		ends = self._ends
+		low = 0
+		high = len(starts)
+		while low < high:
+			middle = (low + high) // 2
+			if data[starts[middle]:ends[middle]] < value:
+				low = middle + 1
+			else:
+				high = middle
+		return low < len(starts) and data[starts[low]:ends[low]] == value
+
+	def __len__(self):
+		return len(self._starts)
+
+def map_sorted(path):
+	"""Return a MappedValueSet for the value file at path, or None if its
+	values aren't sorted."""
+
+	f = open(path, 'rb')
+	try:
+		if os.fstat(f.fileno()).st_size == 0:
+			return None
+		data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+	finally:
+		f.close()
+
+	starts = array.array('L')
+	ends = array.array('L')
+	previous = None
+	position = 0
+	size = len(data)
+	while position < size:
+		end = data.find('\n', position)
+		if end < 0:
+			end = size
+		line = data[position:end]
+		stripped = line.strip()
+		if _is_value(stripped):
+			if previous is not None and stripped <= previous:
+				data.close()
+				return None
+			start = position + line.index(stripped)
+			starts.append(start)
+			ends.append(start + len(stripped))
+			previous = stripped
+		position = end + 1
+
+	return MappedValueSet(path, data, starts, ends)
+
+# maps (path, modification time, size) to ValueSets and MappedValueSets
+_loaded = {}
+_lock = threading.Lock()
+
+def load(path):
+	"""Return the values in the value file at path, as something which
+	supports 'in'. Only strings are ever in it. The file is read once;
+	later loads of the same unchanged file return the same object. May
+	raise IOError or OSError."""
+
+	path = os.path.abspath(path)
+	st = os.stat(path)
+	key = (path, st.st_mtime, st.st_size)
+	_lock.acquire()
+	try:
+		if key not in _loaded:
+			values = None
+			if st.st_size >= mmap_threshold:
+				values = map_sorted(path)
+			if values is None:
+				values = ValueSet(path)
+			# drop older versions of the file
+			for old_key in [k for k in _loaded if k[0]==path]:
+				del _loaded[old_key]
+			_loaded[key] = values
+		return _loaded[key]
+	finally:
+		_lock.release()
@@ -0,0 +1,104 @@
+"""Expressions and records shared by the tests which check that something
+(an engine, a Sieve, an optimization) gives the same results, and raises the
+same exceptions, as evaluating FilterExpressions one at a time."""
+
+expressions = [
+	'a == 1',
+	'a != 1',
+	'b == "x"',
+	'a == 1 and b == "x"',
+	'b == "y" or a == 2',
+	'not a == 1',
+	'a or b',
+	'a and b',
+	'm =~ /world/',
+	'm =~ /^hello$/',
+	'm =~ /(?i)hello/',
+	'm =~ p',
+	'a == 1 or n =~ "("',
+	'n =~ "(" and a == 1',
+	'b in ["x" "y"]',
+	'a not in [1 2]',
+	'ip in cidr ["10.0.0.0/8" "2001:db8::/32"]',
+	'ip not in cidr ["192.168.0.0/16"]',
+	'f > 1 and f <= 10',
+	'a < 2 or f >= 10',
+	'geo.country == "US"',
+	'geo.country in ["US" "PL"] and not m =~ /HELLO/',
+	'geo == "flat"',
+	'missing == 1 or missing.deeper == "x"',
+	'1 == 1 and a == 1',
+	'"x" =~ /x/ or b == "q"',
+	'(a == 1 or a == 2) and (b == "x" or b == "y")',
+	'a == 1 or a == 2 or a == 3',
+	'b != "x" and b != "y"',
+	'm =~ /wor/ and m =~ /ld$/ or m =~ /wor/ and a == 2',
+	'b =~ /x/ and a == 1',
+	'm =~ p and a == 1',
+]
+
+records = [
+	{},
+	{'a': 1, 'b': 'x', 'n': 'abc', 'm': 'hello world', 'p': 'wor', 'ip': '10.1.2.3', 'f': 1.5,
+		'geo': {'country': 'US'}},
+	{'a': 2, 'b': 'y', 'n': '(', 'm': 'HELLO', 'p': '(', 'ip': '192.168.0.1', 'f': -3,
+		'geo': {'country': 'PL'}},
+	{'a': '1', 'b': None, 'm': 5, 'p': 5, 'ip': 'not an address', 'f': 'x', 'geo': 'flat'},
+	{'a': True, 'b': 0, 'm': '', 'p': '', 'ip': '2001:db8::1', 'geo': {}},
+	{'a': [1], 'b': {'x': 1}, 'm': 'x', 'p': 'x', 'geo': {'country': ['US']}},
+	{'a': 0L, 'b': 'x', 'n': 'x\n', 'm': 'hello\n', 'p': '^hello$', 'f': 10,
+		'geo': {'country': 'UK'}},
+	{'a': 2, 'b': [1]},
+	{'a': 1, 'b': 'x', 'm': 'world', 'p': 7},
+]
+
+# the source code of Sieves in which expressions are duplicates of, or
+# imply, earlier ones (see prune.dead_expressions)
+pruned = [
+	'a == 1;\na == 1;',
+	'a == 1;\na == 1 and b == "x";',
+	'a == 1;\nb == "x" and a == 1;',
+	'a in [1 2];\na == 2 and f > 1;',
+	'f > 1;\nf > 5 and f < 7;',
+	'b == "x" or a == 2;\na == 2;\nb == "x";',
+	'1 == 2;\na == 1;',
+	'1 == 1;\nb == "x";',
+	'm =~ /world/;\nm =~ /world/ and a == 1;',
+	'geo.country == "US";\ngeo.country == "US" and geo == "flat";',
+	'a == 1;\nm =~ p and a == 1;\nm =~ p and a == 1;',
+	'a == 1;\nn =~ "(" and a == 1;',
+	'm =~ p;\nm =~ p;',
+]
+
+def outcome(function, *args):
+	"""Return ('value', type, value) for what function returns when called
+	with args, or ('raises', class) for the class of the exception it
+	raises."""
+	try:
+		value = function(*args)
+	except Exception, e:
+		return ('raises', e.__class__)
+	return ('value', type(value), value)
+
+def first_match(filter_expressions, record):
+	"""Return the position of the first of filter_expressions which
+	matches record, or None, evaluating them in order with
+	FilterExpression.match (so raising what that raises)."""
+	for (i, fe) in enumerate(filter_expressions):
+		if fe.match(record)==True:
+			return i
+	return None
+
+def all_matches(filter_expressions, record):
+	"""Return the positions of all of filter_expressions which match
+	record, evaluating every one of them with FilterExpression.match."""
+	return [i for (i, fe) in enumerate(filter_expressions) if fe.match(record)==True]
+
+def sieve_sources():
+	"""Return the source code of Sieves made of the expressions: each on
+	its own, each run of three, and all of them."""
+	sources = [src + ';' for src in expressions]
+	for i in range(len(expressions)-2):
+		sources.append(';\n'.join(expressions[i:i+3]) + ';')
+	sources.append(';\n'.join(expressions) + ';')
+	return sources
@@ -0,0 +1,82 @@
+import gc
+import unittest
+
+from hdslfilter import cache
+from hdslfilter import filter
+
+class RegexCacheTests(unittest.TestCase):
+
+	def test_dynamic_regexes_not_kept(self):
+		# regexes which are the values of symbols come from the bounded
+		# cache.regexes store; only the expression's literals are kept
+		fe = filter.FilterExpression.from_string('m =~ p or n =~ /lit/')
+		for i in range(2000):
+			self.assertEqual(fe.match({'m': 'x%d' % i, 'p': 'x%d$' % i, 'n': ''}), True)
+		self.assertEqual(fe._rc._literals.keys(), ['lit'])
+
+	def test_invalid_literal(self):
+		# a literal regex which doesn't compile raises when it's used, as
+		# before
+		fe = filter.FilterExpression.from_string('a == 1 or n =~ "("')
+		self.assertEqual(fe.match({'a': 1, 'n': 'x'}), True)
+		self.assertRaises(Exception, fe.match, {'a': 2, 'n': 'x'})
+
+class RegexStoreTests(unittest.TestCase):
+
+	def setUp(self):
+		self.saved = cache.regexes
+		cache.regexes = cache.RegexStore(16)
+
+	def tearDown(self):
+		cache.regexes = self.saved
+
+	def test_one_compile_per_build(self):
+		# far more regexes than the store holds, each compiled once by the
+		# tokenizer and found again by every later stage of the build
+		src = ''.join(['m =~ /x%d[ab]+y/ and a == %d;\n' % (i, i) for i in range(200)])
+		sieve = filter.Sieve.from_str(src)
+		stats = cache.regexes.stats()
+		self.assertEqual(stats['compiles'], 200)
+		self.assertEqual(stats['misses'], 200)
+		self.assertTrue(stats['hits'] >= 600)
+		self.assertEqual(sieve.match({'m': 'x17aby', 'a': 17}), True)
+		self.assertEqual(sieve.match({'m': 'x17aby', 'a': 18}), False)
+		# and not again for another Sieve using them while this one's alive
+		filter.Sieve.from_str(src, adaptive=True)
+		self.assertEqual(cache.regexes.stats()['compiles'], 200)
+
+	def test_in_use(self):
+		store = cache.RegexStore(1)
+		search = store.searcher('a+')
+		store.searcher('b+')
+		self.assertEqual(len(store), 1)
+		self.assertTrue(store.searcher('a+') is search)
+		self.assertEqual(store.stats()['compiles'], 2)
+
+	def test_unused_evicted(self):
+		store = cache.RegexStore(1)
+		store.searcher('a+')
+		store.searcher('b+')
+		gc.collect()
+		store.searcher('a+')
+		self.assertEqual(store.stats()['compiles'], 3)
+
+	def test_max_bytes(self):
+		store = cache.RegexStore(100, max_bytes=10)
+		for pattern in ('aaaa', 'bbbb', 'cccc'):
+			store.searcher(pattern)
+		stats = store.stats()
+		self.assertEqual((stats['length'], stats['bytes'], stats['max_bytes']), (2, 8, 10))
+		# one pattern is held, however long
+		store.searcher('d' * 20)
+		self.assertEqual((len(store), store.stats()['bytes']), (1, 20))
+		self.assertRaises(ValueError, cache.RegexStore, 10, 0)
+
+	def test_invalid(self):
+		store = cache.RegexStore(4)
+		for i in range(2):
+			self.assertRaises(Exception, store.searcher, '(')
+		self.assertEqual(len(store), 0)
+
+if __name__ == '__main__':
+	unittest.main()
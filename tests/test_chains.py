@@ -0,0 +1,40 @@
+import cPickle
+import unittest
+
+from hdslfilter import filter
+
+# longer than python's default recursion limit
+count = 2000
+clause = '(host == "web%d" and program =~ /^sshd/)'
+src = ' or '.join([clause % i for i in range(count)])
+last = {'host': 'web%d' % (count-1), 'program': 'sshd'}
+none = {'host': 'web%d' % count, 'program': 'sshd'}
+
+class LongChainTests(unittest.TestCase):
+
+	def check(self, matcher):
+		self.assertEqual(matcher.match(last), True)
+		self.assertEqual(matcher.match(none), False)
+
+	def test_engines(self):
+		for engine in ('eval', 'closure'):
+			self.check(filter.FilterExpression.from_string(src, engine=engine))
+
+	def test_sieves(self):
+		for adaptive in (False, True):
+			self.check(filter.Sieve.from_str(src, adaptive=adaptive))
+
+	def test_specialize(self):
+		sieve = filter.Sieve.from_str(src + ';\nhost == "x"')
+		self.check(sieve.specialize({'program': 'sshd'}))
+
+	def test_pickle(self):
+		sieve = filter.Sieve.from_str(src)
+		self.check(cPickle.loads(cPickle.dumps(sieve, cPickle.HIGHEST_PROTOCOL)))
+
+	def test_repr(self):
+		fe = filter.FilterExpression.from_string(src)
+		self.assertEqual(repr(fe.parse_tree()).count('LogicalExpression('), 2*count-1)
+
+if __name__ == '__main__':
+	unittest.main()
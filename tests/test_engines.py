@@ -0,0 +1,40 @@
+import unittest
+
+from hdslfilter import filter
+
+import corpus
+
+class EngineTests(unittest.TestCase):
+	"""Both engines must give identical results, and raise the same
+	exceptions, for every record."""
+
+	def build(self, src):
+		return [filter.FilterExpression.from_string(src, engine=engine) for engine in filter.FilterExpression.engines]
+
+	def test_equivalence(self):
+		for src in corpus.expressions:
+			(by_eval, by_closure) = self.build(src)
+			self.assertEqual(by_closure.engine(), 'closure')
+			for record in corpus.records:
+				self.assertEqual(corpus.outcome(by_eval.match, record), corpus.outcome(by_closure.match, record),
+					'%s on %r' % (src, record))
+
+	def test_invalid_regex(self):
+		# a regex which doesn't compile only raises if it's used
+		for fe in self.build('a == 1 or n =~ "("'):
+			self.assertEqual(fe.match({'a': 1}), True)
+			self.assertEqual(fe.match({'a': 2}), False)
+			self.assertRaises(Exception, fe.match, {'a': 2, 'n': 'x'})
+
+	def test_values(self):
+		# 'and' and 'or' evaluate to one of their operands, as in python
+		for fe in self.build('a or b'):
+			self.assertEqual(fe.match({'a': 0, 'b': 'x'}), 'x')
+			self.assertEqual(fe.match({'a': 5, 'b': 'x'}), 5)
+
+	def test_not_a_dict(self):
+		for fe in self.build('a == 1'):
+			self.assertRaises(TypeError, fe.match, [('a', 1)])
+
+if __name__ == '__main__':
+	unittest.main()
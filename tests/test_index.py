@@ -0,0 +1,57 @@
+import unittest
+
+from hdslfilter import filter
+
+import corpus
+
+class DispatchIndexTests(unittest.TestCase):
+	"""A Sieve only evaluates the expressions its index finds can match a
+	record, which must give the same results, and raise the same
+	exceptions, as evaluating every expression in order."""
+
+	def test_sieves(self):
+		for src in corpus.sieve_sources():
+			sieve = filter.Sieve.from_str(src)
+			fes = sieve._filter_exprs
+			for record in corpus.records:
+				expected = corpus.outcome(corpus.first_match, fes, record)
+				if expected[0]=='value':
+					found = expected[2] is not None
+					trace = (found, found and fes[expected[2]] or None)
+					expected = ('value', type(True), found)
+					self.assertEqual(corpus.outcome(sieve.match_trace, record), ('value', type(()), trace), '%s on %r' % (src, record))
+				self.assertEqual(corpus.outcome(sieve.match, record), expected, '%s on %r' % (src, record))
+
+	def test_earlier_clause_raises(self):
+		# "a == 1" rules the expression out, but only after "b =~ /x/" has
+		# raised
+		sieve = filter.Sieve.from_str('b =~ /x/ and a == 1;')
+		record = {'a': 2, 'b': [1]}
+		self.assertRaises(filter.SymbolExpansionTypeError, sieve._filter_exprs[0].match, record)
+		self.assertRaises(filter.SymbolExpansionTypeError, sieve.match, record)
+		self.assertRaises(filter.SymbolExpansionTypeError, sieve.match_trace, record)
+		self.assertEqual(sieve.match({'a': 2, 'b': 'x'}), False)
+		self.assertEqual(sieve.match({'a': 1, 'b': 'x'}), True)
+
+	def test_earlier_clause_short_circuits(self):
+		# the guard's symbol isn't looked up when the record can't match,
+		# so only a record which gets that far raises
+		sieve = filter.Sieve.from_str('(c == 1 or b == 2) and a == 1;')
+		self.assertEqual(sieve.match({'a': 2, 'c': 1, 'b': [1]}), False)
+		self.assertRaises(filter.SymbolExpansionTypeError, sieve.match, {'a': 2, 'c': 2, 'b': [1]})
+
+	def test_dynamic_regex(self):
+		# a clause after one which may raise isn't indexed
+		sieve = filter.Sieve.from_str('m =~ p and a == 1;')
+		self.assertEqual(sieve._index.candidates({'a': 2, 'm': 'x', 'p': 5}.get), [0])
+		self.assertRaises(TypeError, sieve.match, {'a': 2, 'm': 'x', 'p': 5})
+
+	def test_indexed(self):
+		sieve = filter.Sieve.from_str('host == "a" and prog =~ /x/;\nhost == "b";\nn > 5 and n < 10;\nprog == "c";')
+		candidates = sieve._index.candidates
+		self.assertEqual(candidates({'host': 'a', 'n': 1}.get), [0])
+		self.assertEqual(candidates({'host': 'b', 'n': 7, 'prog': 'c'}.get), [1, 2, 3])
+		self.assertEqual(candidates({}.get), [])
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,68 @@
+import re
+import unittest
+
+from hdslfilter import literalregex
+
+literals = ['doe', 'Doe', r'x\.y', 'a b', '']
+starts = ['', '^', r'\A']
+ends = ['', '$', r'\Z']
+
+subjects = ['', 'doe', 'Doe', 'DOE', 'john doe', 'doe john', 'xdoex',
+	'doe\n', 'doe\n\n', 'doe \n', '\ndoe', 'doe\nx', 'x\ndoe\n', 'x\nDOE\nx',
+	'x.y', 'xzy', 'X.Y', 'a b', 'A B', 'a\nb',
+	'\xe9t\xe9', '\xc9T\xc9', 'caf\xe9 doe', 'd\xf6e', 'D\xd6E']
+
+def anchored(flags=''):
+	"""Return every pattern of the literals with every combination of
+	anchors, prefixed with flags (ie, '(?i)')."""
+	return [flags + start + literal + end for literal in literals for start in starts for end in ends]
+
+class LiteralRegexTests(unittest.TestCase):
+
+	def check(self, patterns, literal):
+		"""Check that the searcher for each of patterns gives the same
+		answers as re.search for every subject, and that it is searched
+		for as a literal (see literalregex.analyze) if literal is True or
+		with the re module if it is False."""
+		for pattern in patterns:
+			self.assertEqual(literalregex.analyze(pattern) is not None, literal, pattern)
+			search = literalregex.searcher(pattern)
+			for subject in subjects:
+				self.assertEqual(search(subject), re.search(pattern, subject) is not None,
+					'%r on %r' % (pattern, subject))
+
+	def test_anchors(self):
+		self.check(anchored(), True)
+
+	def test_ignorecase(self):
+		self.check(anchored('(?i)'), True)
+
+	def test_harmless_flags(self):
+		self.check(anchored('(?s)') + anchored('(?x)') + anchored('(?is)'), True)
+
+	def test_trailing_newline(self):
+		# $ matches before a newline at the end; \Z doesn't
+		self.check(['doe$', '^doe$', r'doe\n$', r'^doe\n$', r'doe\n\Z', r'doe\Z', '(?i)^DOE$'], True)
+		self.assertEqual(literalregex.searcher('^doe$')('doe\n'), True)
+		self.assertEqual(literalregex.searcher(r'^doe\Z')('doe\n'), False)
+
+	def test_non_ascii(self):
+		# non-ASCII characters are left to the re module
+		self.check(['\xe9t\xe9', '(?i)\xe9t\xe9', '(?i)^\xc9T\xc9$', 'caf\xe9', r'd\xf6e$'], False)
+
+	def test_flag_fallbacks(self):
+		# MULTILINE changes what the anchors match; LOCALE and UNICODE
+		# change what IGNORECASE folds
+		self.check(anchored('(?m)') + anchored('(?im)'), False)
+		self.check(anchored('(?L)') + anchored('(?iL)'), False)
+		self.check(anchored('(?u)') + anchored('(?iu)'), False)
+
+	def test_not_literal(self):
+		self.check(['d.e', '^do+e$', 'doe|john', '[dx]oe', r'\bdoe', 'x.y', '^$doe', 'doe^'], False)
+
+	def test_invalid(self):
+		self.assertEqual(literalregex.analyze('('), None)
+		self.assertRaises(re.error, literalregex.searcher, '(')
+
+if __name__ == '__main__':
+	unittest.main()
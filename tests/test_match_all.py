@@ -0,0 +1,46 @@
+import unittest
+
+from hdslfilter import filter
+
+import corpus
+
+class MatchAllTests(unittest.TestCase):
+	"""match_all, match_bits and results must agree with evaluating every
+	expression, and raise the same exceptions, including for the
+	expressions match never evaluates (see prune.dead_expressions)."""
+
+	def check(self, src):
+		sieve = filter.Sieve.from_str(src)
+		fes = sieve._filter_exprs
+		for record in corpus.records:
+			expected = corpus.outcome(corpus.all_matches, fes, record)
+			where = '%s on %r' % (src, record)
+			if expected[0]=='raises':
+				for method in (sieve.match_all, sieve.match_bits, sieve.results):
+					self.assertEqual(corpus.outcome(method, record), expected, where)
+				continue
+			numbers = expected[2]
+			self.assertEqual(sieve.match_all(record), [fes[i] for i in numbers], where)
+			self.assertEqual(sieve.match_bits(record), sum([1 << i for i in numbers]), where)
+			self.assertEqual(sieve.results(record), [i in numbers for i in range(len(fes))], where)
+
+	def test_equivalence(self):
+		for src in corpus.sieve_sources():
+			self.check(src)
+
+	def test_pruned(self):
+		for src in corpus.pruned:
+			self.check(src)
+		sieve = filter.Sieve.from_str('a == 1;\na == 1;\nb == "x" and a == 1;')
+		self.assertEqual(len(sieve.pruned()), 2)
+		self.assertEqual(sieve.results({'a': 1, 'b': 'x'}), [True, True, True])
+		self.assertEqual(sieve.match_bits({'a': 1, 'b': 'y'}), 3)
+
+	def test_empty(self):
+		sieve = filter.Sieve.from_str('a == 1;')
+		self.assertEqual(sieve.match_all({}), [])
+		self.assertEqual(sieve.match_bits({}), 0)
+		self.assertRaises(TypeError, sieve.match_all, [])
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,75 @@
+import unittest
+
+from hdslfilter import filter
+from hdslfilter import parse
+from hdslfilter import tokenize
+from hdslfilter import trie
+
+import corpus
+
+expressions = corpus.expressions + [
+	'a == 1 or a == 2 or b == "x" or b == "y"',
+	'a != 1 and a != 2',
+	'not (not a == 1)',
+	'not (not a)',
+	'1 == 1',
+	'1 == 2 or a == 1',
+	'a == 1 or 1 == 1',
+	'a or 1 == 1',
+	'a and 1 == 1',
+	'a == 1 and 1 == 1',
+	'a == 1 and a == 1',
+	'a or a',
+	'"x" == "x" and (a or b)',
+	'a and 1 == 2',
+	'(a == 1 or b == 2) or (a == 1 or c == 3)',
+	'"(" =~ "(" or a == 1',
+]
+
+def unoptimized(src):
+	"""Return a function evaluating src's parse tree, as it is before it's
+	optimized, against a record."""
+	tree = parse.parse(tokenize.Tokenizer().tokens(src))
+	closure = filter.ClosureCompiler(filter.RegexCache(), filter.NetworkCache()).closure(tree)
+	path_trie = trie.PathTrie(tree.find_symbols())
+	def evaluate(record):
+		return closure(filter.SymbolTable(record, path_trie))
+	return evaluate
+
+def tree(src):
+	return filter.FilterExpression.from_string(src).parse_tree()
+
+class OptimizerTests(unittest.TestCase):
+
+	def test_equivalence(self):
+		# optimizing changes neither the result nor what's raised
+		for src in expressions:
+			evaluate = unoptimized(src)
+			for engine in filter.FilterExpression.engines:
+				fe = filter.FilterExpression.from_string(src, engine=engine)
+				for record in corpus.records:
+					self.assertEqual(corpus.outcome(fe.match, record), corpus.outcome(evaluate, record),
+						'%s on %r' % (src, record))
+
+	def test_folded(self):
+		self.assertEqual(tree('1 == 1').__class__, parse.ConstantExpression)
+		self.assertEqual(tree('1 == 1 and a == 1').key(), tree('a == 1').key())
+		self.assertEqual(tree('1 == 2 or a == 1').key(), tree('a == 1').key())
+
+	def test_merged(self):
+		self.assertEqual(tree('a == 1 or a == 2').key(), tree('a in [1 2]').key())
+		self.assertEqual(tree('a != 1 and a != 2').key(), tree('a not in [1 2]').key())
+		# strings and ints aren't merged together
+		self.assertEqual(tree('a == 1 or a == "1"').__class__, parse.LogicalExpression)
+
+	def test_duplicates(self):
+		self.assertEqual(tree('a == 1 and a == 1').key(), tree('a == 1').key())
+		# non-boolean operands are kept, since they're the chain's value
+		self.assertEqual(tree('a or a').__class__, parse.LogicalExpression)
+
+	def test_double_negation(self):
+		self.assertEqual(tree('not (not a == 1)').key(), tree('a == 1').key())
+		self.assertEqual(tree('not (not a)').__class__, parse.NotExpression)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,52 @@
+import re
+import unittest
+
+from hdslfilter import filter
+from hdslfilter import ordering
+
+class AdaptiveExceptionTests(unittest.TestCase):
+	"""An adaptive Sieve must raise whatever the same Sieve evaluated in
+	order raises, including exceptions which don't come from looking
+	symbols up (matching against a regex which is the value of a symbol)."""
+
+	def warm_up(self, sieve):
+		# enough records for the operand or expression which always
+		# decides to be moved to the front
+		for i in range(4 * ordering.reorder_interval):
+			sieve.match({'m': 'x', 'p': 'zz', 'a': 1})
+
+	def check(self, src):
+		in_order = filter.Sieve.from_str(src)
+		adaptive = filter.Sieve.from_str(src, adaptive=True)
+		self.warm_up(adaptive)
+		record = {'m': 'x', 'p': 5, 'a': 1}
+		self.assertRaises(TypeError, in_order.match, record)
+		self.assertRaises(TypeError, adaptive.match, record)
+		# records which don't raise still match
+		self.assertEqual(adaptive.match({'m': 'x', 'p': 'x', 'a': 2}), True)
+		self.assertEqual(adaptive.match({'m': 'x', 'p': 'y', 'a': 2}), False)
+
+	def test_chain(self):
+		self.check('m =~ p or a == 1')
+
+	def test_expressions(self):
+		self.check('m =~ p;\na == 1')
+
+	def test_reordered(self):
+		# the chain really was reordered, so the check above means something
+		sieve = filter.Sieve.from_str('m =~ p or a == 1', adaptive=True)
+		self.warm_up(sieve)
+		(chain,) = sieve._closures
+		self.assertEqual(chain.order(), [1, 0])
+
+	def test_uncompileable(self):
+		# so does matching against a literal regex which doesn't compile
+		sieve = filter.Sieve.from_str('n =~ "(" or a == 1', adaptive=True)
+		for i in range(4 * ordering.reorder_interval):
+			sieve.match({'a': 1})
+		(chain,) = sieve._closures
+		self.assertEqual(chain.order(), [1, 0])
+		self.assertRaises(re.error, sieve.match, {'n': 'x', 'a': 1})
+
+if __name__ == '__main__':
+	unittest.main()
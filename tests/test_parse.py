@@ -0,0 +1,56 @@
+import unittest
+
+from hdslfilter import tokenize
+from hdslfilter import parse
+from hdslfilter import errors
+
+import corpus
+
+# input which parse.Parser leaves to the stages: errors, and the forms they
+# treat oddly
+irregular = [
+	'a ==', '== a', 'a == 1 or', 'not ', 'a not ', 'a == 1 b', 'a b', 'and a',
+	'not not a', 'not (not a)', 'not not a == 1 or b', 'a == (b or c)', '(a or b) == 1',
+	'a == (b == c)', 'a == 1 == 2', 'a == == b', 'a in [1 2] == 1',
+	'()', '() or a', 'a == ()', '(()) == 1', '() == ()', '() () a == 1', 'not () ()',
+	'a == 1 or () or () or b == 2', 'a == 1 and ((', 'a == 1 and ))',
+	'[1 2]', 'a in [1 "x"]', 'a in [b]', 'a in [1', 'a in cidr ["bad"]',
+]
+
+def outcome(function, src):
+	"""Return corpus.outcome of function on the tokens of src, with the
+	tree's dump (or the exception's attributes)."""
+	tokens = tokenize.tokenize(src)[0]
+	try:
+		return ('value', function(tokens).dump())
+	except Exception, e:
+		return ('raises', e.__class__, repr(sorted(vars(e).items())))
+
+class StagesTests(unittest.TestCase):
+	"""parse_in_stages applies precedence in one pass, which must give the
+	same trees and errors as finding operators and operands with
+	list.index and list.remove did."""
+
+	def by_equality(self, tokens):
+		ambiguous = parse.ambiguous
+		parse.ambiguous = lambda tokens: True
+		try:
+			return parse.parse_in_stages(tokens)
+		finally:
+			parse.ambiguous = ambiguous
+
+	def test_equivalence(self):
+		for src in irregular + corpus.expressions:
+			expected = outcome(self.by_equality, src)
+			self.assertEqual(outcome(parse.parse_in_stages, src), expected, src)
+			self.assertEqual(outcome(parse.parse, src), expected, src)
+
+	def test_long_chain(self):
+		# an error at the end of a long chain is found without the time
+		# finding operands with list.index takes growing with its square
+		src = ' or '.join(['(host == "web%d" and program =~ /^sshd/)' % i for i in range(3000)])
+		tokens = tokenize.tokenize(src + ' or not not z == 1')[0]
+		self.assertRaises(errors.OperatorInsteadOfOperand, parse.parse, tokens)
+
+if __name__ == '__main__':
+	unittest.main()
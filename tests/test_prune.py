@@ -0,0 +1,75 @@
+import unittest
+
+from hdslfilter import filter
+
+import corpus
+
+class PruneTests(unittest.TestCase):
+	"""A Sieve never evaluates its dead expressions (see
+	prune.dead_expressions) unless that might raise an exception, which
+	must give the same results, and raise the same exceptions, as
+	evaluating every expression in order."""
+
+	def check(self, src):
+		sieve = filter.Sieve.from_str(src)
+		fes = sieve._filter_exprs
+		for record in corpus.records:
+			expected = corpus.outcome(corpus.first_match, fes, record)
+			if expected[0]=='value':
+				found = expected[2] is not None
+				trace = (found, found and fes[expected[2]] or None)
+				expected = ('value', type(True), found)
+				self.assertEqual(corpus.outcome(sieve.match_trace, record), ('value', type(()), trace), '%s on %r' % (src, record))
+			self.assertEqual(corpus.outcome(sieve.match, record), expected, '%s on %r' % (src, record))
+		return sieve
+
+	def reasons(self, src):
+		return [reason for (fe, reason, by) in filter.Sieve.from_str(src).pruned()]
+
+	def test_pruned(self):
+		for src in corpus.pruned:
+			self.check(src)
+		self.check('\n'.join(corpus.pruned))
+
+	def test_reasons(self):
+		self.assertEqual(self.reasons('a == 1;\na == 1;'), ['duplicate'])
+		self.assertEqual(self.reasons('a == 1;\nb == "x" and a == 1;'), ['subsumed'])
+		self.assertEqual(self.reasons('1 == 2;\na == 1;'), ['never matches'])
+		self.assertEqual(self.reasons('1 == 1;\nb == "x";'), ['subsumed'])
+
+	def test_may_raise(self):
+		# an expression which may raise is never dead
+		self.assertEqual(self.reasons('a == 1;\nm =~ p and a == 1;\nm =~ p and a == 1;'), [])
+		self.assertEqual(self.reasons('a == 1;\nn =~ "(" and a == 1;'), [])
+		sieve = self.check('a == 1;\nm =~ p and a == 1;\nm =~ p and a == 1;')
+		self.assertRaises(Exception, sieve.match, {'a': 2, 'm': 'x', 'p': '('})
+
+	def test_symbol_lookup(self):
+		# "c == 2 and a == 1" is dead, but raises looking c up when "a == 1"
+		# is false
+		sieve = self.check('a == 1;\nc == 2 and a == 1;')
+		self.assertEqual(self.reasons('a == 1;\nc == 2 and a == 1;'), ['subsumed'])
+		self.assertRaises(filter.SymbolExpansionTypeError, sieve.match, {'a': 2, 'c': [1]})
+		self.assertRaises(filter.SymbolExpansionTypeError, sieve.match_trace, {'a': 2, 'c': [1]})
+		self.assertEqual(sieve.match({'a': 1, 'c': [1]}), True)
+		self.assertEqual(sieve._index.candidates({'a': 2, 'c': 2}.get), [])
+		def lookup(symbol):
+			if symbol=='c':
+				raise ValueError(symbol)
+			return 2
+		self.assertEqual(sieve._index.candidates(lookup), [1])
+
+	def test_router(self):
+		sieves = dict([('s%d' % i, filter.Sieve.from_str(src)) for (i, src) in enumerate(corpus.pruned)])
+		router = filter.Router(sieves)
+		for record in corpus.records:
+			for (name, sieve) in sieves.iteritems():
+				if corpus.outcome(sieve.match, record)[0]=='raises':
+					self.assertRaises(Exception, router.match, record)
+					break
+			else:
+				expected = set([name for (name, sieve) in sieves.iteritems() if sieve.match(record)])
+				self.assertEqual(router.match(record), expected, repr(record))
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,59 @@
+import re
+import unittest
+
+from hdslfilter import filter
+from hdslfilter import regexset
+
+import corpus
+
+# combinable, prefiltered by a required literal, never combinable
+# (backreferences, named groups, verbose) and uncompileable regexes
+patterns = ['foo', '^bar', 'baz$', '(?i)QUX', 'a|b', r'\d+', 'x(y)z',
+	r'sshd\[\d+\]: Failed', 'error: .*timeout', r'(\w)\1', '(?P<word>w+)',
+	'(?x) f o o ', '(', '[', '^$']
+
+subjects = ['', 'foo', 'bar', 'a bar', 'baz', 'bazz', 'qux', 'QUX', 'b', '123',
+	'xyz', 'sshd[42]: Failed password', 'sshd[x]: Failed', 'error: disk timeout',
+	'aa', 'ab', 'www', 'foo\n']
+
+class RegexSetTests(unittest.TestCase):
+
+	def test_matches(self):
+		regex_set = regexset.RegexSet()
+		numbers = [regex_set.add(pattern) for pattern in patterns]
+		regex_set.compile()
+		for subject in subjects:
+			results = regex_set.scan(subject)
+			for (pattern, number) in zip(patterns, numbers):
+				try:
+					expected = re.search(pattern, subject) is not None
+				except re.error:
+					self.assertRaises(re.error, regex_set.search, number, results)
+					continue
+				self.assertEqual(regex_set.search(number, results), expected, '%r on %r' % (pattern, subject))
+
+	def test_none(self):
+		regex_set = regexset.RegexSet()
+		number = regex_set.add('(')
+		self.assertEqual(regex_set.search(number, regex_set.scan(None)), False)
+
+	def test_sieve(self):
+		src = ''.join(['m =~ "%s";\n' % pattern.replace('\\', '\\\\') for pattern in patterns])
+		sieve = filter.Sieve.from_str(src)
+		fes = sieve._filter_exprs
+		for subject in subjects + [None, 5]:
+			record = {'m': subject}
+			self.assertEqual(corpus.outcome(sieve.match, record),
+				corpus.outcome(lambda: corpus.first_match(fes, record) is not None))
+			self.assertEqual(corpus.outcome(sieve.match_all, record),
+				corpus.outcome(lambda: [fes[i] for i in corpus.all_matches(fes, record)]))
+
+	def test_uncompileable(self):
+		# a regex which doesn't compile only raises if it's evaluated
+		sieve = filter.Sieve.from_str('a == 1 or n =~ "(";')
+		self.assertEqual(sieve.match({'a': 1, 'n': 'x'}), True)
+		self.assertEqual(sieve.match({'a': 2}), False)
+		self.assertRaises(re.error, sieve.match, {'a': 2, 'n': 'x'})
+
+if __name__ == '__main__':
+	unittest.main()
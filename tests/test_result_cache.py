@@ -0,0 +1,56 @@
+import unittest
+
+from hdslfilter import filter
+
+import corpus
+
+class ResultCacheTests(unittest.TestCase):
+	"""Caching results (see FilterExpression.cache_results) must not change
+	what match returns or raises, however often a record repeats."""
+
+	def test_expressions(self):
+		for src in corpus.expressions:
+			for engine in filter.FilterExpression.engines:
+				plain = filter.FilterExpression.from_string(src, engine=engine)
+				cached = filter.FilterExpression.from_string(src, engine=engine)
+				cached.cache_results(4)
+				for record in corpus.records * 2:
+					self.assertEqual(corpus.outcome(cached.match, record), corpus.outcome(plain.match, record),
+						'%s on %r' % (src, record))
+
+	def test_sieves(self):
+		for src in corpus.sieve_sources() + corpus.pruned:
+			for adaptive in (False, True):
+				plain = filter.Sieve.from_str(src, adaptive)
+				cached = filter.Sieve.from_str(src, adaptive)
+				cached.cache_results(4)
+				for record in corpus.records * 2:
+					self.assertEqual(corpus.outcome(cached.match, record), corpus.outcome(plain.match, record),
+						'%s on %r' % (src, record))
+
+	def test_keys(self):
+		# 1, 1.0 and True are equal, but not to a regex
+		fe = filter.FilterExpression.from_string('m =~ /^1$/')
+		fe.cache_results()
+		self.assertEqual(fe.match({'m': 1}), True)
+		self.assertEqual(fe.match({'m': 1.0}), False)
+		self.assertEqual(fe.match({'m': True}), False)
+		self.assertEqual(fe.match({'m': 1, 'other': 2}), True)
+		self.assertEqual(fe.result_cache().stats(), {'hits': 1, 'misses': 3, 'evictions': 0, 'size': 1024, 'length': 3})
+
+	def test_stats(self):
+		sieve = filter.Sieve.from_str('a == 1;\nb == 2;')
+		self.assertEqual(sieve.result_cache(), None)
+		sieve.cache_results(2)
+		for a in (1, 2, 1, 3, 1):
+			sieve.match({'a': a, 'b': 2})
+		self.assertEqual(sieve.result_cache().stats(), {'hits': 2, 'misses': 3, 'evictions': 1, 'size': 2, 'length': 2})
+		# an unusable value isn't cached, and raises every time
+		for i in range(2):
+			self.assertRaises(filter.SymbolExpansionTypeError, sieve.match, {'a': [1]})
+		self.assertEqual(sieve.result_cache().stats()['misses'], 3)
+		sieve.cache_results(0)
+		self.assertEqual(sieve.result_cache(), None)
+
+if __name__ == '__main__':
+	unittest.main()
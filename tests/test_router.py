@@ -0,0 +1,51 @@
+import unittest
+
+from hdslfilter import filter
+
+import corpus
+
+class RouterTests(unittest.TestCase):
+	"""A Router must give the names of the Sieves whose match is true for
+	a record, and raise what the first of them (by name) to raise does."""
+
+	def expected(self, sieves, record):
+		found = set()
+		for name in sorted(sieves.keys()):
+			result = corpus.outcome(sieves[name].match, record)
+			if result[0]=='raises':
+				return result
+			if result[2]:
+				found.add(name)
+		return ('value', type(found), found)
+
+	def check(self, sources):
+		sieves = dict([('s%03d' % i, filter.Sieve.from_str(src)) for (i, src) in enumerate(sources)])
+		router = filter.Router(sieves)
+		self.assertEqual(router.names(), sorted(sieves.keys()))
+		for record in corpus.records:
+			self.assertEqual(corpus.outcome(router.match, record), self.expected(sieves, record), repr(record))
+
+	def test_equivalence(self):
+		self.check(corpus.sieve_sources())
+
+	def test_each(self):
+		# each Sieve on its own, so that no other Sieve's exception hides
+		# its result
+		for src in corpus.sieve_sources() + corpus.pruned:
+			self.check([src])
+
+	def test_pruned(self):
+		self.check(corpus.pruned)
+
+	def test_shared(self):
+		sieves = {'x': filter.Sieve.from_str('m =~ /world/ and a == 1;'), 'y': filter.Sieve.from_str('m =~ /world/ and a == 2;')}
+		router = filter.Router(sieves)
+		self.assertEqual(router.match({'a': 2, 'm': 'hello world'}), set(['y']))
+		self.assertEqual(router.match({'a': 3, 'm': 'hello world'}), set())
+
+	def test_not_sieves(self):
+		self.assertRaises(TypeError, filter.Router, {'x': 'a == 1;'})
+		self.assertRaises(TypeError, filter.Router({}).match, [])
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,55 @@
+import unittest
+
+from hdslfilter import filter
+
+import corpus
+
+shared = [
+	'program == "sshd" and m =~ /fail/ and a == 1',
+	'program == "sshd" and m =~ /fail/ and a == 2',
+	'(m =~ p or b == "x") and a == 3',
+	'(m =~ p or b == "x") and a == 1',
+	'not (m =~ /fail/ and b == "x") and a == 4',
+	'm =~ /fail/ and b == "x"',
+]
+
+records = corpus.records + [
+	{'program': 'sshd', 'm': 'failed', 'a': 2, 'b': 'x', 'p': 'f'},
+	{'program': 'sshd', 'm': 'failed', 'a': 4, 'b': 'y', 'p': 5},
+	{'program': 'cron', 'm': 'ok', 'a': 1, 'b': 'x', 'p': '('},
+]
+
+class SharedSubtreeTests(unittest.TestCase):
+	"""Subtrees in several of a Sieve's expressions are evaluated once per
+	record, which must give the same results, and raise the same
+	exceptions, as evaluating the expressions one by one."""
+
+	def test_equivalence(self):
+		for adaptive in (False, True):
+			sieve = filter.Sieve.from_str(';\n'.join(shared) + ';', adaptive)
+			fes = sieve._filter_exprs
+			for record in records:
+				# twice, since values are only shared within one record
+				for i in range(2):
+					self.assertEqual(corpus.outcome(sieve.match, record),
+						corpus.outcome(lambda: corpus.first_match(fes, record) is not None), repr(record))
+					self.assertEqual(corpus.outcome(sieve.results, record),
+						corpus.outcome(lambda: [fe.match(record)==True for fe in fes]), repr(record))
+
+	def test_saved(self):
+		sieve = filter.Sieve.from_str(';\n'.join(shared) + ';')
+		self.assertEqual(sieve.saved_evaluations(), 0)
+		self.assertEqual(sieve.results({'program': 'sshd', 'm': 'failed', 'a': 5, 'b': 'x', 'p': 'f'}),
+			[False, False, False, False, False, True])
+		self.assertTrue(sieve.saved_evaluations() > 0)
+
+	def test_closure_engine(self):
+		# within one expression too
+		src = '(m =~ /fail/ and a == 1) or (m =~ /fail/ and a == 1 and b == 2) or not (m =~ /fail/ and a == 1)'
+		fe = filter.FilterExpression.from_string(src, engine='closure')
+		same = filter.FilterExpression.from_string(src)
+		for record in records:
+			self.assertEqual(corpus.outcome(fe.match, record), corpus.outcome(same.match, record), repr(record))
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,107 @@
+import os
+import re
+import shutil
+import tempfile
+import cPickle
+import thread
+import unittest
+
+from hdslfilter import cache
+from hdslfilter import filter
+from hdslfilter import snapshot
+
+import corpus
+
+class SnapshotTests(unittest.TestCase):
+
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.sieve_path = os.path.join(self.directory, 'test.sieve')
+		self.snapshot_path = os.path.join(self.directory, 'test.snap')
+		f = open(self.sieve_path, 'w')
+		f.write('a == 1;\nb =~ /x/;\n')
+		f.close()
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	def test_round_trip(self):
+		sieve = filter.Sieve.from_file(self.sieve_path, snapshot_path=self.snapshot_path)
+		self.assertEqual(sorted(os.listdir(self.directory)), ['test.sieve', 'test.snap'])
+		loaded = filter.Sieve.from_file(self.sieve_path, snapshot_path=self.snapshot_path)
+		self.assertEqual(loaded.match({'a': 2, 'b': 'yxy'}), sieve.match({'a': 2, 'b': 'yxy'}))
+
+	def test_unpicklable(self):
+		# pickling fails with PicklingError for some objects and TypeError
+		# for others; either way no temporary file is left behind
+		for (unpicklable, exception) in ((lambda: None, cPickle.PicklingError), (thread.allocate_lock(), TypeError)):
+			self.assertRaises(exception, snapshot.save, unpicklable, self.snapshot_path, 'key')
+			self.assertEqual(os.listdir(self.directory), ['test.sieve'])
+
+	def test_from_file_unpicklable(self):
+		# a snapshot which can't be written doesn't stop the sieve loading
+		save = snapshot.save
+		def failing_save(sieve, path, key):
+			save(lambda: None, path, key)
+		snapshot.save = failing_save
+		try:
+			sieve = filter.Sieve.from_file(self.sieve_path, snapshot_path=self.snapshot_path)
+		finally:
+			snapshot.save = save
+		self.assertEqual(sieve.match({'a': 1}), True)
+		self.assertEqual(os.listdir(self.directory), ['test.sieve'])
+
+	def test_key(self):
+		key = snapshot.key('a == 1;', 'path', False)
+		self.assertNotEqual(snapshot.key('a == 2;', 'path', False), key)
+		self.assertNotEqual(snapshot.key('a == 1;', 'path', True), key)
+		format_version = snapshot.format_version
+		snapshot.format_version += 1
+		try:
+			self.assertNotEqual(snapshot.key('a == 1;', 'path', False), key)
+		finally:
+			snapshot.format_version = format_version
+
+class LoadedSieveTests(unittest.TestCase):
+	"""A Sieve loaded from a snapshot must match as the one saved did,
+	without compiling its regexes until they're needed."""
+
+	def setUp(self):
+		self.saved = cache.regexes
+
+	def tearDown(self):
+		cache.regexes = self.saved
+
+	def test_equivalence(self):
+		for src in corpus.sieve_sources() + corpus.pruned:
+			sieve = filter.Sieve.from_str(src)
+			loaded = cPickle.loads(cPickle.dumps(sieve, cPickle.HIGHEST_PROTOCOL))
+			for record in corpus.records:
+				for method in ('match', 'match_bits', 'results'):
+					self.assertEqual(corpus.outcome(getattr(loaded, method), record), corpus.outcome(getattr(sieve, method), record),
+						'%s of %s on %r' % (method, src, record))
+				for (fe, loaded_fe) in zip(sieve._filter_exprs, loaded._filter_exprs):
+					self.assertEqual(corpus.outcome(loaded_fe.match, record), corpus.outcome(fe.match, record))
+
+	def test_no_compiles(self):
+		src = ''.join(['m =~ /x%d[ab]+y/ and a == %d;\nn =~ /^y%d(q|r)/;\n' % (i, i, i) for i in range(50)])
+		data = cPickle.dumps(filter.Sieve.from_str(src), cPickle.HIGHEST_PROTOCOL)
+		# none of the regexes are in the store, as in a new process
+		cache.regexes = cache.RegexStore(16)
+		loaded = cPickle.loads(data)
+		self.assertEqual(cache.regexes.stats()['compiles'], 0)
+		self.assertEqual(loaded.match({'m': 'x7aby', 'a': 7}), True)
+		self.assertEqual(loaded.match({'m': 'x7aby', 'a': 8, 'n': 'y7z'}), False)
+		self.assertEqual(loaded.match({'n': 'y7r'}), True)
+		# only the regexes which had to be searched for individually
+		self.assertTrue(0 < cache.regexes.stats()['compiles'] < 10)
+
+	def test_uncompileable(self):
+		loaded = cPickle.loads(cPickle.dumps(filter.Sieve.from_str('a == 1 or n =~ "(";\nn =~ "x";')))
+		self.assertEqual(loaded.match({'a': 1, 'n': 'x'}), True)
+		for i in range(2):
+			self.assertRaises(re.error, loaded.match, {'a': 2, 'n': 'x'})
+			self.assertRaises(re.error, loaded._filter_exprs[0].match, {'a': 2, 'n': 'x'})
+
+if __name__ == '__main__':
+	unittest.main()
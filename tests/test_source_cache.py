@@ -0,0 +1,59 @@
+import unittest
+
+from hdslfilter import cache
+from hdslfilter import filter
+
+import corpus
+
+class SourceCacheTests(unittest.TestCase):
+	"""from_string_cached and from_str_cached return the same object for
+	the same source code, which must match just as one built afresh."""
+
+	def setUp(self):
+		self.saved = (filter.FilterExpression.source_cache, filter.Sieve.source_cache)
+		filter.FilterExpression.source_cache = cache.SynchronizedLRUCache(4)
+		filter.Sieve.source_cache = cache.SynchronizedLRUCache(4)
+
+	def tearDown(self):
+		(filter.FilterExpression.source_cache, filter.Sieve.source_cache) = self.saved
+
+	def test_expressions(self):
+		fe = filter.FilterExpression.from_string_cached('a == 1')
+		self.assertTrue(filter.FilterExpression.from_string_cached(' a == 1\n') is fe)
+		self.assertTrue(filter.FilterExpression.from_string_cached('a==1') is not fe)
+		closure = filter.FilterExpression.from_string_cached('a == 1', engine='closure')
+		self.assertTrue(closure is not fe)
+		self.assertEqual(closure.engine(), 'closure')
+		self.assertEqual(filter.FilterExpression.source_cache.stats(), {'hits': 1, 'misses': 3, 'evictions': 0, 'size': 4, 'length': 3})
+
+	def test_sieves(self):
+		sieve = filter.Sieve.from_str_cached('a == 1;\nb == 2;')
+		self.assertTrue(filter.Sieve.from_str_cached('a == 1;\nb == 2;\n') is sieve)
+		self.assertTrue(filter.Sieve.from_str_cached('a == 1;\nb == 2;', adaptive=True) is not sieve)
+		self.assertEqual(filter.Sieve.source_cache.stats()['hits'], 1)
+
+	def test_evicted(self):
+		for i in range(5):
+			filter.FilterExpression.from_string_cached('a == %d' % i)
+		self.assertEqual(filter.FilterExpression.source_cache.stats()['evictions'], 1)
+		fe = filter.FilterExpression.from_string_cached('a == 0')
+		self.assertEqual(fe.match({'a': 0}), True)
+
+	def test_equivalence(self):
+		for src in corpus.expressions:
+			fe = filter.FilterExpression.from_string(src)
+			for i in range(2):
+				cached = filter.FilterExpression.from_string_cached(src)
+				for record in corpus.records:
+					self.assertEqual(corpus.outcome(cached.match, record), corpus.outcome(fe.match, record),
+						'%s on %r' % (src, record))
+
+	def test_errors(self):
+		# source code which doesn't compile raises every time, and isn't
+		# cached
+		for i in range(2):
+			self.assertRaises(Exception, filter.FilterExpression.from_string_cached, 'a ==')
+		self.assertEqual(len(filter.FilterExpression.source_cache), 0)
+
+if __name__ == '__main__':
+	unittest.main()
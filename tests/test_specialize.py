@@ -0,0 +1,65 @@
+import re
+import unittest
+
+from hdslfilter import filter
+
+import corpus
+
+# symbols bound by each test, with values taken from the records
+bindings = [
+	{'a': 1},
+	{'a': 2, 'b': 'y'},
+	{'m': 'hello world', 'p': 'wor'},
+	{'m': 'x', 'p': '('},
+	{'n': '('},
+	{'f': 10},
+	{'b': 'x', 'ip': '10.1.2.3'},
+]
+
+class SpecializeTests(unittest.TestCase):
+	"""A specialized Sieve must give the same results, and raise the same
+	exceptions, as the Sieve it was made from for every record in which
+	the bound symbols have their bound values."""
+
+	def check(self, src, bound):
+		sieve = filter.Sieve.from_str(src)
+		# specialized expressions keep the origin of theirs
+		for (i, fe) in enumerate(sieve._filter_exprs):
+			fe.origin = i
+		specialized = sieve.specialize(bound)
+		for record in corpus.records:
+			record = dict(record)
+			record.update(bound)
+			self.assertEqual(corpus.outcome(specialized.match, record), corpus.outcome(sieve.match, record),
+				'%s with %r on %r' % (src, bound, record))
+			expected = corpus.outcome(sieve.match_trace, record)
+			if expected[0]=='value':
+				(found, fe) = expected[2]
+				expected = (found, fe and fe.origin)
+				(found, fe) = specialized.match_trace(record)
+				self.assertEqual((found, fe and fe.origin), expected, '%s with %r on %r' % (src, bound, record))
+			else:
+				self.assertEqual(corpus.outcome(specialized.match_trace, record), expected)
+
+	def test_equivalence(self):
+		for bound in bindings:
+			for src in corpus.sieve_sources():
+				self.check(src, bound)
+
+	def test_folded(self):
+		sieve = filter.Sieve.from_str('a == 1 and b == "x";\na == 2;\nm =~ p;').specialize({'a': 1, 'm': 'hello', 'p': 'l+'})
+		self.assertEqual(len(sieve._filter_exprs), 2)
+		self.assertEqual(sieve.match({'a': 1, 'b': 'y', 'm': 'hello', 'p': 'l+'}), True)
+
+	def test_invalid_regex(self):
+		# a bound regex which doesn't compile is left to raise when it's
+		# evaluated
+		sieve = filter.Sieve.from_str('a == 1 or m =~ p;').specialize({'m': 'x', 'p': '('})
+		self.assertEqual(sieve.match({'a': 1, 'm': 'x', 'p': '('}), True)
+		self.assertRaises(re.error, sieve.match, {'a': 2, 'm': 'x', 'p': '('})
+
+	def test_bad_binding(self):
+		self.assertRaises(TypeError, filter.Sieve.from_str('a == 1;').specialize, {'a': [1]})
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,60 @@
+import unittest
+
+from hdslfilter import filter
+
+import corpus
+
+def changed_paths(before, after, prefix=''):
+	"""Return the paths of the parts of dict after which differ from
+	before, as deep as both are dicts."""
+	paths = []
+	for key in set(before.keys()) | set(after.keys()):
+		(old, new) = (before.get(key), after.get(key))
+		if type(old) is dict and type(new) is dict:
+			paths.extend(changed_paths(old, new, prefix + key + '.'))
+		elif key not in before or key not in after or old != new or type(old) is not type(new):
+			paths.append(prefix + key)
+	return paths
+
+class UpdateResultsTests(unittest.TestCase):
+	"""update_results must give what results would for the changed record,
+	and raise what it would."""
+
+	def check(self, src):
+		sieve = filter.Sieve.from_str(src)
+		for before in corpus.records:
+			outcome = corpus.outcome(sieve.results, before)
+			if outcome[0]=='raises':
+				continue
+			results = outcome[2]
+			for after in corpus.records:
+				changed = changed_paths(before, after)
+				self.assertEqual(corpus.outcome(sieve.update_results, after, results, changed), corpus.outcome(sieve.results, after),
+					'%s from %r to %r' % (src, before, after))
+
+	def test_equivalence(self):
+		for src in corpus.sieve_sources() + corpus.pruned:
+			self.check(src)
+
+	def test_paths(self):
+		sieve = filter.Sieve.from_str('geo.country == "US";\ngeo.city == "x";\ngeography == 1;\na == 1;')
+		fes = sieve._filter_exprs
+		self.assertEqual(sieve.dependents(['geo.country']), [fes[0]])
+		self.assertEqual(sieve.dependents(['geo']), fes[:2])
+		self.assertEqual(sieve.dependents(['geo.country.code']), [fes[0]])
+		self.assertEqual(sieve.dependents(['b']), [])
+		record = {'a': 1, 'geo': {'country': 'PL'}}
+		results = sieve.results(record)
+		self.assertEqual(results, [False, False, False, True])
+		record['geo']['country'] = 'US'
+		self.assertEqual(sieve.update_results(record, results, ['geo.country']), [True, False, False, True])
+		# nothing changed which the expressions use
+		self.assertEqual(sieve.update_results(record, results, ['b']), results)
+
+	def test_bad_arguments(self):
+		sieve = filter.Sieve.from_str('a == 1;')
+		self.assertRaises(ValueError, sieve.update_results, {}, [], ['a'])
+		self.assertRaises(TypeError, sieve.update_results, [], [False], ['a'])
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,86 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from hdslfilter import filter
+from hdslfilter import valuefile
+
+values = ['1', '2', 'x', 'John Doe', '', 0, 1, 2, 1.0, True, False, None, 'a', 'b', 'c', '# not a comment']
+
+class ListTests(unittest.TestCase):
+	"""'in' and 'not in' lists are held in frozensets, and must give the
+	same answers as python's list membership."""
+
+	def check(self, src, values_list, negated):
+		for engine in filter.FilterExpression.engines:
+			fe = filter.FilterExpression.from_string(src, engine=engine)
+			for value in values:
+				self.assertEqual(fe.match({'v': value}), (value in values_list) != negated, '%s on %r' % (src, value))
+
+	def test_lists(self):
+		self.check('v in ["1" "x" "John Doe"]', ['1', 'x', 'John Doe'], False)
+		self.check('v not in ["1" "x" "John Doe"]', ['1', 'x', 'John Doe'], True)
+		self.check('v in [1 2]', [1, 2], False)
+		self.check('v not in [0 2]', [0, 2], True)
+
+class ValueFileTests(unittest.TestCase):
+
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.path = self.write('hosts', '# blocked hosts\nb\n\n  a  \nc\n# not a comment\n')
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	def write(self, name, contents):
+		path = os.path.join(self.directory, name)
+		f = open(path, 'w')
+		f.write(contents)
+		f.close()
+		return path
+
+	def check(self, src, equivalent):
+		# a value file gives the same results as a list of its values
+		for engine in filter.FilterExpression.engines:
+			fe = filter.FilterExpression.from_string(src, engine=engine)
+			same = filter.FilterExpression.from_string(equivalent, engine=engine)
+			for value in values:
+				self.assertEqual(fe.match({'v': value}), same.match({'v': value}), '%s on %r' % (src, value))
+		sieve = filter.Sieve.from_str(src + ';')
+		for value in values:
+			self.assertEqual(sieve.match({'v': value}), same.match({'v': value}), '%s on %r' % (src, value))
+
+	def test_in(self):
+		self.check('v in @"%s"' % self.path, 'v in ["a" "b" "c"]')
+
+	def test_not_in(self):
+		self.check('v not in @"%s"' % self.path, 'v not in ["a" "b" "c"]')
+
+	def test_mapped(self):
+		# large files whose values are sorted are searched in place
+		threshold = valuefile.mmap_threshold
+		valuefile.mmap_threshold = 0
+		try:
+			path = self.write('sorted', 'a\nb\n# comment\nc\n')
+			self.assertEqual(valuefile.load(path).__class__, valuefile.MappedValueSet)
+			self.check('v in @"%s"' % path, 'v in ["a" "b" "c"]')
+		finally:
+			valuefile.mmap_threshold = threshold
+
+	def test_shared(self):
+		self.assertTrue(valuefile.load(self.path) is valuefile.load(self.path))
+
+	def test_changed(self):
+		# a changed file is read again by expressions built after the change
+		self.write('hosts', 'a\nb\nc\nd and more\n')
+		new = filter.FilterExpression.from_string('v in @"%s"' % self.path)
+		self.assertEqual(new.match({'v': 'd and more'}), True)
+
+	def test_missing(self):
+		src = 'v in @"%s"' % os.path.join(self.directory, 'missing')
+		for engine in filter.FilterExpression.engines:
+			self.assertRaises(Exception, filter.FilterExpression.from_string, src, engine=engine)
+
+if __name__ == '__main__':
+	unittest.main()